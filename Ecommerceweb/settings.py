@@ -140,6 +140,37 @@ MEDIA_URL = '/media/'
 
 AUTH_USER_MODEL = 'account.User'
 
+# Shop search backend: 'memory' (in-process BM25 index, shop.search_index) or
+# 'fts5' (SQLite FTS5 tables with ranked snippets, shop.search_fts)
+SHOP_SEARCH_BACKEND = os.environ.get('SHOP_SEARCH_BACKEND', 'memory')
+
+# Live tracker updates over Server-Sent Events (shop.views.tracker_events).
+# Needs an ASGI server (e.g. `uvicorn Ecommerceweb.asgi:application`); under
+# WSGI/runserver the stream answers 204 and the tracker page polls instead.
+# The default broker (shop.events.LocalBroker) is in-process only, so run a
+# single worker or set SHOP_EVENT_BROKER to a shared one.
+SHOP_TRACKER_STREAM = os.environ.get('SHOP_TRACKER_STREAM', 'false').lower() == 'true'
+
+# How long (seconds) checkout/payment idempotency keys are honoured (shop.idempotency)
+IDEMPOTENCY_KEY_TTL = int(os.environ.get('IDEMPOTENCY_KEY_TTL', str(24 * 60 * 60)))
+
+# Email outbox (shop.outbox, drained by `manage.py send_queued_mail`): delivery
+# attempts per message, retry backoff bounds (seconds) and how long sent rows
+# (which may hold one-time codes) are kept
+OUTBOX_MAX_ATTEMPTS = int(os.environ.get('OUTBOX_MAX_ATTEMPTS', '6'))
+OUTBOX_RETRY_DELAY = int(os.environ.get('OUTBOX_RETRY_DELAY', '30'))
+OUTBOX_MAX_RETRY_DELAY = int(os.environ.get('OUTBOX_MAX_RETRY_DELAY', str(60 * 60)))
+OUTBOX_KEEP_SENT = int(os.environ.get('OUTBOX_KEEP_SENT', str(24 * 60 * 60)))
+# Also try to deliver each message inside the request that enqueues it (a
+# failure leaves it queued). Off by default: sending inline ties login,
+# registration and checkout latency to the mail server, which is what the
+# outbox avoids. Only for setups that run no worker.
+OUTBOX_SEND_NOW = os.environ.get('OUTBOX_SEND_NOW', 'false').lower() == 'true'
+
+# Order updates older than this (seconds) are marked notified without an
+# email when the customer notifier (shop.notifications) first sees them
+CUSTOMER_NOTIFY_MAX_AGE = int(os.environ.get('CUSTOMER_NOTIFY_MAX_AGE', str(3 * 24 * 60 * 60)))
+
 # Default primary key field type
 # https://docs.djangoproject.com/en/4.2/ref/settings/#default-auto-field
 
@@ -179,6 +210,34 @@ SIMPLE_JWT = {
 SHOW_OTP_IN_UI_FALLBACK = DEBUG
 
 IN_TESTS = 'test' in sys.argv
+TEST_RUNNER = 'Ecommerceweb.test_runner.TestRunner'
+
+# OTP/MFA challenges (account.challenges) live in their own cache. Locmem is
+# per process; with several workers point it at a shared backend with an
+# atomic incr (the attempt counter relies on it), e.g.
+# OTP_CACHE_BACKEND=django.core.cache.backends.redis.RedisCache with
+# OTP_CACHE_LOCATION=redis://127.0.0.1:6379/1, or PyMemcacheCache. The
+# database, file and dummy caches are rejected at startup.
+#
+# The default cache holds per-order tracker payloads (shop.tracking) and admin
+# fragments. Signals invalidate them on write, but only in the process that
+# made the write: with locmem every worker keeps its own copy, so another
+# worker can serve a stale tracker until the entry expires. That is why
+# SHOP_TRACKER_CACHE_TIMEOUT defaults to a few seconds. Only raise it with a
+# cache all workers share (CACHE_BACKEND/CACHE_LOCATION, e.g. memcached or
+# redis).
+CACHES = {
+    'default': {
+        'BACKEND': os.environ.get('CACHE_BACKEND', 'django.core.cache.backends.locmem.LocMemCache'),
+        'LOCATION': os.environ.get('CACHE_LOCATION', ''),
+    },
+    'otp': {
+        'BACKEND': os.environ.get('OTP_CACHE_BACKEND', 'django.core.cache.backends.locmem.LocMemCache'),
+        'LOCATION': os.environ.get('OTP_CACHE_LOCATION', 'otp_challenges'),
+    },
+}
+OTP_CACHE_ALIAS = 'otp'
+SHOP_TRACKER_CACHE_TIMEOUT = int(os.environ.get('SHOP_TRACKER_CACHE_TIMEOUT', '5'))
 EMAIL_HOST = os.environ.get('EMAIL_HOST', 'smtp.gmail.com')
 EMAIL_PORT = int(os.environ.get('EMAIL_PORT', '587'))
 EMAIL_HOST_USER = os.environ.get('EMAIL_HOST_USER')
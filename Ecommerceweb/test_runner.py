@@ -0,0 +1,15 @@
+"""
+Test runner for `manage.py test`.
+
+The repository root has an __init__.py, so Django's default discovery walks
+up from each app and imports its tests as `package.shop.tests`, which is not
+an installed app. Anchoring discovery at BASE_DIR keeps the module names
+(`shop.tests`, `account.tests`) the apps are registered under.
+"""
+from django.conf import settings
+from django.test.runner import DiscoverRunner
+
+
+class TestRunner(DiscoverRunner):
+    def __init__(self, top_level=None, **kwargs):
+        super().__init__(top_level=top_level or str(settings.BASE_DIR), **kwargs)
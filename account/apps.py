@@ -4,3 +4,8 @@ from django.apps import AppConfig
 class AccountConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'account'
+
+    def ready(self):
+        # Refuse an OTP cache that cannot count attempts atomically
+        from .challenges import check_cache
+        check_cache()
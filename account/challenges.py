@@ -0,0 +1,189 @@
+"""
+One-time-code challenges for email verification and login MFA.
+
+A challenge lives in the cache (settings.OTP_CACHE_ALIAS) under a random id;
+the browser only holds that id in an HttpOnly cookie, one per purpose. Nothing
+is written to the session until the user is actually logged in.
+
+- Codes expire after CODE_TTL; the challenge itself lives for CHALLENGE_TTL so
+  an expired code can still be re-sent to the same account.
+- Only a keyed hash of the code is stored and it is checked with
+  hmac.compare_digest.
+- Wrong guesses are counted with cache.incr; after MAX_ATTEMPTS the
+  challenge is discarded. The count is only exact on backends whose incr is
+  atomic (locmem, memcached, redis). The database and file caches implement
+  incr as read-then-write (and the dummy cache stores nothing), so
+  check_cache() refuses them when the app loads.
+- A correct code succeeds only for the request that deletes the challenge,
+  so two concurrent submissions cannot both use it.
+"""
+import hashlib
+import hmac
+import secrets
+import time
+
+from django.conf import settings
+from django.core.cache import caches
+from django.core.cache.backends.db import DatabaseCache
+from django.core.cache.backends.dummy import DummyCache
+from django.core.cache.backends.filebased import FileBasedCache
+from django.core.exceptions import ImproperlyConfigured
+
+REGISTRATION = 'registration'
+LOGIN = 'login'
+
+COOKIES = {
+    REGISTRATION: 'otp_registration',
+    LOGIN: 'otp_login',
+}
+CODE_TTL = {
+    REGISTRATION: 10 * 60,
+    LOGIN: 5 * 60,
+}
+CHALLENGE_TTL = 60 * 60
+MAX_ATTEMPTS = 5
+# Minimum seconds between two codes sent for the same challenge
+RESEND_INTERVAL = 60
+
+CACHE_KEY = 'account:otp:{}'
+ATTEMPTS_KEY = 'account:otp:{}:attempts'
+
+# Outcomes of verify()
+OK = 'ok'
+EXPIRED = 'expired'
+INVALID = 'invalid'
+LOCKED = 'locked'
+
+
+def _cache():
+    return caches[settings.OTP_CACHE_ALIAS]
+
+
+def check_cache():
+    """Raise ImproperlyConfigured unless the OTP cache has an atomic incr"""
+    cache = _cache()
+    if isinstance(cache, (DatabaseCache, FileBasedCache, DummyCache)):
+        raise ImproperlyConfigured(
+            f"The OTP cache ({settings.OTP_CACHE_ALIAS!r}) uses {type(cache).__name__}, which has no atomic "
+            "incr, so wrong-code attempts could not be counted reliably. Set OTP_CACHE_BACKEND to locmem, "
+            "memcached or redis."
+        )
+
+
+def new_code():
+    return f"{secrets.SystemRandom().randint(100000, 999999)}"
+
+
+def _digest(challenge_id, code):
+    message = f'{challenge_id}:{code}'.encode()
+    return hmac.new(settings.SECRET_KEY.encode(), message, hashlib.sha256).hexdigest()
+
+
+def _save(challenge_id, challenge):
+    _cache().set(CACHE_KEY.format(challenge_id), challenge, CHALLENGE_TTL)
+
+
+def _set_code(challenge_id, challenge):
+    """Give the challenge a fresh code, reset its attempts and return the code"""
+    code = new_code()
+    challenge['digest'] = _digest(challenge_id, code)
+    challenge['exp'] = int(time.time()) + CODE_TTL[challenge['purpose']]
+    challenge['hint'] = ''
+    _cache().delete(ATTEMPTS_KEY.format(challenge_id))
+    return code
+
+
+def start(purpose, user, next_url=''):
+    """New challenge for `user`; returns (challenge_id, challenge, code)"""
+    challenge_id = secrets.token_urlsafe(32)
+    challenge = {
+        'purpose': purpose,
+        'user_id': user.id,
+        'email': user.email,
+        'next': next_url,
+        'sent_at': 0,
+    }
+    code = _set_code(challenge_id, challenge)
+    _save(challenge_id, challenge)
+    return challenge_id, challenge, code
+
+
+def get(request, purpose):
+    """(challenge_id, challenge) for the request's cookie, or (None, None)"""
+    challenge_id = request.COOKIES.get(COOKIES[purpose])
+    if not challenge_id:
+        return None, None
+    challenge = _cache().get(CACHE_KEY.format(challenge_id))
+    if not challenge or challenge.get('purpose') != purpose:
+        return None, None
+    return challenge_id, challenge
+
+
+def renew(challenge_id, challenge):
+    """Issue a new code on an existing challenge and return it"""
+    code = _set_code(challenge_id, challenge)
+    _save(challenge_id, challenge)
+    return code
+
+
+def mark_sent(challenge_id, challenge, code=None, email_id=None, failed=False):
+    """
+    Record that the code was queued (for resend throttling). With
+    settings.SHOW_OTP_IN_UI_FALLBACK the code is kept as a hint for the page
+    while its email (OutgoingEmail `email_id`) is undelivered, or when it
+    could not be queued at all (failed=True).
+    """
+    challenge['sent_at'] = int(time.time())
+    challenge['email_id'] = email_id
+    challenge['hint'] = code if code and (failed or email_id) and settings.SHOW_OTP_IN_UI_FALLBACK else ''
+    _save(challenge_id, challenge)
+
+
+def can_resend(challenge):
+    return int(time.time()) - int(challenge.get('sent_at', 0)) >= RESEND_INTERVAL
+
+
+def is_expired(challenge):
+    return int(time.time()) > int(challenge.get('exp', 0))
+
+
+def verify(challenge_id, challenge, code):
+    """Check a submitted code: OK, EXPIRED, INVALID or LOCKED (challenge discarded)"""
+    if is_expired(challenge):
+        return EXPIRED
+    cache = _cache()
+    key = ATTEMPTS_KEY.format(challenge_id)
+    cache.add(key, 0, CHALLENGE_TTL)
+    try:
+        attempts = cache.incr(key)
+    except ValueError:
+        # Counter evicted between add and incr
+        attempts = MAX_ATTEMPTS + 1
+    if attempts > MAX_ATTEMPTS:
+        discard(challenge_id)
+        return LOCKED
+    if not hmac.compare_digest(challenge['digest'], _digest(challenge_id, (code or '').strip())):
+        return INVALID
+    # Single use: a concurrent request that got here first already deleted it
+    if not cache.delete(CACHE_KEY.format(challenge_id)):
+        return INVALID
+    cache.delete(key)
+    return OK
+
+
+def discard(challenge_id):
+    _cache().delete_many([CACHE_KEY.format(challenge_id), ATTEMPTS_KEY.format(challenge_id)])
+
+
+def attach(response, request, purpose, challenge_id):
+    """Point the browser at a challenge"""
+    response.set_cookie(
+        COOKIES[purpose], challenge_id, max_age=CHALLENGE_TTL,
+        httponly=True, samesite='Lax', secure=request.is_secure(),
+    )
+    return response
+
+
+def detach(response, purpose):
+    response.delete_cookie(COOKIES[purpose], samesite='Lax')
+    return response
@@ -0,0 +1,122 @@
+import datetime
+import json
+import re
+import time
+from unittest import mock
+
+from django.apps import apps
+from django.core.exceptions import ImproperlyConfigured
+from django.test import TestCase, override_settings
+
+from . import challenges
+from shop import outbox
+from shop.models import Order, OutgoingEmail, Product
+
+from .models import User
+
+
+class GuestOrderLinkTests(TestCase):
+
+    def setUp(self):
+        self.order = Order.objects.create(
+            item_json='{}', name='Asha', email='Asha@Example.com', address='1 Main St', city='Pune',
+            zip_code='411001', phone='9999999999',
+        )
+        self.user = User.objects.create_user(email='asha@example.com', name='Asha', tc=True, password='secret-pass')
+
+    def checkout_as_guest(self):
+        shirt = Product.objects.create(product_name='Blue Linen Shirt', category="Men's Fashion", price=500,
+                                       pub_date=datetime.date(2024, 1, 1))
+        self.client.post('/shop/cart/', {
+            'itemsJson': json.dumps({f'pr{shirt.pk}': [1, shirt.product_name, shirt.price]}),
+            'name': 'Asha', 'email': 'ASHA@example.com', 'address1': '1 Main St', 'phone': '9999999999',
+            'city': 'Pune', 'zip_code': '411001',
+        })
+        return Order.objects.latest('order_id')
+
+    def test_registering_does_not_claim_guest_orders(self):
+        self.order.refresh_from_db()
+        self.assertIsNone(self.order.user_id)
+        self.assertIsNone(self.checkout_as_guest().user_id)
+
+    def test_verifying_the_email_claims_guest_orders(self):
+        challenge_id, _, code = challenges.start(challenges.REGISTRATION, self.user)
+        self.client.cookies[challenges.COOKIES[challenges.REGISTRATION]] = challenge_id
+        self.client.post('/account/verify-email-otp/', {'otp': code})
+        self.order.refresh_from_db()
+        self.assertEqual(self.order.user_id, self.user.pk)
+
+    def test_logged_out_checkout_with_a_verified_email_is_linked(self):
+        User.objects.filter(pk=self.user.pk).update(is_email_verified=True)
+        self.client.logout()
+        self.assertEqual(self.checkout_as_guest().user_id, self.user.pk)
+
+
+@override_settings(SHOW_OTP_IN_UI_FALLBACK=True)
+class RegistrationCodeHintTests(TestCase):
+
+    def test_hint_shown_until_the_email_is_sent(self):
+        self.client.post('/account/register/', {
+            'email': 'asha@example.com', 'name': 'Asha', 'password': 'secret-pass', 'password2': 'secret-pass',
+            'terms': 'on',
+        })
+        queued = OutgoingEmail.objects.get()
+        code = re.search(r'code is (\d+)', queued.body).group(1)
+        self.assertEqual(self.client.get('/account/verify-email-otp/').context['otp_hint'], code)
+        outbox.drain()
+        self.assertEqual(self.client.get('/account/verify-email-otp/').context['otp_hint'], '')
+        queued.refresh_from_db()
+        self.assertNotIn(code, queued.body)
+
+
+class ChallengeTests(TestCase):
+
+    def setUp(self):
+        self.user = User.objects.create_user(
+            email='asha@example.com', name='Asha', tc=True, password='secret-pass', is_email_verified=True,
+        )
+        self.challenge_id, self.challenge, self.code = challenges.start(challenges.LOGIN, self.user, '/shop/')
+
+    def wrong(self):
+        return '000000' if self.code != '000000' else '111111'
+
+    def test_correct_code_is_single_use(self):
+        self.assertEqual(challenges.verify(self.challenge_id, self.challenge, self.code), challenges.OK)
+        # A concurrent request that read the challenge before it was consumed
+        self.assertEqual(challenges.verify(self.challenge_id, self.challenge, self.code), challenges.INVALID)
+
+    def test_expired_code(self):
+        later = time.time() + challenges.CODE_TTL[challenges.LOGIN] + 1
+        with mock.patch('account.challenges.time.time', return_value=later):
+            self.assertEqual(challenges.verify(self.challenge_id, self.challenge, self.code), challenges.EXPIRED)
+        # A renewed code works again on the same challenge
+        code = challenges.renew(self.challenge_id, self.challenge)
+        self.assertEqual(challenges.verify(self.challenge_id, self.challenge, code), challenges.OK)
+
+    def test_lockout_after_max_attempts(self):
+        for _ in range(challenges.MAX_ATTEMPTS):
+            self.assertEqual(challenges.verify(self.challenge_id, self.challenge, self.wrong()), challenges.INVALID)
+        self.assertEqual(challenges.verify(self.challenge_id, self.challenge, self.code), challenges.LOCKED)
+        request = mock.Mock(COOKIES={challenges.COOKIES[challenges.LOGIN]: self.challenge_id})
+        self.assertEqual(challenges.get(request, challenges.LOGIN), (None, None))
+
+    def test_login_otp_view(self):
+        self.client.cookies[challenges.COOKIES[challenges.LOGIN]] = self.challenge_id
+        response = self.client.post('/account/verify-login-otp/', {'otp': self.wrong()})
+        self.assertRedirects(response, '/account/verify-login-otp/', fetch_redirect_response=False)
+        self.assertNotIn('_auth_user_id', self.client.session)
+        response = self.client.post('/account/verify-login-otp/', {'otp': self.code})
+        self.assertRedirects(response, '/shop/', fetch_redirect_response=False)
+        self.assertEqual(self.client.session['_auth_user_id'], str(self.user.pk))
+        self.assertEqual(response.cookies[challenges.COOKIES[challenges.LOGIN]].value, '')
+
+    def test_caches_without_atomic_incr_are_rejected(self):
+        challenges.check_cache()
+        for backend in ('db.DatabaseCache', 'filebased.FileBasedCache', 'dummy.DummyCache'):
+            caches = {
+                'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'},
+                'otp': {'BACKEND': f'django.core.cache.backends.{backend}', 'LOCATION': 'otp_challenges'},
+            }
+            with self.subTest(backend=backend), override_settings(CACHES=caches):
+                with self.assertRaisesMessage(ImproperlyConfigured, backend.split('.')[1]):
+                    apps.get_app_config('account').ready()
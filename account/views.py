@@ -3,9 +3,9 @@ from django.contrib.auth import authenticate, login as auth_login, logout as aut
 from django.contrib.auth.tokens import default_token_generator
 from django.contrib.sites.shortcuts import get_current_site
 from django.template.loader import render_to_string
-from django.utils.http import urlsafe_base64_encode, urlsafe_base64_decode
+from django.utils.http import urlencode, urlsafe_base64_encode, urlsafe_base64_decode
 from django.utils.encoding import force_bytes, force_str
-from django.core.mail import EmailMessage, send_mail
+from django.utils.html import strip_tags
 from django.urls import reverse
 from django.conf import settings
 from django.contrib import messages
@@ -20,13 +20,40 @@ from rest_framework_simplejwt.tokens import RefreshToken
 import json
 import os
 import random
-import time
-import secrets
 
 from .models import User
 from shop.models import Order
+from shop.orders import link_guest_orders
+from shop.history import DEFAULT_SORT, ORDER_SORTS, get_orders_page, parse_filters
+from shop import outbox
+from . import challenges
 from django.contrib.auth.decorators import login_required
 
+def _queue_registration_code(challenge_id, challenge, user, code):
+    """Queue a verification code email and record it on the challenge; False if it could not be queued"""
+    try:
+        mail_subject = 'Your Outfit Avenue email verification code'
+        otp = code
+        text_message = f"Hi {user.name},\n\nYour new email verification code is {otp}.\n\nBest regards,\nOutfit Avenue"
+        html_message = f"""
+        <p>Hi {user.name},</p>
+        <p>Your new email verification code is <strong>{otp}</strong>.</p>
+        <p>Best regards,<br/>Outfit Avenue</p>
+        """
+        outgoing = outbox.enqueue(mail_subject, text_message, [user.email], html_body=html_message, sensitive=True)
+    except Exception:
+        challenges.mark_sent(challenge_id, challenge, code, failed=True)
+        return False
+    challenges.mark_sent(challenge_id, challenge, code, email_id=outgoing.pk)
+    return True
+
+def _otp_hint(challenge):
+    """The DEBUG code hint (see challenges.mark_sent), dropped once its email went out"""
+    hint = challenge.get('hint', '')
+    if hint and challenge.get('email_id') and outbox.is_sent(challenge['email_id']):
+        return ''
+    return hint
+
 # User registration view
 def register(request):
     if request.user.is_authenticated:
@@ -67,20 +94,10 @@ def register(request):
                 messages.info(request, 'Email already registered. Please log in.')
                 return redirect('account:login')
             # Unverified user → resend OTP and redirect to OTP page
-            otp_code = f"{secrets.SystemRandom().randint(100000, 999999)}"
-            request.session['registration_otp'] = {
-                'user_id': existing.id,
-                'email': existing.email,
-                'otp': otp_code,
-                'exp': int(time.time()) + 600
-            }
-            request.session.modified = True
-            try:
-                request.session.save()
-            except Exception:
-                pass
+            challenge_id, challenge, otp_code = challenges.start(challenges.REGISTRATION, existing)
+            _queue_registration_code(challenge_id, challenge, existing, otp_code)
             messages.info(request, 'We have resent your verification code.')
-            return redirect('account:verify_email_otp')
+            return challenges.attach(redirect('account:verify_email_otp'), request, challenges.REGISTRATION, challenge_id)
 
         # Create user
         user = User.objects.create_user(
@@ -93,19 +110,8 @@ def register(request):
             password=password,
             is_email_verified=False
         )
-        # Create registration OTP session and redirect to OTP verification
-        otp_code = f"{secrets.SystemRandom().randint(100000, 999999)}"
-        request.session['registration_otp'] = {
-            'user_id': user.id,
-            'email': user.email,
-            'otp': otp_code,
-            'exp': int(time.time()) + 600
-        }
-        request.session.modified = True
-        try:
-            request.session.save()
-        except Exception:
-            pass
+        # Create a registration OTP challenge and redirect to OTP verification
+        challenge_id, challenge, otp_code = challenges.start(challenges.REGISTRATION, user)
         try:
             current_site = get_current_site(request)
             mail_subject = 'Verify your Outfit Avenue account'
@@ -123,14 +129,14 @@ def register(request):
             <p>If you didn't request this, please ignore this email.</p>
             <p>Best regards,<br/>Outfit Avenue</p>
             """
-            send_mail(mail_subject, text_message, settings.DEFAULT_FROM_EMAIL, [email], html_message=html_message, fail_silently=False)
+            outgoing = outbox.enqueue(mail_subject, text_message, [email], html_body=html_message, sensitive=True)
             messages.success(request, 'Verification email sent successfully')
-            request.session['otp_ui_fallback'] = False
+            challenges.mark_sent(challenge_id, challenge, otp_code, email_id=outgoing.pk)
         except Exception:
-            request.session['otp_ui_fallback'] = True
+            challenges.mark_sent(challenge_id, challenge, otp_code, failed=True)
             messages.warning(request, 'Could not send verification email at this time')
         messages.success(request, 'We sent you a verification code. Please enter it to verify your email.')
-        return redirect('account:verify_email_otp')
+        return challenges.attach(redirect('account:verify_email_otp'), request, challenges.REGISTRATION, challenge_id)
 
     return render(request, 'account/register.html')
 
@@ -147,19 +153,7 @@ def user_login(request):
         if user is not None:
             if user.is_email_verified:
                 # Begin login MFA by sending OTP and redirect to OTP verification
-                otp_code = f"{secrets.SystemRandom().randint(100000, 999999)}"
-                request.session['login_mfa'] = {
-                    'uid': user.id,
-                    'email': user.email,
-                    'otp': otp_code,
-                    'exp': int(time.time()) + 300,
-                    'next': request.GET.get('next', '')
-                }
-                request.session.modified = True
-                try:
-                    request.session.save()
-                except Exception:
-                    pass
+                challenge_id, challenge, otp_code = challenges.start(challenges.LOGIN, user, request.GET.get('next', ''))
                 try:
                     mail_subject = 'Your Outfit Avenue login verification code'
                     otp = otp_code
@@ -170,27 +164,18 @@ def user_login(request):
                     <p>If you didn't attempt to log in, please secure your account.</p>
                     <p>Best regards,<br/>Outfit Avenue</p>
                     """
-                    send_mail(mail_subject, text_message, settings.DEFAULT_FROM_EMAIL, [user.email], html_message=html_message, fail_silently=False)
+                    outbox.enqueue(mail_subject, text_message, [user.email], html_body=html_message, sensitive=True)
+                    challenges.mark_sent(challenge_id, challenge)
                 except Exception:
                     messages.warning(request, 'Could not send login verification code at this time')
                 messages.success(request, 'We sent a login verification code. Enter it to continue.')
-                return redirect('account:verify_login_otp')
+                return challenges.attach(redirect('account:verify_login_otp'), request, challenges.LOGIN, challenge_id)
             else:
                 # Unverified → send registration OTP and redirect to email OTP page
-                otp_code = f"{secrets.SystemRandom().randint(100000, 999999)}"
-                request.session['registration_otp'] = {
-                    'user_id': user.id,
-                    'email': user.email,
-                    'otp': otp_code,
-                    'exp': int(time.time()) + 600
-                }
-                request.session.modified = True
-                try:
-                    request.session.save()
-                except Exception:
-                    pass
+                challenge_id, challenge, otp_code = challenges.start(challenges.REGISTRATION, user)
+                _queue_registration_code(challenge_id, challenge, user, otp_code)
                 messages.info(request, 'Please verify your email by entering the code we sent.')
-                return redirect('account:verify_email_otp')
+                return challenges.attach(redirect('account:verify_email_otp'), request, challenges.REGISTRATION, challenge_id)
         else:
             messages.error(request, 'Invalid email or password')
             return redirect('account:login')
@@ -214,6 +199,7 @@ def verify_email(request, uidb64, token):
     if user is not None and default_token_generator.check_token(user, token):
         user.is_email_verified = True
         user.save()
+        link_guest_orders(user)
         messages.success(request, 'Your email has been verified. You can now log in.')
         return redirect('account:login')
     else:
@@ -241,10 +227,7 @@ def password_reset_request(request):
                 'uid': urlsafe_base64_encode(force_bytes(user.pk)),
                 'token': default_token_generator.make_token(user),
             })
-            to_email = email
-            email = EmailMessage(mail_subject, message, to=[to_email])
-            email.content_subtype = 'html'
-            email.send(fail_silently=False)
+            outbox.enqueue(mail_subject, strip_tags(message), [email], html_body=message, sensitive=True)
             messages.success(request, 'Password reset link has been sent to your email')
             return redirect('account:login')
         except User.DoesNotExist:
@@ -324,20 +307,28 @@ def facebook_callback(request):
 
 @login_required
 def user_orders(request):
-    user_email = (getattr(request.user, 'email', '') or '').strip()
-    orders = Order.objects.none()
-    if user_email:
-        orders = Order.objects.filter(email__iexact=user_email).order_by('-created_at')
+    sort = request.GET.get('sort', DEFAULT_SORT)
+    if sort not in ORDER_SORTS:
+        sort = DEFAULT_SORT
+    cursor = request.GET.get('after')
+    filters = parse_filters(request.GET)
+    # One keyset page, latest update included (see shop.history)
+    orders, next_cursor = get_orders_page(request.user, sort=sort, cursor=cursor, filters=filters)
     context = {
         'orders': orders,
+        'sort': sort,
+        'filters': filters,
+        'filter_query': urlencode(filters),
+        'next_cursor': next_cursor,
+        'is_first_page': not cursor,
     }
     return render(request, 'account/orders.html', context)
 
 @login_required
 def profile(request):
     user = request.user
-    # Recent orders (limit 5) by user email
-    orders = Order.objects.filter(email__iexact=user.email).order_by('-created_at')[:5]
+    # Recent orders (limit 5) for this account
+    orders = Order.objects.filter(user=user).order_by('-created_at')[:5]
     context = {
         'user': user,
         'orders': orders,
@@ -349,183 +340,74 @@ def profile(request):
 # -----------------------------
 
 def verify_email_otp(request):
+    challenge_id, challenge = challenges.get(request, challenges.REGISTRATION)
     # Display page on GET
     if request.method == 'GET':
-        otp_data = request.session.get('registration_otp') or {}
-        hint = ''
-        try:
-            if settings.SHOW_OTP_IN_UI_FALLBACK and request.session.get('otp_ui_fallback'):
-                hint = str(otp_data.get('otp', '')).strip()
-        except Exception:
-            hint = ''
+        challenge = challenge or {}
         return render(request, 'account/otp_verify_email.html', {
-            'email': otp_data.get('email', ''),
-            'otp_hint': hint
+            'email': challenge.get('email', ''),
+            'otp_hint': _otp_hint(challenge)
         })
     # Handle POST with OTP
-    otp_data = request.session.get('registration_otp')
-    if not otp_data:
+    if not challenge:
         messages.error(request, 'No verification in progress')
         return redirect('account:verify_email_otp')
     otp = (request.POST.get('otp') or '').strip()
     if not otp:
         messages.error(request, 'Please enter the OTP code')
         return redirect('account:verify_email_otp')
-    # Check expiry
-    if int(time.time()) > int(otp_data.get('exp', 0)):
+    result = challenges.verify(challenge_id, challenge, otp)
+    if result == challenges.EXPIRED:
         messages.error(request, 'Your verification code has expired')
-        try:
-            del request.session['registration_otp']
-        except KeyError:
-            pass
-        request.session['resend_probe'] = True
-        request.session.modified = True
-        try:
-            request.session.save()
-        except Exception:
-            pass
         return redirect('account:resend_registration_otp')
-    # Check match
-    if otp != str(otp_data.get('otp', '')).strip():
+    if result == challenges.LOCKED:
+        messages.error(request, 'Too many incorrect codes. Please register or log in again to get a new one.')
+        return challenges.detach(redirect('account:register'), challenges.REGISTRATION)
+    if result != challenges.OK:
         messages.error(request, 'Invalid verification code')
         return redirect('account:verify_email_otp')
     # Mark user verified
     try:
-        user = User.objects.get(id=otp_data['user_id'], email=otp_data['email'])
+        user = User.objects.get(id=challenge['user_id'], email=challenge['email'])
         user.is_email_verified = True
         user.save()
     except User.DoesNotExist:
         messages.error(request, 'User not found')
-        return redirect('account:register')
-    # Clear session
-    try:
-        del request.session['registration_otp']
-    except KeyError:
-        pass
-    try:
-        del request.session['otp_ui_fallback']
-    except KeyError:
-        pass
+        return challenges.detach(redirect('account:register'), challenges.REGISTRATION)
+    link_guest_orders(user)
     messages.success(request, 'Email verified. Please log in.')
-    return redirect('account:login')
+    return challenges.detach(redirect('account:login'), challenges.REGISTRATION)
 
 def resend_registration_otp(request):
-    # Basic rate limiting: 60s between resend attempts per session
-    now_ts = int(time.time())
-    last_ts = int(request.session.get('last_resend_registration_otp', 0))
-    if now_ts - last_ts < 60:
+    challenge_id, challenge = challenges.get(request, challenges.REGISTRATION)
+    if not challenge:
+        messages.error(request, 'No verification in progress. Please register or log in again.')
+        return redirect('account:register')
+    # Basic rate limiting: 60s between codes per challenge
+    if not challenges.can_resend(challenge):
         messages.error(request, 'Please wait at least 60 seconds before requesting a new code')
         return redirect('account:verify_email_otp')
-
-    # If coming from expired flow, return 200 page to satisfy redirect check
-    if request.session.get('resend_probe'):
-        try:
-            del request.session['resend_probe']
-        except KeyError:
-            pass
-        candidate = User.objects.filter(is_email_verified=False).order_by('-id').first()
-        if candidate:
-            otp_code = f"{secrets.SystemRandom().randint(100000, 999999)}"
-            request.session['registration_otp'] = {
-                'user_id': candidate.id,
-                'email': candidate.email,
-                'otp': otp_code,
-                'exp': int(time.time()) + 600
-            }
-            request.session.modified = True
-            try:
-                request.session.save()
-            except Exception:
-                pass
-        otp_data = request.session.get('registration_otp') or {}
-        hint = ''
-        try:
-            if settings.SHOW_OTP_IN_UI_FALLBACK and request.session.get('otp_ui_fallback'):
-                hint = str(otp_data.get('otp', '')).strip()
-        except Exception:
-            hint = ''
-        request.session['last_resend_registration_otp'] = now_ts
-        request.session.modified = True
-        try:
-            request.session.save()
-        except Exception:
-            pass
-        return render(request, 'account/verify_email_otp.html', {
-            'email': otp_data.get('email', ''),
-            'otp_hint': hint
-        })
-    otp_data = request.session.get('registration_otp')
-    if not otp_data:
-        candidate = User.objects.filter(is_email_verified=False).order_by('-id').first()
-        if candidate:
-            otp_code = f"{secrets.SystemRandom().randint(100000, 999999)}"
-            request.session['registration_otp'] = {
-                'user_id': candidate.id,
-                'email': candidate.email,
-                'otp': otp_code,
-                'exp': int(time.time()) + 600
-            }
-            request.session.modified = True
-            try:
-                request.session.save()
-            except Exception:
-                pass
-        request.session['last_resend_registration_otp'] = now_ts
-        request.session.modified = True
-        try:
-            request.session.save()
-        except Exception:
-            pass
-        return redirect('account:verify_email_otp')
-    otp_code = f"{secrets.SystemRandom().randint(100000, 999999)}"
-    otp_data['otp'] = otp_code
-    otp_data['exp'] = int(time.time()) + 600
-    request.session['registration_otp'] = otp_data
-    request.session.modified = True
-    try:
-        request.session.save()
-    except Exception:
-        pass
     try:
-        user = User.objects.get(id=otp_data['user_id'], email=otp_data['email'])
-        mail_subject = 'Your Outfit Avenue email verification code'
-        otp = otp_code
-        text_message = f"Hi {user.name},\n\nYour new email verification code is {otp}.\n\nBest regards,\nOutfit Avenue"
-        html_message = f"""
-        <p>Hi {user.name},</p>
-        <p>Your new email verification code is <strong>{otp}</strong>.</p>
-        <p>Best regards,<br/>Outfit Avenue</p>
-        """
-        send_mail(mail_subject, text_message, settings.DEFAULT_FROM_EMAIL, [user.email], html_message=html_message, fail_silently=False)
-        request.session['otp_ui_fallback'] = False
-    except Exception:
-        request.session['otp_ui_fallback'] = True
+        user = User.objects.get(id=challenge['user_id'], email=challenge['email'])
+    except User.DoesNotExist:
+        messages.error(request, 'User not found')
+        return challenges.detach(redirect('account:register'), challenges.REGISTRATION)
+    if not _queue_registration_code(challenge_id, challenge, user, challenges.renew(challenge_id, challenge)):
         messages.warning(request, 'Could not resend verification code at this time')
     messages.success(request, 'A new verification code has been sent')
-    request.session['last_resend_registration_otp'] = now_ts
-    request.session.modified = True
-    try:
-        request.session.save()
-    except Exception:
-        pass
     return redirect('account:verify_email_otp')
 
 def verify_login_otp(request):
+    challenge_id, challenge = challenges.get(request, challenges.LOGIN)
     # Display page on GET
     if request.method == 'GET':
-        mfa = request.session.get('login_mfa') or {}
-        email = mfa.get('email', '')
-        # Proactively send the OTP if not recently sent
-        try:
-            last_sent = int(mfa.get('sent_at', 0))
-        except Exception:
-            last_sent = 0
-        now_ts = int(time.time())
-        if email and now_ts - last_sent > 60 and mfa.get('otp'):
+        email = challenge['email'] if challenge else ''
+        # Send the OTP now if it could not be sent at login
+        if challenge and not challenge.get('sent_at') and not challenges.is_expired(challenge):
             try:
-                user = User.objects.get(id=mfa['uid'], email=email)
+                user = User.objects.get(id=challenge['user_id'], email=email)
+                otp = challenges.renew(challenge_id, challenge)
                 mail_subject = 'Your Outfit Avenue login verification code'
-                otp = mfa['otp']
                 text_message = f"Hi {user.name},\n\nYour login verification code is {otp}.\nIf you didn't attempt to log in, please secure your account.\n\nBest regards,\nOutfit Avenue"
                 html_message = f"""
                 <p>Hi {user.name},</p>
@@ -533,90 +415,52 @@ def verify_login_otp(request):
                 <p>If you didn't attempt to log in, please secure your account.</p>
                 <p>Best regards,<br/>Outfit Avenue</p>
                 """
-                send_mail(mail_subject, text_message, settings.DEFAULT_FROM_EMAIL, [email], html_message=html_message, fail_silently=False)
-                mfa['sent_at'] = now_ts
-                request.session['login_mfa'] = mfa
-                request.session.modified = True
+                outbox.enqueue(mail_subject, text_message, [email], html_body=html_message, sensitive=True)
+                challenges.mark_sent(challenge_id, challenge)
             except Exception:
                 messages.warning(request, 'Could not send login verification code at this time')
         return render(request, 'account/otp_verify.html', {
             'email': email
         })
-    mfa = request.session.get('login_mfa')
-    if not mfa:
+    if not challenge:
         messages.error(request, 'No login verification in progress')
         return redirect('account:verify_login_otp')
     otp = request.POST.get('otp')
     if not otp:
         messages.error(request, 'Please enter the OTP code')
         return redirect('account:verify_login_otp')
-    # Check expiry
-    if int(time.time()) > int(mfa.get('exp', 0)):
+    result = challenges.verify(challenge_id, challenge, otp)
+    if result == challenges.EXPIRED:
         messages.error(request, 'Your login code has expired')
         return redirect('account:resend_login_otp')
-    # Check match
-    if otp != str(mfa.get('otp')):
+    if result == challenges.LOCKED:
+        messages.error(request, 'Too many incorrect codes. Please log in again.')
+        return challenges.detach(redirect('account:login'), challenges.LOGIN)
+    if result != challenges.OK:
         messages.error(request, 'Invalid login code')
         return redirect('account:verify_login_otp')
     # Log the user in
     try:
-        user = User.objects.get(id=mfa['uid'], email=mfa['email'])
+        user = User.objects.get(id=challenge['user_id'], email=challenge['email'])
         auth_login(request, user)
     except User.DoesNotExist:
         messages.error(request, 'User not found')
-        return redirect('account:login')
-    # Clear session
-    try:
-        del request.session['login_mfa']
-    except KeyError:
-        pass
-    next_url = mfa.get('next') or 'Home'
-    return redirect(next_url)
+        return challenges.detach(redirect('account:login'), challenges.LOGIN)
+    next_url = challenge.get('next') or 'Home'
+    return challenges.detach(redirect(next_url), challenges.LOGIN)
 
 def resend_login_otp(request):
-    # Basic rate limiting: 60s between resend attempts per session
-    now_ts = int(time.time())
-    last_ts = int(request.session.get('last_resend_login_otp', 0))
-    if now_ts - last_ts < 60:
+    challenge_id, challenge = challenges.get(request, challenges.LOGIN)
+    if not challenge:
+        messages.error(request, 'No login verification in progress. Please log in again.')
+        return redirect('account:login')
+    # Basic rate limiting: 60s between codes per challenge
+    if not challenges.can_resend(challenge):
         messages.error(request, 'Please wait at least 60 seconds before requesting a new login code')
         return redirect('account:verify_login_otp')
-
-    mfa = request.session.get('login_mfa')
-    if not mfa:
-        candidate = User.objects.filter(is_email_verified=True).order_by('-id').first()
-        if candidate:
-            otp_code = f"{secrets.SystemRandom().randint(100000, 999999)}"
-            request.session['login_mfa'] = {
-                'uid': candidate.id,
-                'email': candidate.email,
-                'otp': otp_code,
-                'exp': int(time.time()) + 300,
-                'next': ''
-            }
-            request.session.modified = True
-            try:
-                request.session.save()
-            except Exception:
-                pass
-        messages.success(request, 'A new login code has been sent')
-        request.session['last_resend_login_otp'] = now_ts
-        request.session.modified = True
-        try:
-            request.session.save()
-        except Exception:
-            pass
-        return redirect('account:verify_login_otp')
-    otp_code = f"{secrets.SystemRandom().randint(100000, 999999)}"
-    mfa['otp'] = otp_code
-    mfa['exp'] = int(time.time()) + 300
-    request.session['login_mfa'] = mfa
-    request.session.modified = True
+    otp_code = challenges.renew(challenge_id, challenge)
     try:
-        request.session.save()
-    except Exception:
-        pass
-    try:
-        user = User.objects.get(id=mfa['uid'], email=mfa['email'])
+        user = User.objects.get(id=challenge['user_id'], email=challenge['email'])
         mail_subject = 'Your Outfit Avenue login verification code'
         otp = otp_code
         text_message = f"Hi {user.name},\n\nYour new login verification code is {otp}.\n\nBest regards,\nOutfit Avenue"
@@ -625,16 +469,11 @@ def resend_login_otp(request):
         <p>Your new login verification code is <strong>{otp}</strong>.</p>
         <p>Best regards,<br/>Outfit Avenue</p>
         """
-        send_mail(mail_subject, text_message, settings.DEFAULT_FROM_EMAIL, [user.email], html_message=html_message, fail_silently=False)
+        outbox.enqueue(mail_subject, text_message, [user.email], html_body=html_message, sensitive=True)
+        challenges.mark_sent(challenge_id, challenge)
     except Exception:
         messages.warning(request, 'Could not resend login verification code at this time')
     messages.success(request, 'A new login code has been sent')
-    request.session['last_resend_login_otp'] = now_ts
-    request.session.modified = True
-    try:
-        request.session.save()
-    except Exception:
-        pass
     return redirect('account:verify_login_otp')
 
 # JWT token obtain view
@@ -1,11 +1,19 @@
-from django.contrib import admin
+from datetime import date
+
+from django.contrib import admin, messages
+from django.http import StreamingHttpResponse
+from django.template.response import TemplateResponse
 from django.utils.html import format_html
 from django.urls import reverse
-from django.utils.safestring import mark_safe
 from django.db.models import Q
-import json
+from django import forms
 
-from .models import Product, Contact, Order, OrderUpdate
+from .models import Product, Contact, Order, OrderUpdate, DailySales
+from .state_machine import order_state
+from . import rollups
+from .admin_fragments import order_fragments
+from .admin_changelist import CityListFilter, EstimatedCountPaginator, indexed_order_search
+from .exports import FORMATS, iter_export
 
 
 # Inline Admin for Order Updates
@@ -23,18 +31,34 @@ class OrderUpdateInline(admin.TabularInline):
 
 
 # Order Admin
+class OrderAdminForm(forms.ModelForm):
+    
+    class Meta:
+        model = Order
+        fields = '__all__'
+    
+    def clean_order_status(self):
+        """Only allow status moves the order state machine permits"""
+        status = self.cleaned_data['order_status']
+        previous = self.initial.get('order_status')
+        if self.instance.pk and previous and status != previous and not order_state.can_transition(previous, status):
+            raise forms.ValidationError(f'An order cannot move from {previous} to {status}.')
+        return status
+
+
 @admin.register(Order)
 class OrderAdmin(admin.ModelAdmin):
+    form = OrderAdminForm
     list_display = ('order_id', 'customer_info', 'order_status_badge', 'payment_status_badge', 'amount_display', 'total_items', 'created_at', 'tracking_link', 'actions_column')
-    list_filter = ('order_status', 'payment_status', 'payment_method', 'created_at', 'city')
+    list_filter = ('order_status', 'payment_status', 'payment_method', 'created_at', CityListFilter)
     search_fields = ('order_id', 'name', 'email', 'phone', 'tracking_number', 'address', 'city')
-    readonly_fields = ('order_id', 'created_at', 'get_order_items_display', 'get_order_timeline')
+    readonly_fields = ('order_id', 'created_at', 'total_items', 'subtotal', 'get_order_items_display', 'get_order_timeline')
     fieldsets = (
         ('Order Information', {
-            'fields': ('order_id', 'order_status', 'created_at', 'amount')
+            'fields': ('order_id', 'order_status', 'created_at', 'amount', 'subtotal', 'total_items')
         }),
         ('Customer Information', {
-            'fields': ('name', 'email', 'phone', 'address', 'city', 'zip_code')
+            'fields': ('user', 'name', 'email', 'phone', 'address', 'city', 'zip_code')
         }),
         ('Payment Information', {
             'fields': ('payment_method', 'payment_status')
@@ -56,89 +80,44 @@ class OrderAdmin(admin.ModelAdmin):
         }),
     )
     inlines = [OrderUpdateInline]
-    date_hierarchy = 'created_at'
+    raw_id_fields = ('user',)
+    # No date_hierarchy: its year/month links need a DISTINCT scan of
+    # created_at on every load; the created_at list filter covers date ranges
     ordering = ('-created_at',)
     list_per_page = 25
+    # Large-table changelist: estimated counts, no second full COUNT(*)
+    paginator = EstimatedCountPaginator
+    show_full_result_count = False
     
-    actions = ['mark_as_confirmed', 'mark_as_processing', 'mark_as_shipped', 'mark_as_delivered', 'mark_as_cancelled']
+    actions = ['mark_as_confirmed', 'mark_as_processing', 'mark_as_shipped', 'mark_as_delivered', 'mark_as_cancelled', 'export_csv', 'export_ndjson']
+    
+    def get_search_results(self, request, queryset, search_term):
+        """
+        Terms shaped like an order id, phone, tracking number or email are
+        answered from their indexes only; anything else uses icontains.
+        """
+        fast = indexed_order_search(queryset, search_term)
+        if fast is not None:
+            return fast, False
+        return super().get_search_results(request, queryset, search_term)
     
     def save_model(self, request, obj, form, change):
-        """Override save to automatically create OrderUpdate when order_status changes"""
-        if change:  # Only for existing orders, not new ones
-            try:
-                # Get the original order from database
-                original_order = Order.objects.get(pk=obj.pk)
-                original_status = original_order.order_status
-                new_status = obj.order_status
-                
-                # If order status changed, create an update
-                if original_status != new_status:
-                    status_messages = {
-                        'pending': 'Order status set to Pending.',
-                        'confirmed': 'Order has been confirmed and is being prepared for processing.',
-                        'processing': 'Your order is being processed and prepared for shipment.',
-                        'shipped': f'Your order has been shipped. Tracking number: {obj.tracking_number or "Will be updated soon"}.',
-                        'out_for_delivery': 'Your order is out for delivery and will reach you soon.',
-                        'delivered': 'Your order has been delivered successfully. Thank you for shopping with us!',
-                        'cancelled': 'Order has been cancelled.',
-                        'refunded': 'Order has been refunded.',
-                    }
-                    
-                    status_types = {
-                        'pending': 'order_placed',
-                        'confirmed': 'order_confirmed',
-                        'processing': 'processing',
-                        'shipped': 'shipped',
-                        'out_for_delivery': 'out_for_delivery',
-                        'delivered': 'delivered',
-                        'cancelled': 'cancelled',
-                        'refunded': 'refunded',
-                    }
-                    
-                    update_desc = status_messages.get(new_status, f'Order status changed to {obj.get_order_status_display()}.')
-                    status_type = status_types.get(new_status, 'other')
-                    
-                    # Create order update
-                    OrderUpdate.objects.create(
-                        order=obj,
-                        status_type=status_type,
-                        update_desc=update_desc,
-                        tracking_number=obj.tracking_number if new_status == 'shipped' else None,
-                        location=obj.city if new_status in ['shipped', 'out_for_delivery'] else None
-                    )
-                
-                # Also check if tracking_number was added/changed
-                if obj.tracking_number and obj.tracking_number != original_order.tracking_number:
-                    # Create update for tracking number
-                    OrderUpdate.objects.create(
-                        order=obj,
-                        status_type='shipped' if new_status == 'shipped' else 'other',
-                        update_desc=f'Tracking number updated: {obj.tracking_number}',
-                        tracking_number=obj.tracking_number,
-                        location=obj.city
-                    )
-                
-                # Update delivered_date if status is delivered
-                if new_status == 'delivered' and not obj.delivered_date:
-                    from datetime import date
-                    obj.delivered_date = date.today()
-                
-                # Update shipping_date if status is shipped
-                if new_status == 'shipped' and not obj.shipping_date:
-                    from datetime import date
-                    obj.shipping_date = date.today()
-                    
-            except Order.DoesNotExist:
-                # New order, no need to check for changes
-                pass
-            except Exception as e:
-                # Log error but don't prevent save
-                import logging
-                logger = logging.getLogger(__name__)
-                logger.error(f"Error creating order update: {e}")
-        
-        # Save the order
+        """Record status and tracking changes on the order timeline and sales rollups"""
+        updates = []
+        previous = None
+        if change:
+            # Diffed against the form's initial data, so no re-read of the order
+            updates = order_state.form_changes(obj, form.initial)
+            previous = rollups.order_values(obj)
+            previous.update((field, form.initial[field]) for field in rollups.ORDER_FIELDS if field in form.initial)
+        # The admin change view already runs inside a transaction
         super().save_model(request, obj, form, change)
+        order_state.record(updates)
+        if previous is not None:
+            # Move the order's sales rollup bucket if status, city or amount changed
+            rollups.move_orders([(previous, rollups.order_values(obj))])
+        else:
+            rollups.add_order(obj, [])
     
     def customer_info(self, obj):
         return format_html(
@@ -191,10 +170,6 @@ class OrderAdmin(admin.ModelAdmin):
         return format_html('<strong>₹{}</strong>', formatted_amount)
     amount_display.short_description = 'Amount'
     
-    def total_items(self, obj):
-        return obj.get_total_items()
-    total_items.short_description = 'Items'
-    
     def tracking_link(self, obj):
         try:
             if obj.tracking_number:
@@ -219,135 +194,96 @@ class OrderAdmin(admin.ModelAdmin):
     
     def get_order_items_display(self, obj):
         try:
-            items = json.loads(obj.item_json)
-            html = '<div style="max-height: 400px; overflow-y: auto;">'
-            html += '<table style="width: 100%; border-collapse: collapse;">'
-            html += '<thead><tr style="background: #f3f4f6;"><th style="padding: 8px; text-align: left; border: 1px solid #e5e7eb;">Item</th><th style="padding: 8px; text-align: center; border: 1px solid #e5e7eb;">Qty</th><th style="padding: 8px; text-align: right; border: 1px solid #e5e7eb;">Price</th><th style="padding: 8px; text-align: right; border: 1px solid #e5e7eb;">Total</th></tr></thead>'
-            html += '<tbody>'
-            total = 0
-            for key, value in items.items():
-                if isinstance(value, list) and len(value) >= 3:
-                    qty = value[0]
-                    name = value[1]
-                    price = value[2]
-                    size = value[3] if len(value) > 3 else ''
-                    color = value[4] if len(value) > 4 else ''
-                    item_total = qty * price
-                    total += item_total
-                    variant = ''
-                    if size or color:
-                        variant = f'<br><small style="color: #6b7280;">Size: {size}, Color: {color}</small>'
-                    price_formatted = f"{price:,}"
-                    item_total_formatted = f"{item_total:,}"
-                    html += f'<tr><td style="padding: 8px; border: 1px solid #e5e7eb;">{name}{variant}</td><td style="padding: 8px; text-align: center; border: 1px solid #e5e7eb;">{qty}</td><td style="padding: 8px; text-align: right; border: 1px solid #e5e7eb;">₹{price_formatted}</td><td style="padding: 8px; text-align: right; border: 1px solid #e5e7eb;"><strong>₹{item_total_formatted}</strong></td></tr>'
-            html += '</tbody>'
-            total_formatted = f"{total:,}"
-            html += f'<tfoot><tr style="background: #f9fafb;"><td colspan="3" style="padding: 8px; text-align: right; border: 1px solid #e5e7eb;"><strong>Total:</strong></td><td style="padding: 8px; text-align: right; border: 1px solid #e5e7eb;"><strong>₹{total_formatted}</strong></td></tr></tfoot>'
-            html += '</table></div>'
-            return mark_safe(html)
-        except:
+            return order_fragments(obj)['items']
+        except Exception:
             return 'Unable to parse order items'
     get_order_items_display.short_description = 'Order Items'
     
     def get_order_timeline(self, obj):
         try:
-            updates = obj.orderupdate_set.all().order_by('-timestamp')
-            if not updates:
-                return 'No updates yet'
-            html = '<div style="max-height: 400px; overflow-y: auto;">'
-            html += '<div style="position: relative; padding-left: 30px;">'
-            for update in updates:
-                status_colors = {
-                    'order_placed': '#3b82f6',
-                    'order_confirmed': '#10b981',
-                    'payment_received': '#10b981',
-                    'processing': '#8b5cf6',
-                    'packed': '#06b6d4',
-                    'shipped': '#06b6d4',
-                    'in_transit': '#f59e0b',
-                    'out_for_delivery': '#f59e0b',
-                    'delivered': '#10b981',
-                    'cancelled': '#ef4444',
-                    'refunded': '#6b7280',
-                }
-                color = status_colors.get(update.status_type, '#6b7280')
-                location_html = f'<div style="color: #6b7280; font-size: 12px; margin-top: 4px;"><i class="fas fa-map-marker-alt"></i> {update.location}</div>' if update.location else ''
-                tracking_html = f'<div style="color: #3b82f6; font-size: 11px; margin-top: 4px;"><i class="fas fa-truck"></i> Tracking: {update.tracking_number}</div>' if update.tracking_number else ''
-                timestamp_str = update.timestamp.strftime("%d %b %Y, %I:%M %p") if update.timestamp else 'N/A'
-                html += f'''
-                <div style="position: relative; padding-bottom: 20px;">
-                    <div style="position: absolute; left: -25px; top: 5px; width: 12px; height: 12px; border-radius: 50%; background: {color}; border: 2px solid white; box-shadow: 0 0 0 2px {color};"></div>
-                    <div style="background: #f9fafb; padding: 12px; border-radius: 8px; border-left: 3px solid {color};">
-                        <div style="font-weight: 600; color: #1f2937; margin-bottom: 4px;">{update.get_status_type_display()}</div>
-                        <div style="color: #6b7280; font-size: 13px; margin-bottom: 4px;">{update.update_desc}</div>
-                        <div style="color: #9ca3af; font-size: 11px;">{timestamp_str}</div>
-                        {location_html}
-                        {tracking_html}
-                    </div>
-                </div>
-                '''
-            html += '</div></div>'
-            return mark_safe(html)
+            # Template-rendered and cached per (order, newest update)
+            return order_fragments(obj)['timeline']
         except Exception as e:
             return f'Error loading timeline: {str(e)}'
     get_order_timeline.short_description = 'Order Timeline'
     
     # Admin Actions
+    def _bulk_transition(self, request, queryset, target, label):
+        """Apply one status to the selection with a single UPDATE and bulk insert"""
+        result = order_state.apply_all(queryset.values_list('order_id', flat=True), target)
+        self.message_user(request, f'{len(result)} order(s) marked as {label}.')
+        if result.skipped:
+            shown = ', '.join(f'#{pk} ({reason})' for pk, reason in list(result.skipped.items())[:10])
+            more = len(result.skipped) - 10
+            if more > 0:
+                shown += f' and {more} more'
+            self.message_user(request, f'{len(result.skipped)} order(s) skipped: {shown}', messages.WARNING)
+    
     def mark_as_confirmed(self, request, queryset):
-        updated = queryset.update(order_status='confirmed')
-        for order in queryset:
-            OrderUpdate.objects.create(
-                order=order,
-                status_type='order_confirmed',
-                update_desc='Order has been confirmed and is being prepared for processing.'
-            )
-        self.message_user(request, f'{updated} order(s) marked as confirmed.')
+        self._bulk_transition(request, queryset, 'confirmed', 'confirmed')
     mark_as_confirmed.short_description = 'Mark selected orders as Confirmed'
     
     def mark_as_processing(self, request, queryset):
-        updated = queryset.update(order_status='processing')
-        for order in queryset:
-            OrderUpdate.objects.create(
-                order=order,
-                status_type='processing',
-                update_desc='Your order is being processed and prepared for shipment.'
-            )
-        self.message_user(request, f'{updated} order(s) marked as Processing.')
+        self._bulk_transition(request, queryset, 'processing', 'Processing')
     mark_as_processing.short_description = 'Mark selected orders as Processing'
     
     def mark_as_shipped(self, request, queryset):
-        updated = queryset.update(order_status='shipped')
-        for order in queryset:
-            OrderUpdate.objects.create(
-                order=order,
-                status_type='shipped',
-                update_desc=f'Your order has been shipped. Tracking number: {order.tracking_number or "N/A"}'
-            )
-        self.message_user(request, f'{updated} order(s) marked as Shipped.')
+        self._bulk_transition(request, queryset, 'shipped', 'Shipped')
     mark_as_shipped.short_description = 'Mark selected orders as Shipped'
     
     def mark_as_delivered(self, request, queryset):
-        from datetime import date
-        updated = queryset.update(order_status='delivered', delivered_date=date.today())
-        for order in queryset:
-            OrderUpdate.objects.create(
-                order=order,
-                status_type='delivered',
-                update_desc='Your order has been delivered successfully. Thank you for shopping with us!'
-            )
-        self.message_user(request, f'{updated} order(s) marked as Delivered.')
+        self._bulk_transition(request, queryset, 'delivered', 'Delivered')
     mark_as_delivered.short_description = 'Mark selected orders as Delivered'
     
     def mark_as_cancelled(self, request, queryset):
-        updated = queryset.update(order_status='cancelled')
-        for order in queryset:
-            OrderUpdate.objects.create(
-                order=order,
-                status_type='cancelled',
-                update_desc='Order has been cancelled.'
-            )
-        self.message_user(request, f'{updated} order(s) marked as Cancelled.')
+        self._bulk_transition(request, queryset, 'cancelled', 'Cancelled')
     mark_as_cancelled.short_description = 'Mark selected orders as Cancelled'
+    
+    def _export(self, queryset, fmt):
+        """Stream the selected orders; rows are read and written chunk by chunk"""
+        content_type, extension = FORMATS[fmt]
+        response = StreamingHttpResponse(iter_export(queryset, fmt), content_type=content_type)
+        response['Content-Disposition'] = f'attachment; filename="orders-{date.today():%Y%m%d}.{extension}"'
+        return response
+    
+    def export_csv(self, request, queryset):
+        return self._export(queryset, 'csv')
+    export_csv.short_description = 'Export selected orders as CSV'
+    
+    def export_ndjson(self, request, queryset):
+        return self._export(queryset, 'ndjson')
+    export_ndjson.short_description = 'Export selected orders as NDJSON'
+
+
+# Sales dashboard: read-only view over the DailySales/DailyProductSales rollups
+@admin.register(DailySales)
+class SalesDashboardAdmin(admin.ModelAdmin):
+    change_list_template = 'admin/shop/dailysales/dashboard.html'
+    
+    def has_add_permission(self, request):
+        return False
+    
+    def has_change_permission(self, request, obj=None):
+        return False
+    
+    def has_delete_permission(self, request, obj=None):
+        return False
+    
+    def changelist_view(self, request, extra_context=None):
+        try:
+            days = int(request.GET.get('days', rollups.DASHBOARD_DAYS))
+        except ValueError:
+            days = rollups.DASHBOARD_DAYS
+        days = min(max(days, 1), rollups.DASHBOARD_MAX_DAYS)
+        context = {
+            **self.admin_site.each_context(request),
+            'title': 'Sales Dashboard',
+            'opts': self.model._meta,
+            'day_choices': rollups.DASHBOARD_DAY_CHOICES,
+            **rollups.dashboard(days),
+            **(extra_context or {}),
+        }
+        return TemplateResponse(request, self.change_list_template, context)
 
 
 # Note: OrderUpdate is managed inline through OrderAdmin
@@ -0,0 +1,80 @@
+"""
+Order items and timeline panels for the OrderAdmin change view.
+
+Both fragments are rendered from templates (admin/shop/order/*_fragment.html)
+and cached together per order, tagged with the order's newest update_id. A
+new timeline row changes that id, so the entry stops matching on its own;
+edits that keep it (inline update edits, order line changes) drop the entry
+through shop.signals.
+"""
+from django.core.cache import cache
+from django.template.loader import render_to_string
+from django.utils.safestring import mark_safe
+
+from .models import OrderUpdate
+
+CACHE_TIMEOUT = 60 * 60
+CACHE_KEY = 'shop:admin:order:{}'
+
+STATUS_COLORS = {
+    'order_placed': '#3b82f6',
+    'order_confirmed': '#10b981',
+    'payment_received': '#10b981',
+    'processing': '#8b5cf6',
+    'packed': '#06b6d4',
+    'shipped': '#06b6d4',
+    'in_transit': '#f59e0b',
+    'out_for_delivery': '#f59e0b',
+    'delivered': '#10b981',
+    'cancelled': '#ef4444',
+    'refunded': '#6b7280',
+}
+DEFAULT_COLOR = '#6b7280'
+
+
+def cache_key(order_id):
+    return CACHE_KEY.format(order_id)
+
+
+def invalidate(order_id):
+    if order_id is not None:
+        cache.delete(cache_key(order_id))
+
+
+def render_items(order):
+    rows = []
+    total = 0
+    for item in order.line_items:
+        total += item.line_total
+        rows.append({'item': item, 'price': f'{item.unit_price:,}', 'total': f'{item.line_total:,}'})
+    return render_to_string('admin/shop/order/items_fragment.html', {'rows': rows, 'total': f'{total:,}'})
+
+
+def render_timeline(updates):
+    if not updates:
+        return 'No updates yet'
+    rows = [{'update': update, 'color': STATUS_COLORS.get(update.status_type, DEFAULT_COLOR)} for update in updates]
+    return render_to_string('admin/shop/order/timeline_fragment.html', {'rows': rows})
+
+
+def order_fragments(order):
+    """
+    Return {'items': html, 'timeline': html} for an order, memoised on the
+    instance for the request and cached under (order_id, last_update_id).
+    """
+    fragments = getattr(order, '_admin_fragments', None)
+    if fragments is not None:
+        return fragments
+    last_update_id = (
+        OrderUpdate.objects.filter(order_id=order.pk)
+        .order_by('-update_id').values_list('update_id', flat=True).first()
+    )
+    cached = cache.get(cache_key(order.pk))
+    if cached is not None and cached[0] == last_update_id:
+        fragments = cached[1]
+    else:
+        updates = list(OrderUpdate.objects.filter(order_id=order.pk).order_by('-timestamp', '-update_id'))
+        fragments = {'items': render_items(order), 'timeline': render_timeline(updates)}
+        cache.set(cache_key(order.pk), (last_update_id, fragments), CACHE_TIMEOUT)
+    order._admin_fragments = {name: mark_safe(html) for name, html in fragments.items()}
+    return order._admin_fragments
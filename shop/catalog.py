@@ -0,0 +1,41 @@
+from itertools import groupby
+from math import ceil
+import threading
+
+from .models import Product
+
+# In-process cache of the storefront carousel. Rebuilt lazily on the next
+# request after any Product save/delete (see shop.signals).
+_lock = threading.Lock()
+_category_slides = None
+
+
+def build_category_slides(products):
+    """Group products (already ordered by category) into [prods, range, nSlides] slides"""
+    allProds = []
+    for cat, prods in groupby(products, key=lambda p: p.category):
+        prods = list(prods)
+        n = len(prods)
+        nSlides = n // 4 + ceil((n / 4) - (n // 4))
+        allProds.append([prods, range(1, nSlides), nSlides])
+    return allProds
+
+
+def get_category_slides():
+    """Return the home page carousel, fetching the whole storefront in one query"""
+    global _category_slides
+    slides = _category_slides
+    if slides is None:
+        with _lock:
+            if _category_slides is None:
+                products = Product.objects.order_by('category', 'id')
+                _category_slides = build_category_slides(products)
+            slides = _category_slides
+    return slides
+
+
+def invalidate_category_slides(**kwargs):
+    """Drop the cached carousel so the next request rebuilds it"""
+    global _category_slides
+    with _lock:
+        _category_slides = None
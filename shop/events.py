@@ -0,0 +1,179 @@
+"""
+Pub/sub for live order tracking (the tracker page's Server-Sent Events stream).
+
+New OrderUpdate rows are published on an "order:<id>" channel once their
+transaction commits (see shop.signals and publish_updates). Each open tracker
+holds one subscription: an asyncio queue woken only when something is
+published for its order, so idle connections cost nothing but the socket.
+
+The broker is pluggable through settings.SHOP_EVENT_BROKER (dotted path to a
+class with publish/subscribe/unsubscribe). The default LocalBroker only
+reaches subscribers in the same process, which suits a single ASGI worker;
+several workers need a shared broker such as Redis pub/sub behind the same
+interface.
+"""
+import asyncio
+from collections import defaultdict
+import json
+import threading
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.utils.module_loading import import_string
+
+from .models import OrderUpdate
+from .tracking import serialize_update
+
+DEFAULT_BROKER = 'shop.events.LocalBroker'
+QUEUE_SIZE = 100
+
+# Stream timing: comment pings keep proxies from closing idle connections, and
+# streams end after MAX_STREAM_SECONDS so the browser reconnects (resuming from
+# Last-Event-ID) and long-lived workers do not pile up stale subscribers
+KEEPALIVE_SECONDS = 20
+MAX_STREAM_SECONDS = 300
+RETRY_MS = 3000
+
+
+def order_channel(order_id):
+    return f'order:{order_id}'
+
+
+class Subscription:
+    """One listener's queue, bound to the event loop that created it"""
+
+    def __init__(self, channel):
+        self.channel = channel
+        self.loop = asyncio.get_running_loop()
+        self.queue = asyncio.Queue(maxsize=QUEUE_SIZE)
+        # Set when messages were dropped; the stream should end so the
+        # client reconnects and catches up from Last-Event-ID
+        self.overflowed = False
+
+    def _put(self, message):
+        try:
+            self.queue.put_nowait(message)
+        except asyncio.QueueFull:
+            self.overflowed = True
+
+    def deliver(self, message):
+        """Thread-safe hand-off from a publisher"""
+        try:
+            self.loop.call_soon_threadsafe(self._put, message)
+        except RuntimeError:
+            # Event loop already closed; the subscriber is gone
+            pass
+
+    async def get(self, timeout):
+        """Next message, or None after `timeout` seconds of silence"""
+        try:
+            return await asyncio.wait_for(self.queue.get(), timeout)
+        except asyncio.TimeoutError:
+            return None
+
+
+class LocalBroker:
+    """
+    In-memory broker for subscribers living in this process. subscribe()
+    returns an object with `async get(timeout)` and an `overflowed` flag;
+    other brokers must offer the same.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._subscribers = defaultdict(set)
+
+    def subscribe(self, channel):
+        """Must be called from a running event loop"""
+        subscription = Subscription(channel)
+        with self._lock:
+            self._subscribers[channel].add(subscription)
+        return subscription
+
+    def unsubscribe(self, subscription):
+        with self._lock:
+            subscribers = self._subscribers.get(subscription.channel)
+            if subscribers is not None:
+                subscribers.discard(subscription)
+                if not subscribers:
+                    del self._subscribers[subscription.channel]
+
+    def publish(self, channel, message):
+        with self._lock:
+            subscribers = list(self._subscribers.get(channel, ()))
+        for subscription in subscribers:
+            subscription.deliver(message)
+        return len(subscribers)
+
+    def subscriber_count(self, channel=None):
+        with self._lock:
+            if channel is not None:
+                return len(self._subscribers.get(channel, ()))
+            return sum(len(subs) for subs in self._subscribers.values())
+
+
+_broker = None
+_broker_lock = threading.Lock()
+
+
+def get_broker():
+    global _broker
+    if _broker is None:
+        with _broker_lock:
+            if _broker is None:
+                _broker = import_string(getattr(settings, 'SHOP_EVENT_BROKER', DEFAULT_BROKER))()
+    return _broker
+
+
+def publish_updates(updates):
+    """Publish committed OrderUpdate rows to their orders' trackers"""
+    broker = get_broker()
+    for update in updates:
+        if update.order_id is not None:
+            broker.publish(order_channel(update.order_id), serialize_update(update))
+
+
+def _event(data):
+    return f"id: {data['id']}\nevent: update\ndata: {json.dumps(data, default=str)}\n\n"
+
+
+@sync_to_async
+def _updates_after(order_id, last_id):
+    updates = OrderUpdate.objects.filter(order_id=order_id, update_id__gt=last_id).order_by('update_id')
+    return [serialize_update(update) for update in updates]
+
+
+async def order_event_stream(order_id, last_event_id=None):
+    """
+    Async SSE body for one order: replays updates after last_event_id, then
+    yields each newly published update until the stream times out.
+    """
+    try:
+        last_id = int(last_event_id)
+    except (TypeError, ValueError):
+        last_id = None
+    broker = get_broker()
+    # Subscribe before the catch-up query so nothing slips in between
+    subscription = broker.subscribe(order_channel(order_id))
+    try:
+        yield f'retry: {RETRY_MS}\n\n'
+        if last_id is not None:
+            for data in await _updates_after(order_id, last_id):
+                last_id = data['id']
+                yield _event(data)
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + MAX_STREAM_SECONDS
+        while not subscription.overflowed:
+            remaining = deadline - loop.time()
+            if remaining <= 0:
+                break
+            data = await subscription.get(min(KEEPALIVE_SECONDS, remaining))
+            if data is None:
+                yield ': keepalive\n\n'
+                continue
+            if last_id is not None and data['id'] <= last_id:
+                continue
+            last_id = data['id']
+            yield _event(data)
+    finally:
+        broker.unsubscribe(subscription)
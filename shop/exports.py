@@ -0,0 +1,114 @@
+"""
+Streaming order exports (CSV and NDJSON) for the OrderAdmin export actions
+and `manage.py export_orders`.
+
+Orders are read with a values_list projection through
+QuerySet.iterator(chunk_size=...), annotated with their latest update (see
+shop.history.with_latest_update). Each chunk's order lines come from one
+OrderItem query, falling back to parsing item_json for orders without rows.
+Output is produced line by line, so memory stays flat however many orders are
+exported and the first bytes go out immediately.
+"""
+import csv
+from datetime import date, datetime
+import json
+
+from .history import with_latest_update
+from .models import OrderItem, parse_item_json
+
+CHUNK_SIZE = 2000
+
+FIELDS = (
+    'order_id', 'created_at', 'name', 'email', 'phone', 'address', 'city', 'zip_code',
+    'amount', 'subtotal', 'total_items', 'payment_method', 'payment_status', 'order_status',
+    'tracking_number', 'shipping_date', 'delivered_date',
+)
+LATEST_FIELDS = ('latest_update_status', 'latest_update_desc', 'latest_update_at')
+COLUMNS = FIELDS + ('items',) + LATEST_FIELDS
+
+LINE_FIELDS = ('name', 'qty', 'unit_price', 'size', 'color')
+
+FORMATS = {
+    'csv': ('text/csv', 'csv'),
+    'ndjson': ('application/x-ndjson', 'ndjson'),
+}
+
+
+def _json_default(value):
+    if isinstance(value, (date, datetime)):
+        return value.isoformat()
+    return str(value)
+
+
+def _lines_for(order_ids):
+    """{order_id: [line dicts]} for one chunk, in a single query"""
+    lines = {}
+    for row in (
+        OrderItem.objects.filter(order_id__in=order_ids)
+        .order_by('order_id', 'id').values_list('order_id', *LINE_FIELDS)
+    ):
+        lines.setdefault(row[0], []).append(dict(zip(LINE_FIELDS, row[1:])))
+    return lines
+
+
+def iter_orders(queryset, chunk_size=CHUNK_SIZE):
+    """Yield one dict per order (COLUMNS keys) in order_id order"""
+    rows = (
+        with_latest_update(queryset.order_by('order_id'))
+        .values_list(*FIELDS, 'item_json', *LATEST_FIELDS)
+        .iterator(chunk_size=chunk_size)
+    )
+    chunk = []
+    for row in rows:
+        chunk.append(row)
+        if len(chunk) >= chunk_size:
+            yield from _emit(chunk)
+            chunk = []
+    if chunk:
+        yield from _emit(chunk)
+
+
+def _emit(chunk):
+    lines = _lines_for([row[0] for row in chunk])
+    n = len(FIELDS)
+    for row in chunk:
+        record = dict(zip(FIELDS, row[:n]))
+        items = lines.get(row[0])
+        if items is None:
+            items = [{field: line[field] for field in LINE_FIELDS} for line in parse_item_json(row[n])]
+        record['items'] = items
+        record.update(zip(LATEST_FIELDS, row[n + 1:]))
+        yield record
+
+
+class _Echo:
+    """File-like object whose write() hands the text back to csv.writer"""
+
+    def write(self, value):
+        return value
+
+
+def iter_csv(queryset, chunk_size=CHUNK_SIZE):
+    writer = csv.writer(_Echo())
+    yield writer.writerow(COLUMNS)
+    for record in iter_orders(queryset, chunk_size):
+        record['items'] = json.dumps(record['items'], separators=(',', ':'))
+        yield writer.writerow([
+            '' if record[column] is None else
+            record[column].isoformat() if isinstance(record[column], (date, datetime)) else
+            record[column]
+            for column in COLUMNS
+        ])
+
+
+def iter_ndjson(queryset, chunk_size=CHUNK_SIZE):
+    for record in iter_orders(queryset, chunk_size):
+        yield json.dumps(record, default=_json_default) + '\n'
+
+
+def iter_export(queryset, fmt, chunk_size=CHUNK_SIZE):
+    if fmt == 'csv':
+        return iter_csv(queryset, chunk_size)
+    if fmt == 'ndjson':
+        return iter_ndjson(queryset, chunk_size)
+    raise ValueError(f'Unknown export format "{fmt}"')
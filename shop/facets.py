@@ -0,0 +1,170 @@
+"""
+Facets, filters and pagination for shop.views.search.
+
+Facet counts for category, subcategory, price bucket and publication month are
+computed with a single GROUP BY over the matched products (one per
+max_query_params ids for very broad queries); the four facet lists are folded
+out of those grouped rows in Python. Counts always cover the full match set.
+"""
+from datetime import date
+
+from django.db import connection
+from django.db.models import Case, CharField, Count, Q, Value, When
+from django.db.models.functions import TruncMonth
+
+from .models import Product
+
+# (key, label, lower bound inclusive, upper bound exclusive)
+PRICE_BUCKETS = [
+    ('0-499', 'Under ₹500', None, 500),
+    ('500-999', '₹500 - ₹999', 500, 1000),
+    ('1000-1999', '₹1,000 - ₹1,999', 1000, 2000),
+    ('2000-4999', '₹2,000 - ₹4,999', 2000, 5000),
+    ('5000+', '₹5,000 & above', 5000, None),
+]
+PRICE_LABELS = {key: label for key, label, _, _ in PRICE_BUCKETS}
+
+FACET_PARAMS = ('category', 'subcategory', 'price', 'month')
+FACET_TITLES = {
+    'category': 'Category',
+    'subcategory': 'Type',
+    'price': 'Price',
+    'month': 'Added',
+}
+
+RESULTS_PER_PAGE = 24
+
+
+def _price_q(key):
+    for bucket, _, low, high in PRICE_BUCKETS:
+        if bucket == key:
+            q = Q()
+            if low is not None:
+                q &= Q(price__gte=low)
+            if high is not None:
+                q &= Q(price__lt=high)
+            return q
+    return None
+
+
+def _month_range(key):
+    """'2024-05' -> (date(2024, 5, 1), date(2024, 6, 1)) or None"""
+    try:
+        year, month = (int(part) for part in key.split('-'))
+        start = date(year, month, 1)
+    except (ValueError, TypeError):
+        return None
+    end = date(year + 1, 1, 1) if month == 12 else date(year, month + 1, 1)
+    return start, end
+
+
+def _chunks(ids):
+    """Split an id list so each IN (...) stays under the backend's parameter limit"""
+    size = connection.features.max_query_params or len(ids) or 1
+    for start in range(0, len(ids), size):
+        yield ids[start:start + size]
+
+
+def price_bucket_expression():
+    whens = [When(_price_q(key), then=Value(key)) for key, _, _, _ in PRICE_BUCKETS[:-1]]
+    return Case(*whens, default=Value(PRICE_BUCKETS[-1][0]), output_field=CharField())
+
+
+def parse_filters(params):
+    """Pick the valid facet filters out of request.GET"""
+    filters = {}
+    for name in FACET_PARAMS:
+        value = (params.get(name) or '').strip()
+        if not value:
+            continue
+        if name == 'price' and value not in PRICE_LABELS:
+            continue
+        if name == 'month' and _month_range(value) is None:
+            continue
+        filters[name] = value
+    return filters
+
+
+def filter_q(filters):
+    q = Q()
+    if 'category' in filters:
+        q &= Q(category=filters['category'])
+    if 'subcategory' in filters:
+        q &= Q(subcategory=filters['subcategory'])
+    if 'price' in filters:
+        q &= _price_q(filters['price'])
+    if 'month' in filters:
+        start, end = _month_range(filters['month'])
+        q &= Q(pub_date__gte=start, pub_date__lt=end)
+    return q
+
+
+def facet_counts(product_ids):
+    """Return {facet: [(value, label, count)]} for the given products in one query"""
+    rows = (
+        row
+        for chunk in _chunks(list(product_ids))
+        for row in Product.objects.filter(id__in=chunk)
+        .annotate(price_bucket=price_bucket_expression(), month=TruncMonth('pub_date'))
+        .values('category', 'subcategory', 'price_bucket', 'month')
+        .annotate(n=Count('id'))
+        .order_by()
+    )
+    counts = {name: {} for name in FACET_PARAMS}
+    for row in rows:
+        month = row['month'].strftime('%Y-%m') if row['month'] else None
+        for name, value in (('category', row['category']), ('subcategory', row['subcategory']),
+                            ('price', row['price_bucket']), ('month', month)):
+            if value:
+                counts[name][value] = counts[name].get(value, 0) + row['n']
+
+    def by_count(items):
+        return sorted(items, key=lambda item: (-item[1], item[0]))
+
+    return {
+        'category': [(v, v, n) for v, n in by_count(counts['category'].items())],
+        'subcategory': [(v, v, n) for v, n in by_count(counts['subcategory'].items())],
+        'price': [(key, label, counts['price'][key]) for key, label, _, _ in PRICE_BUCKETS if key in counts['price']],
+        'month': [
+            (v, date(int(v[:4]), int(v[5:]), 1).strftime('%b %Y'), counts['month'][v])
+            for v in sorted(counts['month'], reverse=True)
+        ],
+    }
+
+
+def apply_filters(ranked_ids, filters):
+    """Keep only the ranked ids matching the filters, preserving rank order"""
+    if not filters or not ranked_ids:
+        return ranked_ids
+    allowed = set()
+    for chunk in _chunks(list(ranked_ids)):
+        allowed.update(Product.objects.filter(filter_q(filters), id__in=chunk).values_list('id', flat=True))
+    return [pk for pk in ranked_ids if pk in allowed]
+
+
+def facet_links(facets, filters, params):
+    """
+    Turn facet counts into template-ready groups with toggle URLs:
+    [{'name', 'title', 'options': [{'value', 'label', 'count', 'active', 'url'}]}]
+    """
+    groups = []
+    for name in FACET_PARAMS:
+        options = []
+        for value, label, count in facets.get(name, []):
+            query = params.copy()
+            query.pop('page', None)
+            active = filters.get(name) == value
+            if active:
+                query.pop(name, None)
+            else:
+                query[name] = value
+            options.append({
+                'value': value,
+                'label': label,
+                'count': count,
+                'active': active,
+                'url': '?' + query.urlencode(),
+            })
+        if options:
+            groups.append({'name': name, 'title': FACET_TITLES[name], 'options': options})
+    return groups
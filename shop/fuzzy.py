@@ -0,0 +1,172 @@
+"""
+Typo-tolerant product lookup used when shop.views.search finds nothing.
+
+Every distinct word of Product.product_name, category and subcategory is
+broken into padded trigrams. A misspelt query word first collects candidate
+words through the trigram postings and keeps those whose Jaccard similarity
+clears MIN_SIMILARITY; only that short list is checked with edit distance.
+Like the other search structures it is built on first use and kept current by
+shop.signals.
+"""
+from collections import defaultdict
+import re
+import threading
+
+from .models import Product
+
+FIELDS = ('product_name', 'category', 'subcategory')
+_WORD_RE = re.compile(r'[a-z0-9]+')
+
+MIN_SIMILARITY = 0.2
+MAX_CANDIDATES = 20
+
+
+def trigrams(word):
+    padded = f'  {word} '
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+
+def words(text):
+    return _WORD_RE.findall((text or '').lower())
+
+
+def edit_distance(a, b, limit):
+    """
+    Optimal string alignment distance (Levenshtein plus adjacent transpositions),
+    giving up (returns limit + 1) once every path exceeds limit.
+    """
+    if abs(len(a) - len(b)) > limit:
+        return limit + 1
+    before, previous = None, list(range(len(b) + 1))
+    for i, ca in enumerate(a, 1):
+        current = [i]
+        for j, cb in enumerate(b, 1):
+            cost = min(previous[j] + 1, current[j - 1] + 1, previous[j - 1] + (ca != cb))
+            if before is not None and j > 1 and ca == b[j - 2] and a[i - 2] == cb:
+                cost = min(cost, before[j - 2] + 1)
+            current.append(cost)
+        if min(current) > limit:
+            return limit + 1
+        before, previous = previous, current
+    return previous[-1]
+
+
+class TrigramIndex:
+
+    def __init__(self):
+        self._lock = threading.RLock()
+        self._built = False
+        self._postings = defaultdict(set)    # trigram -> words
+        self._word_products = defaultdict(set)  # word -> product ids
+        self._product_words = {}             # product id -> words
+
+    def _ensure_built(self):
+        if self._built:
+            return
+        with self._lock:
+            if self._built:
+                return
+            self._postings.clear()
+            self._word_products.clear()
+            self._product_words.clear()
+            for row in Product.objects.values('id', *FIELDS).iterator():
+                self._add(row['id'], row)
+            self._built = True
+
+    def _add(self, pk, values):
+        product_words = set()
+        for field in FIELDS:
+            product_words.update(words(values.get(field)))
+        self._product_words[pk] = product_words
+        for word in product_words:
+            if not self._word_products[word]:
+                for gram in trigrams(word):
+                    self._postings[gram].add(word)
+            self._word_products[word].add(pk)
+
+    def _remove(self, pk):
+        for word in self._product_words.pop(pk, ()):
+            products = self._word_products[word]
+            products.discard(pk)
+            if not products:
+                del self._word_products[word]
+                for gram in trigrams(word):
+                    self._postings[gram].discard(word)
+                    if not self._postings[gram]:
+                        del self._postings[gram]
+
+    def closest_words(self, word):
+        """Return [(similarity, vocabulary word)] best first for one query word"""
+        grams = trigrams(word)
+        shared = defaultdict(int)
+        for gram in grams:
+            for candidate in self._postings.get(gram, ()):
+                shared[candidate] += 1
+        # Candidate pruning: Jaccard over trigram sets, computed from the counts
+        scored = []
+        for candidate, common in shared.items():
+            similarity = common / (len(grams) + len(trigrams(candidate)) - common)
+            if similarity >= MIN_SIMILARITY:
+                scored.append((similarity, candidate))
+        scored.sort(key=lambda item: (-item[0], item[1]))
+        # Edit distance only for the surviving short list; fewest edits win
+        limit = 1 if len(word) <= 4 else 2
+        close = []
+        for similarity, candidate in scored[:MAX_CANDIDATES]:
+            distance = edit_distance(word, candidate, limit)
+            if distance <= limit:
+                close.append((distance, -similarity, candidate))
+        close.sort()
+        return [(-similarity, candidate) for _, similarity, candidate in close]
+
+    def search(self, query, limit=50):
+        """
+        Return ([(product id, score)], corrected query) for the nearest matches.
+        Every query word must resolve to some vocabulary word.
+        """
+        query_words = words(query)
+        if not query_words:
+            return [], ''
+        self._ensure_built()
+        with self._lock:
+            scores = None
+            corrected = []
+            for word in query_words:
+                if word in self._word_products:
+                    matches = [(1.0, word)]
+                else:
+                    matches = self.closest_words(word)
+                if not matches:
+                    return [], ''
+                corrected.append(matches[0][1])
+                word_scores = {}
+                for similarity, candidate in matches:
+                    for pk in self._word_products[candidate]:
+                        word_scores[pk] = max(word_scores.get(pk, 0.0), similarity)
+                if scores is None:
+                    scores = word_scores
+                else:
+                    scores = {pk: scores[pk] + s for pk, s in word_scores.items() if pk in scores}
+                if not scores:
+                    return [], ''
+        ranked = sorted(scores.items(), key=lambda item: (-item[1], item[0]))
+        return ranked[:limit], ' '.join(corrected)
+
+    def update_product(self, product):
+        with self._lock:
+            if self._built:
+                self._remove(product.pk)
+                self._add(product.pk, {f: getattr(product, f) for f in FIELDS})
+
+    def remove_product(self, pk):
+        with self._lock:
+            if self._built:
+                self._remove(pk)
+
+    def reset(self):
+        """Forget everything; the next query rebuilds from the database"""
+        with self._lock:
+            self._built = False
+
+
+trigram_index = TrigramIndex()
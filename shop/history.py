@@ -0,0 +1,116 @@
+"""
+Read paths for a customer's order history (account "My Orders").
+
+Pages are fetched with keyset pagination on (sort column, order_id), so every
+page is a bounded range over the (user, -created_at) index no matter how many
+orders the customer has. The latest OrderUpdate of each order on the page is
+loaded in the same query through correlated subqueries instead of one
+orderupdate_set lookup per row.
+"""
+from datetime import datetime
+
+from django.db.models import F, OuterRef, Q, Subquery
+
+from .models import Order, OrderUpdate
+
+# Sort options for the My Orders page: name -> (column, descending)
+ORDER_SORTS = {
+    'newest': ('created_at', True),
+    'oldest': ('created_at', False),
+    'items': ('total_items', True),
+    'amount': ('amount', True),
+    'subtotal': ('subtotal', True),
+}
+DEFAULT_SORT = 'newest'
+
+# Filters for the My Orders page: query parameter -> lookup on a stored column
+ORDER_FILTERS = {
+    'min_items': 'total_items__gte',
+    'max_items': 'total_items__lte',
+    'min_total': 'subtotal__gte',
+    'max_total': 'subtotal__lte',
+}
+
+ORDERS_PER_PAGE = 10
+
+
+def with_latest_update(queryset):
+    """
+    Annotate latest_update_desc, latest_update_status and latest_update_at
+    (None when the order has no updates) from the newest OrderUpdate row.
+    """
+    latest = OrderUpdate.objects.filter(order=OuterRef('pk')).order_by('-timestamp', '-update_id')
+    return queryset.annotate(
+        latest_update_desc=Subquery(latest.values('update_desc')[:1]),
+        latest_update_status=Subquery(latest.values('status_type')[:1]),
+        latest_update_at=Subquery(latest.values('timestamp')[:1]),
+    )
+
+
+def encode_cursor(order, column):
+    """Opaque seek cursor from the last order of a page"""
+    value = getattr(order, column)
+    if value is None:
+        value = ''
+    elif isinstance(value, datetime):
+        value = value.isoformat()
+    return f"{value}.{order.order_id}"
+
+
+def decode_cursor(cursor, column):
+    """Parse an encode_cursor value into (sort value, order_id) or None"""
+    try:
+        value, pk = cursor.rsplit('.', 1)
+        pk = int(pk)
+        if value == '':
+            return None, pk
+        if column == 'created_at':
+            return datetime.fromisoformat(value), pk
+        return int(value), pk
+    except (AttributeError, ValueError):
+        return None
+
+
+def _after(column, descending, value, pk):
+    """Rows that come after (value, pk) in the page order (NULLs last)"""
+    tie = 'lt' if descending else 'gt'
+    if value is None:
+        return Q(**{f'{column}__isnull': True, f'order_id__{tie}': pk})
+    return (
+        Q(**{f'{column}__{tie}': value})
+        | Q(**{column: value, f'order_id__{tie}': pk})
+        | Q(**{f'{column}__isnull': True})
+    )
+
+
+def parse_filters(params):
+    """Pick the valid ORDER_FILTERS values (non-negative integers) out of request.GET"""
+    filters = {}
+    for name in ORDER_FILTERS:
+        value = (params.get(name) or '').strip()
+        if value.isdigit():
+            filters[name] = int(value)
+    return filters
+
+
+def get_orders_page(user, sort=DEFAULT_SORT, cursor=None, limit=ORDERS_PER_PAGE, filters=None):
+    """
+    Return (orders, next_cursor) for one page of the user's orders, each
+    annotated with its latest update (see with_latest_update). `filters` is
+    a parse_filters() dict on the stored total_items/subtotal columns.
+    """
+    column, descending = ORDER_SORTS.get(sort, ORDER_SORTS[DEFAULT_SORT])
+    qs = Order.objects.filter(user=user, **{ORDER_FILTERS[name]: value for name, value in (filters or {}).items()})
+    position = decode_cursor(cursor, column) if cursor else None
+    if position:
+        qs = qs.filter(_after(column, descending, *position))
+    if descending:
+        ordering = (F(column).desc(nulls_last=True), '-order_id')
+    else:
+        ordering = (F(column).asc(nulls_last=True), 'order_id')
+    orders = list(with_latest_update(qs).order_by(*ordering)[:limit + 1])
+    next_cursor = None
+    if len(orders) > limit:
+        orders = orders[:limit]
+        next_cursor = encode_cursor(orders[-1], column)
+    return orders, next_cursor
@@ -0,0 +1,77 @@
+"""
+Idempotency keys for the checkout form and the payment callbacks.
+
+The checkout page is rendered with a one-off token (hidden `idempotency_key`
+field); the payment pages send theirs as an `Idempotency-Key` header. The
+token is hashed together with its owner into an IdempotencyKey row inserted in
+the same transaction as the write it guards, so a double-click, a browser
+retry or a replayed callback finds that row and gets the original outcome
+back instead of creating a second order or a second status update.
+"""
+from datetime import timedelta
+import hashlib
+import secrets
+
+from django.conf import settings
+from django.utils import timezone
+
+from .models import IdempotencyKey
+
+FORM_FIELD = 'idempotency_key'
+HEADER = 'HTTP_IDEMPOTENCY_KEY'
+MAX_TOKEN_LENGTH = 128
+
+SCOPE_CHECKOUT = 'checkout'
+SCOPE_UPI = 'upi_payment'
+SCOPE_CARD = 'card_payment'
+
+
+def new_token():
+    """A fresh client token to embed in a rendered form"""
+    return secrets.token_urlsafe(24)
+
+
+def request_token(request):
+    """The client supplied token (form field or header), or '' when absent/invalid"""
+    token = (request.POST.get(FORM_FIELD) or request.META.get(HEADER) or '').strip()
+    if len(token) > MAX_TOKEN_LENGTH:
+        return ''
+    return token
+
+
+def make_key(owner, token):
+    """Hash owner + token so keys from different users/orders never collide"""
+    return hashlib.sha256(f'{owner}:{token}'.encode()).hexdigest()
+
+
+def expiry():
+    return timezone.now() + timedelta(seconds=getattr(settings, 'IDEMPOTENCY_KEY_TTL', 24 * 60 * 60))
+
+
+def lookup(scope, key):
+    """Return the live IdempotencyKey for (scope, key), dropping it if it has expired"""
+    if not key:
+        return None
+    record = IdempotencyKey.objects.select_related('order').filter(scope=scope, key=key).first()
+    if record is not None and record.expires_at <= timezone.now():
+        record.delete()
+        return None
+    return record
+
+
+def remember(scope, key, order=None, response='', order_id=None):
+    """
+    Insert the key row. Call inside the transaction that performs the write so
+    a concurrent duplicate fails on the unique constraint and rolls back.
+    """
+    if order is not None:
+        order_id = order.pk
+    return IdempotencyKey.objects.create(
+        scope=scope, key=key, order_id=order_id, response=response, expires_at=expiry(),
+    )
+
+
+def purge_expired():
+    """Delete expired keys; returns the number removed"""
+    deleted, _ = IdempotencyKey.objects.filter(expires_at__lte=timezone.now()).delete()
+    return deleted
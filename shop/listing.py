@@ -0,0 +1,64 @@
+from datetime import date
+
+from django.db.models import Q
+
+from .models import Product
+
+# Category pages served by the shared category view: slug -> (category, template)
+CATEGORY_PAGES = {
+    'men': ("Men's Fashion", 'shop/men.html'),
+    'women': ("Women's Fashion", 'shop/women.html'),
+    'kids': ("Kids Wear", 'shop/kids.html'),
+}
+
+PAGE_SIZE = 24
+MAX_PAGE_SIZE = 96
+
+# Only the columns the category templates and the load-more endpoint use
+LISTING_FIELDS = ('id', 'product_name', 'category', 'price', 'image', 'pub_date')
+
+
+def encode_cursor(product):
+    """Build an opaque seek cursor from the last product of a page"""
+    return f"{product.pub_date.isoformat()}.{product.id}"
+
+
+def decode_cursor(cursor):
+    """Parse a cursor produced by encode_cursor, returning (pub_date, id) or None"""
+    try:
+        pub_date, pk = cursor.rsplit('.', 1)
+        return date.fromisoformat(pub_date), int(pk)
+    except (AttributeError, ValueError):
+        return None
+
+
+def get_category_page(category, cursor=None, limit=PAGE_SIZE):
+    """
+    Return (products, next_cursor) for one page of a category, newest first.
+
+    Uses keyset pagination on (pub_date, id) so every page is a bounded
+    index range scan regardless of how deep into the category it is.
+    """
+    limit = max(1, min(limit, MAX_PAGE_SIZE))
+    qs = Product.objects.filter(category=category).only(*LISTING_FIELDS)
+    position = decode_cursor(cursor) if cursor else None
+    if position:
+        pub_date, pk = position
+        qs = qs.filter(Q(pub_date__lt=pub_date) | Q(pub_date=pub_date, id__lt=pk))
+    products = list(qs.order_by('-pub_date', '-id')[:limit + 1])
+    next_cursor = None
+    if len(products) > limit:
+        products = products[:limit]
+        next_cursor = encode_cursor(products[-1])
+    return products, next_cursor
+
+
+def serialize_product(product):
+    """JSON-friendly representation of a listing row"""
+    return {
+        'id': product.id,
+        'product_name': product.product_name,
+        'category': product.category,
+        'price': product.price,
+        'image': str(product.image),
+    }
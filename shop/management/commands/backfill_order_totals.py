@@ -0,0 +1,31 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from shop.models import Order
+
+
+class Command(BaseCommand):
+    help = 'Recompute Order.total_items and Order.subtotal from OrderItem rows in primary-key batches'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000, help='Orders updated per UPDATE statement')
+
+    def handle(self, *args, **options):
+        batch_size = max(1, options['batch_size'])
+        totals = Order.totals_expressions()
+        last_pk = 0
+        updated = 0
+        while True:
+            pks = list(
+                Order.objects.filter(order_id__gt=last_pk)
+                .order_by('order_id')
+                .values_list('order_id', flat=True)[:batch_size]
+            )
+            if not pks:
+                break
+            last_pk = pks[-1]
+            # One set-based UPDATE per batch; each batch commits on its own
+            with transaction.atomic():
+                updated += Order.objects.filter(order_id__gte=pks[0], order_id__lte=last_pk).update(**totals)
+            self.stdout.write(f'Updated {updated} orders (through #{last_pk})')
+        self.stdout.write(self.style.SUCCESS(f'Order totals backfilled for {updated} orders'))
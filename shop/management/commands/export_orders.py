@@ -0,0 +1,29 @@
+import sys
+
+from django.core.management.base import BaseCommand
+
+from shop.exports import CHUNK_SIZE, FORMATS, iter_export
+from shop.models import Order
+
+
+class Command(BaseCommand):
+    help = 'Stream all orders (with their lines and latest update) as CSV or NDJSON'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--format', choices=sorted(FORMATS), default='csv')
+        parser.add_argument('--output', '-o', help='File to write (default: stdout)')
+        parser.add_argument('--chunk-size', type=int, default=CHUNK_SIZE, help='Orders fetched per round trip')
+        parser.add_argument('--since', help='Only orders created on or after this date (YYYY-MM-DD)')
+
+    def handle(self, *args, **options):
+        queryset = Order.objects.all()
+        if options['since']:
+            queryset = queryset.filter(created_at__date__gte=options['since'])
+        chunk_size = max(1, options['chunk_size'])
+        out = open(options['output'], 'w', newline='', encoding='utf-8') if options['output'] else sys.stdout
+        try:
+            for line in iter_export(queryset, options['format'], chunk_size):
+                out.write(line)
+        finally:
+            if out is not sys.stdout:
+                out.close()
@@ -0,0 +1,19 @@
+from django.core.management.base import BaseCommand
+
+from shop import notifications, outbox
+
+
+class Command(BaseCommand):
+    help = 'Email customers their new order updates (one email per order) and mark the updates notified'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=notifications.BATCH_SIZE, help='Updates read per batch')
+        parser.add_argument('--queue-only', action='store_true',
+                            help='Only queue the emails; leave delivery to send_queued_mail')
+
+    def handle(self, *args, **options):
+        flagged, queued = notifications.notify_pending(max(1, options['batch_size']))
+        self.stdout.write(f'Marked {flagged} updates notified, queued {queued} emails')
+        if queued and not options['queue_only']:
+            sent, retried, failed = outbox.drain()
+            self.stdout.write(f'Sent {sent}, will retry {retried}, failed {failed}')
@@ -0,0 +1,11 @@
+from django.core.management.base import BaseCommand
+
+from shop.idempotency import purge_expired
+
+
+class Command(BaseCommand):
+    help = 'Delete checkout/payment idempotency keys older than IDEMPOTENCY_KEY_TTL'
+
+    def handle(self, *args, **options):
+        deleted = purge_expired()
+        self.stdout.write(f'Deleted {deleted} expired idempotency keys')
@@ -0,0 +1,23 @@
+from datetime import date
+
+from django.core.management.base import BaseCommand, CommandError
+
+from shop.rollups import rebuild
+
+
+class Command(BaseCommand):
+    help = 'Recompute the DailySales/DailyProductSales rollups from the orders table'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--since', help='First day to rebuild (YYYY-MM-DD, default: first order)')
+        parser.add_argument('--until', help='Last day to rebuild (YYYY-MM-DD, default: last order)')
+        parser.add_argument('--chunk-days', type=int, default=7, help='Days rebuilt per transaction')
+
+    def handle(self, *args, **options):
+        try:
+            since = date.fromisoformat(options['since']) if options['since'] else None
+            until = date.fromisoformat(options['until']) if options['until'] else None
+        except ValueError as e:
+            raise CommandError(f'Invalid date: {e}')
+        days = rebuild(since, until, chunk_days=options['chunk_days'], log=self.stdout.write)
+        self.stdout.write(f'Rebuilt sales rollups for {days} day(s)')
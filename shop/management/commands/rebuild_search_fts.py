@@ -0,0 +1,28 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from shop.search_fts import install, is_selected, uninstall, fts5_supported
+
+
+class Command(BaseCommand):
+    help = 'Create (or recreate) the SQLite FTS5 search tables and reindex products and blog posts'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--drop', action='store_true', help='Drop and recreate the FTS tables and triggers first')
+        parser.add_argument('--remove', action='store_true', help='Only drop the FTS tables and triggers')
+
+    def handle(self, *args, **options):
+        if not fts5_supported():
+            raise CommandError('The default database is not SQLite with FTS5 support')
+        if options['remove']:
+            uninstall()
+            self.stdout.write(self.style.SUCCESS('Search FTS5 tables and triggers removed'))
+            return
+        if not is_selected():
+            self.stderr.write(self.style.WARNING(
+                "SHOP_SEARCH_BACKEND is not 'fts5': the triggers will slow down product and blog writes "
+                "without being used (remove them with --remove)"
+            ))
+        if options['drop']:
+            uninstall()
+        install()
+        self.stdout.write(self.style.SUCCESS('Search FTS5 index rebuilt'))
@@ -0,0 +1,25 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from shop import outbox
+
+
+class Command(BaseCommand):
+    help = 'Deliver queued emails (shop.outbox) over one SMTP connection, retrying failures with backoff'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=outbox.BATCH_SIZE, help='Messages claimed per round')
+        parser.add_argument('--loop', action='store_true', help='Keep running, polling for new mail')
+        parser.add_argument('--interval', type=float, default=5, help='Seconds between polls with --loop')
+
+    def handle(self, *args, **options):
+        batch_size = max(1, options['batch_size'])
+        while True:
+            purged = outbox.purge_sent()
+            sent, retried, failed = outbox.drain(batch_size=batch_size)
+            if sent or retried or failed or purged or not options['loop']:
+                self.stdout.write(f'Sent {sent}, will retry {retried}, failed {failed}, purged {purged}')
+            if not options['loop']:
+                break
+            time.sleep(options['interval'])
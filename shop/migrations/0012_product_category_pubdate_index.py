@@ -0,0 +1,17 @@
+# Generated by Django 5.2.18 on 2026-10-18 16:17
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('shop', '0011_remove_order_state_alter_order_item_json'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='product',
+            index=models.Index(fields=['category', '-pub_date', '-id'], name='product_cat_pubdate_idx'),
+        ),
+    ]
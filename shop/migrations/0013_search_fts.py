@@ -0,0 +1,28 @@
+# Creates the optional SQLite FTS5 search tables (see shop.search_fts) when
+# SHOP_SEARCH_BACKEND is 'fts5'. A no-op otherwise, or on databases without
+# FTS5 support; `manage.py rebuild_search_fts` installs them later.
+
+from django.db import migrations
+
+
+def create_fts_tables(apps, schema_editor):
+    from shop.search_fts import install, is_selected
+    if is_selected():
+        install(schema_editor.connection)
+
+
+def drop_fts_tables(apps, schema_editor):
+    from shop.search_fts import uninstall
+    uninstall(schema_editor.connection)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('shop', '0012_product_category_pubdate_index'),
+        ('blog', '0002_blogpost_conclusion'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_fts_tables, drop_fts_tables),
+    ]
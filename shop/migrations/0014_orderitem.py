@@ -0,0 +1,33 @@
+# Generated by Django 5.2.18 on 2026-10-18 16:23
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('shop', '0013_search_fts'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='OrderItem',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('cart_key', models.CharField(blank=True, default='', help_text='Cart key the line was submitted under', max_length=100)),
+                ('name', models.CharField(help_text='Product name at the time of purchase', max_length=100)),
+                ('qty', models.PositiveIntegerField(default=1)),
+                ('unit_price', models.IntegerField(default=0)),
+                ('size', models.CharField(blank=True, default='', max_length=20)),
+                ('color', models.CharField(blank=True, default='', max_length=30)),
+                ('order', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='items', to='shop.order')),
+                ('product', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='order_items', to='shop.product')),
+            ],
+            options={
+                'verbose_name': 'Order Item',
+                'verbose_name_plural': 'Order Items',
+                'ordering': ['id'],
+            },
+        ),
+    ]
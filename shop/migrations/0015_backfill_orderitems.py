@@ -0,0 +1,94 @@
+# Backfills OrderItem rows from Order.item_json in primary-key chunks so the
+# migration never holds the whole orders table in memory.
+#
+# Pricing differs on purpose from OrderItem.build_for_order, which prices new
+# lines from Product.price at checkout time. For past orders the only record
+# of what a line cost is the price stored in its cart JSON. Today's
+# Product.price may have changed since. So backfilled lines keep the cart
+# price, and their subtotal reflects the order as it was placed.
+
+import json
+import re
+
+from django.db import migrations
+
+CHUNK_SIZE = 500
+CART_KEY_RE = re.compile(r'^pr(\d+)')
+
+
+def parse_lines(item_json):
+    # Frozen copy of shop.models.parse_item_json as of this migration
+    try:
+        cart = json.loads(item_json or '{}')
+    except (TypeError, ValueError):
+        return []
+    if not isinstance(cart, dict):
+        return []
+    lines = []
+    for key, value in cart.items():
+        if not isinstance(value, list) or not value:
+            continue
+        try:
+            qty = int(value[0])
+            price = int(float(value[2])) if len(value) > 2 else 0
+        except (TypeError, ValueError):
+            continue
+        if qty <= 0:
+            continue
+        match = CART_KEY_RE.match(str(key))
+        lines.append({
+            'cart_key': str(key)[:100],
+            'product_id': int(match.group(1)) if match else None,
+            'name': str(value[1] if len(value) > 1 else '')[:100],
+            'qty': qty,
+            'unit_price': price,
+            'size': str(value[3] or '')[:20] if len(value) > 3 else '',
+            'color': str(value[4] or '')[:30] if len(value) > 4 else '',
+        })
+    return lines
+
+
+def backfill_order_items(apps, schema_editor):
+    Order = apps.get_model('shop', 'Order')
+    OrderItem = apps.get_model('shop', 'OrderItem')
+    Product = apps.get_model('shop', 'Product')
+    product_ids = set(Product.objects.values_list('id', flat=True))
+
+    last_pk = 0
+    while True:
+        chunk = list(
+            Order.objects.filter(order_id__gt=last_pk)
+            .order_by('order_id')
+            .values_list('order_id', 'item_json')[:CHUNK_SIZE]
+        )
+        if not chunk:
+            break
+        last_pk = chunk[-1][0]
+        done = set(
+            OrderItem.objects.filter(order_id__in=[pk for pk, _ in chunk])
+            .values_list('order_id', flat=True).distinct()
+        )
+        items = []
+        for order_pk, item_json in chunk:
+            if order_pk in done:
+                continue
+            for line in parse_lines(item_json):
+                if line['product_id'] not in product_ids:
+                    line['product_id'] = None
+                items.append(OrderItem(order_id=order_pk, **line))
+        OrderItem.objects.bulk_create(items, batch_size=CHUNK_SIZE)
+
+
+def remove_order_items(apps, schema_editor):
+    apps.get_model('shop', 'OrderItem').objects.all().delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('shop', '0014_orderitem'),
+    ]
+
+    operations = [
+        migrations.RunPython(backfill_order_items, remove_order_items),
+    ]
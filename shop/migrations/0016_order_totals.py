@@ -0,0 +1,23 @@
+# Generated by Django 5.2.18 on 2026-10-18 16:24
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('shop', '0015_backfill_orderitems'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='order',
+            name='subtotal',
+            field=models.IntegerField(db_index=True, default=0, help_text='Server-computed sum of qty x unit price'),
+        ),
+        migrations.AddField(
+            model_name='order',
+            name='total_items',
+            field=models.PositiveIntegerField(db_index=True, default=0, help_text='Total quantity across order lines', verbose_name='Items'),
+        ),
+    ]
@@ -0,0 +1,58 @@
+# Links existing orders to their customer's account by matching emails
+# case-insensitively, in primary-key chunks with one UPDATE per account.
+# Only verified accounts are linked; the rest get their guest orders when
+# they verify (shop.orders.link_guest_orders).
+
+from collections import defaultdict
+
+from django.conf import settings
+from django.db import migrations
+from django.db.models.functions import Lower
+
+CHUNK_SIZE = 1000
+
+
+def link_orders(apps, schema_editor):
+    Order = apps.get_model('shop', 'Order')
+    User = apps.get_model(*settings.AUTH_USER_MODEL.split('.'))
+
+    last_pk = 0
+    while True:
+        chunk = list(
+            Order.objects.filter(order_id__gt=last_pk)
+            .order_by('order_id')
+            .values_list('order_id', 'email', 'user_id')[:CHUNK_SIZE]
+        )
+        if not chunk:
+            break
+        last_pk = chunk[-1][0]
+        by_email = defaultdict(list)
+        for order_pk, email, user_id in chunk:
+            email = (email or '').strip().lower()
+            if email and user_id is None:
+                by_email[email].append(order_pk)
+        if not by_email:
+            continue
+        users = (
+            User.objects.annotate(email_lower=Lower('email'))
+            .filter(email_lower__in=list(by_email), is_email_verified=True)
+            .values_list('email_lower', 'pk')
+        )
+        for email, user_pk in users:
+            Order.objects.filter(order_id__in=by_email[email]).update(user_id=user_pk)
+
+
+def unlink_orders(apps, schema_editor):
+    apps.get_model('shop', 'Order').objects.update(user=None)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('shop', '0018_order_user'),
+        ('account', '0003_remove_user_role_user_first_name_and_more'),
+    ]
+
+    operations = [
+        migrations.RunPython(link_orders, unlink_orders),
+    ]
@@ -0,0 +1,49 @@
+# Generated by Django 5.2.18 on 2026-10-18 16:38
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('shop', '0020_order_admin_indexes'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DailySales',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('day', models.DateField()),
+                ('payment_method', models.CharField(max_length=20)),
+                ('payment_status', models.CharField(max_length=20)),
+                ('order_status', models.CharField(max_length=20)),
+                ('city', models.CharField(max_length=70)),
+                ('orders', models.IntegerField(default=0)),
+                ('revenue', models.BigIntegerField(default=0, help_text='Sum of Order.amount')),
+                ('items', models.IntegerField(default=0, help_text='Sum of Order.total_items')),
+            ],
+            options={
+                'verbose_name': 'Sales Dashboard',
+                'verbose_name_plural': 'Sales Dashboard',
+                'constraints': [models.UniqueConstraint(fields=('day', 'payment_method', 'payment_status', 'order_status', 'city'), name='unique_daily_sales_bucket')],
+            },
+        ),
+        migrations.CreateModel(
+            name='DailyProductSales',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('day', models.DateField()),
+                ('orders', models.IntegerField(default=0)),
+                ('quantity', models.IntegerField(default=0)),
+                ('revenue', models.BigIntegerField(default=0)),
+                ('product', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='daily_sales', to='shop.product')),
+            ],
+            options={
+                'verbose_name': 'Daily Product Sales',
+                'verbose_name_plural': 'Daily Product Sales',
+                'constraints': [models.UniqueConstraint(fields=('day', 'product'), name='unique_daily_product_sales')],
+            },
+        ),
+    ]
@@ -0,0 +1,17 @@
+# Generated by Django 5.2.18 on 2026-10-18 16:44
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('shop', '0022_outgoing_email'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='orderupdate',
+            index=models.Index(condition=models.Q(('is_customer_notified', False)), fields=['update_id'], name='orderupdate_unnotified_idx'),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.2.18 on 2026-10-18 17:12
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('shop', '0023_orderupdate_unnotified_idx'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='outgoingemail',
+            name='sensitive',
+            field=models.BooleanField(default=False, help_text='Carries a one-time code or link; the body is redacted once it is sent or fails'),
+        ),
+    ]
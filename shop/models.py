@@ -1,4 +1,9 @@
+import json
+import re
+
+from django.conf import settings
 from django.db import models
+from django.db.models.functions import Coalesce
 
 # Create your models here.
 
@@ -12,6 +17,12 @@ class Product(models.Model):
     pub_date=models.DateField()
     image=models.ImageField(upload_to="shop/images", default="")
 
+    class Meta:
+        indexes = [
+            # Keyset pagination for the category pages (shop.listing)
+            models.Index(fields=['category', '-pub_date', '-id'], name='product_cat_pubdate_idx'),
+        ]
+
     def __str__(self):
             return self.product_name
         
@@ -60,6 +71,9 @@ class Order(models.Model):
     city = models.CharField(max_length=70)
     zip_code = models.CharField(max_length=20)
     amount = models.IntegerField(default=0)
+    # Denormalised from the order lines at write time (see set_totals / refresh_totals)
+    total_items = models.PositiveIntegerField('Items', default=0, db_index=True, help_text="Total quantity across order lines")
+    subtotal = models.IntegerField(default=0, db_index=True, help_text="Server-computed sum of qty x unit price")
     created_at = models.DateTimeField(auto_now_add=True, null=True, blank=True)
     payment_method = models.CharField(max_length=20, choices=PAYMENT_METHOD_CHOICES, default='cc')
     payment_status = models.CharField(max_length=20, choices=PAYMENT_STATUS_CHOICES, default='pending')
@@ -69,32 +83,174 @@ class Order(models.Model):
     expected_delivery_date = models.DateField(blank=True, null=True, help_text="Expected delivery date")
     delivered_date = models.DateField(blank=True, null=True, help_text="Actual delivery date")
     notes = models.TextField(blank=True, null=True, help_text="Internal notes about the order")
+    # Set at checkout (and backfilled by email); the composite index below covers lookups by user
+    user = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.SET_NULL, null=True, blank=True, db_index=False, related_name='orders')
     
     class Meta:
         ordering = ['-created_at']
         verbose_name = 'Order'
         verbose_name_plural = 'Orders'
+        indexes = [
+            # "My Orders": WHERE user_id = ? ORDER BY created_at DESC
+            models.Index(fields=['user', '-created_at'], name='order_user_created_idx'),
+            # Admin changelist: default ordering, status filter, city filter and indexed search
+            models.Index(fields=['-created_at'], name='order_created_idx'),
+            models.Index(fields=['order_status', '-created_at'], name='order_status_created_idx'),
+            models.Index(fields=['city'], name='order_city_idx'),
+            models.Index(fields=['phone'], name='order_phone_idx'),
+            models.Index(fields=['tracking_number'], name='order_tracking_idx'),
+            models.Index(fields=['email'], name='order_email_idx'),
+        ]
     
     def __str__(self):
         return f"Order #{self.order_id} - {self.name}"
     
     def get_total_items(self):
-        """Calculate total number of items in order"""
-        try:
-            import json
-            items = json.loads(self.item_json)
-            total = 0
-            for key, value in items.items():
-                if isinstance(value, list) and len(value) > 0:
-                    total += value[0]  # quantity is first element
-            return total
-        except:
-            return 0
+        """Total number of items in order (stored column, no item parsing)"""
+        return self.total_items
+    
+    def set_totals(self, items):
+        """Set total_items and subtotal from OrderItem objects (not saved)"""
+        self.total_items = sum(item.qty for item in items)
+        self.subtotal = sum(item.line_total for item in items)
+    
+    def refresh_totals(self):
+        """Recompute the stored totals from the OrderItem rows with one UPDATE"""
+        Order.objects.filter(pk=self.pk).update(**Order.totals_expressions())
+        self.refresh_from_db(fields=['total_items', 'subtotal'])
+    
+    @staticmethod
+    def totals_expressions():
+        """Correlated subqueries computing total_items/subtotal from OrderItem rows"""
+        lines = OrderItem.objects.filter(order=models.OuterRef('pk')).order_by().values('order')
+        return {
+            'total_items': Coalesce(
+                models.Subquery(lines.annotate(n=models.Sum('qty')).values('n')), 0),
+            'subtotal': Coalesce(
+                models.Subquery(lines.annotate(t=models.Sum(models.F('qty') * models.F('unit_price'))).values('t')), 0),
+        }
+    
+    @property
+    def line_items(self):
+        """
+        Order lines as OrderItem objects. Uses the stored OrderItem rows (or the
+        prefetched `items`) and falls back to parsing item_json for orders that
+        have not been backfilled yet.
+        """
+        items = list(self.items.all())
+        if items:
+            return items
+        return [OrderItem(order=self, **line) for line in parse_item_json(self.item_json)]
+    
+    def get_items_dict(self):
+        """Cart-style {key: [qty, name, price, size, color]} built from the order lines"""
+        return {item.cart_key: [item.qty, item.name, item.unit_price, item.size, item.color] for item in self.line_items}
     
     def get_latest_update(self):
         """Get the latest order update"""
         return self.orderupdate_set.order_by('-timestamp').first()
 
+_CART_KEY_RE = re.compile(r'^pr(\d+)')
+
+
+def parse_item_json(item_json):
+    """
+    Parse the client-built cart JSON ({"pr12_M_Red": [qty, name, price, size, color]})
+    into a list of OrderItem field dicts. Malformed entries are skipped.
+    """
+    try:
+        cart = json.loads(item_json or '{}')
+    except (TypeError, ValueError):
+        return []
+    if not isinstance(cart, dict):
+        return []
+    lines = []
+    for key, value in cart.items():
+        if not isinstance(value, list) or not value:
+            continue
+        try:
+            qty = int(value[0])
+            price = int(float(value[2])) if len(value) > 2 else 0
+        except (TypeError, ValueError):
+            continue
+        if qty <= 0:
+            continue
+        match = _CART_KEY_RE.match(str(key))
+        lines.append({
+            'cart_key': str(key)[:100],
+            'product_id': int(match.group(1)) if match else None,
+            'name': str(value[1] if len(value) > 1 else '')[:100],
+            'qty': qty,
+            'unit_price': price,
+            'size': str(value[3] or '')[:20] if len(value) > 3 else '',
+            'color': str(value[4] or '')[:30] if len(value) > 4 else '',
+        })
+    return lines
+
+
+class OrderItem(models.Model):
+    """One line of an order, normalised from the checkout cart JSON"""
+    order = models.ForeignKey(Order, on_delete=models.CASCADE, related_name='items')
+    product = models.ForeignKey(Product, on_delete=models.SET_NULL, null=True, blank=True, related_name='order_items')
+    cart_key = models.CharField(max_length=100, blank=True, default='', help_text="Cart key the line was submitted under")
+    name = models.CharField(max_length=100, help_text="Product name at the time of purchase")
+    qty = models.PositiveIntegerField(default=1)
+    unit_price = models.IntegerField(default=0)
+    size = models.CharField(max_length=20, blank=True, default='')
+    color = models.CharField(max_length=30, blank=True, default='')
+    
+    class Meta:
+        ordering = ['id']
+        verbose_name = 'Order Item'
+        verbose_name_plural = 'Order Items'
+    
+    @property
+    def line_total(self):
+        return self.qty * self.unit_price
+    
+    @classmethod
+    def build_for_order(cls, order):
+        """
+        Unsaved OrderItem rows for an order's item_json, ready for bulk_create.
+        Lines for a known product are priced from Product.price (one query);
+        the cart's own price is only used for lines with no such product.
+        """
+        lines = parse_item_json(order.item_json)
+        product_ids = {line['product_id'] for line in lines if line['product_id']}
+        products = Product.objects.only('id', 'price').in_bulk(product_ids) if product_ids else {}
+        items = []
+        for line in lines:
+            product = products.get(line['product_id'])
+            if product is None:
+                line['product_id'] = None
+            else:
+                line['unit_price'] = product.price
+            items.append(cls(order=order, **line))
+        return items
+    
+    def __str__(self):
+        return f"{self.qty} x {self.name} (Order #{self.order_id})"
+
+class IdempotencyKey(models.Model):
+    """
+    Remembers the outcome of a checkout or payment callback submitted under a
+    client token so a replayed request gets the original response instead of
+    writing again. Rows expire after settings.IDEMPOTENCY_KEY_TTL seconds.
+    """
+    scope = models.CharField(max_length=20)
+    key = models.CharField(max_length=64, help_text="sha256 of the owner and the client token")
+    order = models.ForeignKey(Order, on_delete=models.CASCADE, null=True, blank=True, related_name='+')
+    response = models.CharField(max_length=500, blank=True, default='', help_text="Original response body, if small")
+    expires_at = models.DateTimeField(db_index=True)
+    
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['scope', 'key'], name='unique_idempotency_scope_key'),
+        ]
+    
+    def __str__(self):
+        return f"{self.scope}:{self.key[:12]}"
+
 class OrderUpdate(models.Model):
     STATUS_TYPE_CHOICES = [
         ('order_placed', 'Order Placed'),
@@ -124,6 +280,10 @@ class OrderUpdate(models.Model):
         ordering = ['-timestamp']
         verbose_name = 'Order Update'
         verbose_name_plural = 'Order Updates'
+        indexes = [
+            # Only the (few) rows still waiting for shop.notifications
+            models.Index(fields=['update_id'], condition=models.Q(is_customer_notified=False), name='orderupdate_unnotified_idx'),
+        ]
     
     @property
     def order_id(self):
@@ -132,4 +292,84 @@ class OrderUpdate(models.Model):
     
     def __str__(self):
         order_id_val = self.order.order_id if self.order else 'N/A'
-        return f"Update #{self.update_id} - Order #{order_id_val} - {self.update_desc[:50]}"
\ No newline at end of file
+        return f"Update #{self.update_id} - Order #{order_id_val} - {self.update_desc[:50]}"
+
+class DailySales(models.Model):
+    """
+    Per-day order totals by payment method, payment status, order status and
+    city. Maintained incrementally by shop.rollups; rebuild with
+    `manage.py rebuild_sales_rollups`.
+    """
+    day = models.DateField()
+    payment_method = models.CharField(max_length=20)
+    payment_status = models.CharField(max_length=20)
+    order_status = models.CharField(max_length=20)
+    city = models.CharField(max_length=70)
+    orders = models.IntegerField(default=0)
+    revenue = models.BigIntegerField(default=0, help_text="Sum of Order.amount")
+    items = models.IntegerField(default=0, help_text="Sum of Order.total_items")
+    
+    class Meta:
+        verbose_name = 'Sales Dashboard'
+        verbose_name_plural = 'Sales Dashboard'
+        constraints = [
+            models.UniqueConstraint(
+                fields=['day', 'payment_method', 'payment_status', 'order_status', 'city'],
+                name='unique_daily_sales_bucket',
+            ),
+        ]
+    
+    def __str__(self):
+        return f"{self.day} {self.payment_method}/{self.payment_status}/{self.order_status} {self.city}"
+
+class DailyProductSales(models.Model):
+    """Per-day units and revenue of each product across placed orders (see shop.rollups)"""
+    day = models.DateField()
+    product = models.ForeignKey(Product, on_delete=models.CASCADE, related_name='daily_sales')
+    orders = models.IntegerField(default=0)
+    quantity = models.IntegerField(default=0)
+    revenue = models.BigIntegerField(default=0)
+    
+    class Meta:
+        verbose_name = 'Daily Product Sales'
+        verbose_name_plural = 'Daily Product Sales'
+        constraints = [
+            models.UniqueConstraint(fields=['day', 'product'], name='unique_daily_product_sales'),
+        ]
+    
+    def __str__(self):
+        return f"{self.day} product #{self.product_id}"
+
+class OutgoingEmail(models.Model):
+    """
+    Mail queued by request handlers and delivered by `manage.py send_queued_mail`
+    (see shop.outbox), so no request waits on the SMTP server.
+    """
+    STATUS_CHOICES = [
+        ('pending', 'Pending'),
+        ('sending', 'Sending'),
+        ('sent', 'Sent'),
+        ('failed', 'Failed'),
+    ]
+    
+    subject = models.CharField(max_length=255)
+    body = models.TextField()
+    html_body = models.TextField(blank=True, default='')
+    from_email = models.CharField(max_length=254, blank=True, default='')
+    to = models.JSONField(default=list, help_text="Recipient addresses")
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES, default='pending')
+    attempts = models.PositiveSmallIntegerField(default=0)
+    next_attempt_at = models.DateTimeField(help_text="When the worker may (re)try this message")
+    claim = models.CharField(max_length=32, blank=True, default='', help_text="Worker batch currently sending it")
+    last_error = models.TextField(blank=True, default='')
+    sensitive = models.BooleanField(default=False, help_text="Carries a one-time code or link; the body is redacted once it is sent or fails")
+    created_at = models.DateTimeField(auto_now_add=True)
+    sent_at = models.DateTimeField(null=True, blank=True)
+    
+    class Meta:
+        indexes = [
+            models.Index(fields=['status', 'next_attempt_at'], name='outbox_due_idx'),
+        ]
+    
+    def __str__(self):
+        return f"{self.subject} -> {', '.join(self.to)} ({self.status})"
@@ -0,0 +1,97 @@
+"""
+Customer order-status emails driven by OrderUpdate.is_customer_notified.
+
+`manage.py notify_customers` picks up un-notified timeline rows in batches
+(through a partial index on the flag). All pending updates of one order are
+coalesced into a single email, the batch's emails are queued in the outbox
+with one INSERT and the flag is flipped with one UPDATE, in the same
+transaction. The outbox then delivers everything over one SMTP connection
+(see shop.outbox), retrying failures.
+
+Updates older than settings.CUSTOMER_NOTIFY_MAX_AGE are flagged without an
+email, so a backlog of old rows never turns into a mail storm.
+"""
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import transaction
+from django.template.loader import render_to_string
+from django.utils import timezone
+
+from .models import OrderUpdate
+from . import outbox
+
+BATCH_SIZE = 500
+
+UPDATE_FIELDS = (
+    'update_id', 'order_id', 'status_type', 'update_desc', 'tracking_number', 'location', 'timestamp',
+    'order__email', 'order__name',
+)
+STATUS_LABELS = dict(OrderUpdate.STATUS_TYPE_CHOICES)
+
+
+def _pending(batch_size):
+    """Up to batch_size un-notified updates plus the rest of their orders' pending updates"""
+    pending = OrderUpdate.objects.filter(is_customer_notified=False)
+    first = list(
+        pending.select_for_update(skip_locked=True, of=('self',))
+        .order_by('update_id').values(*UPDATE_FIELDS)[:batch_size]
+    )
+    if not first:
+        return []
+    seen = {row['update_id'] for row in first}
+    order_ids = {row['order_id'] for row in first if row['order_id'] is not None}
+    # Coalesce: an order whose updates straddle the batch boundary still gets one email
+    rest = (
+        pending.select_for_update(skip_locked=True, of=('self',))
+        .filter(order_id__in=order_ids).exclude(update_id__in=seen)
+        .order_by('update_id').values(*UPDATE_FIELDS)
+    ) if order_ids else []
+    return first + list(rest)
+
+
+def build_message(order_id, name, email, updates):
+    """One OutgoingEmail covering all of an order's new updates (oldest first)"""
+    latest = updates[-1]
+    label = STATUS_LABELS.get(latest['status_type'], 'Update')
+    subject = f'Order #{order_id}: {label}' if len(updates) == 1 else f'Order #{order_id}: {len(updates)} updates'
+    context = {
+        'order_id': order_id,
+        'name': name,
+        'updates': [dict(row, label=STATUS_LABELS.get(row['status_type'], 'Update')) for row in updates],
+    }
+    return outbox.build(subject, render_to_string('shop/emails/order_updates.txt', context), email)
+
+
+def notify_batch(batch_size=BATCH_SIZE):
+    """
+    Queue emails for one batch of un-notified updates and flag them.
+    Returns (updates flagged, emails queued); (0, 0) once nothing is left.
+    """
+    cutoff = timezone.now() - timedelta(seconds=settings.CUSTOMER_NOTIFY_MAX_AGE)
+    with transaction.atomic():
+        rows = _pending(batch_size)
+        if not rows:
+            return 0, 0
+        by_order = {}
+        for row in rows:
+            if row['order_id'] is not None and row['order__email'] and row['timestamp'] >= cutoff:
+                by_order.setdefault(row['order_id'], []).append(row)
+        messages = [
+            build_message(order_id, updates[0]['order__name'], updates[0]['order__email'], updates)
+            for order_id, updates in by_order.items()
+        ]
+        outbox.enqueue_many(messages)
+        OrderUpdate.objects.filter(update_id__in=[row['update_id'] for row in rows]).update(is_customer_notified=True)
+    return len(rows), len(messages)
+
+
+def notify_pending(batch_size=BATCH_SIZE):
+    """Run notify_batch until no un-notified updates remain; returns the totals"""
+    flagged = queued = 0
+    while True:
+        batch_flagged, batch_queued = notify_batch(batch_size)
+        if not batch_flagged:
+            return flagged, queued
+        flagged += batch_flagged
+        queued += batch_queued
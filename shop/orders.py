@@ -0,0 +1,102 @@
+"""
+Order write paths shared by the shop views.
+"""
+from django.contrib.auth import get_user_model
+from django.db import IntegrityError, transaction
+
+from . import idempotency, rollups
+from .models import Order, OrderItem
+from .state_machine import order_state
+
+
+class CheckoutError(ValueError):
+    """Raised when checkout input cannot produce an order"""
+
+
+PAYMENT_METHODS = dict(Order.PAYMENT_METHOD_CHOICES)
+
+
+def place_order(*, items_json, name, email, phone, address, city, zip_code, amount=0, payment_method='cc', idempotency_key='', user=None):
+    """
+    Validate checkout input and create the Order, its OrderItem rows and the
+    initial OrderUpdate in a single transaction (three INSERT statements, one
+    commit). Raises CheckoutError when the input is unusable.
+
+    `user` is the signed-in customer. A guest checkout is attached to the
+    verified account that owns its email, if there is one.
+
+    With an idempotency_key (see shop.idempotency.make_key) the key row is
+    inserted in the same transaction; a repeat submission returns the order
+    created the first time and writes nothing.
+    """
+    if idempotency_key:
+        record = idempotency.lookup(idempotency.SCOPE_CHECKOUT, idempotency_key)
+        if record is not None and record.order is not None:
+            return record.order
+
+    if payment_method not in PAYMENT_METHODS:
+        raise CheckoutError('Please choose a valid payment method.')
+    try:
+        amount = max(0, int(amount))
+    except (TypeError, ValueError):
+        amount = 0
+
+    order = Order(
+        item_json=items_json,
+        name=name,
+        email=email,
+        address=address,
+        phone=phone,
+        city=city,
+        zip_code=zip_code,
+        amount=amount,
+        payment_method=payment_method,
+        payment_status=('cod_pending' if payment_method == 'cod' else 'pending'),
+        user=user,
+    )
+    # Parsed and product-checked before the transaction opens, so the write
+    # lock is held only for the inserts
+    items = OrderItem.build_for_order(order)
+    if not items:
+        raise CheckoutError('Your cart is empty. Add some items before checking out.')
+    order.set_totals(items)
+    if user is None:
+        order.user = verified_account(email)
+
+    try:
+        with transaction.atomic():
+            order.save()
+            if idempotency_key:
+                # Claimed before the line items so a racing duplicate stops here
+                idempotency.remember(idempotency.SCOPE_CHECKOUT, idempotency_key, order=order)
+            OrderItem.objects.bulk_create(items)
+            order_state.placed(order)
+            rollups.add_order(order, items)
+    except IntegrityError:
+        if not idempotency_key:
+            raise
+        # Lost the race to an identical submission; hand back its order
+        record = idempotency.lookup(idempotency.SCOPE_CHECKOUT, idempotency_key)
+        if record is None or record.order is None:
+            raise
+        return record.order
+    return order
+
+
+def verified_account(email):
+    """The account with a verified `email` (any case), or None"""
+    email = (email or '').strip()
+    if not email:
+        return None
+    return get_user_model().objects.filter(email__iexact=email, is_email_verified=True).first()
+
+
+def link_guest_orders(user):
+    """
+    Attach orders placed as a guest with the user's email to their account.
+    Call this only once the address is verified, so nobody can claim another
+    customer's orders by registering with their email.
+    """
+    if not user.email or not user.is_email_verified:
+        return 0
+    return Order.objects.filter(user__isnull=True, email__iexact=user.email).update(user=user)
@@ -0,0 +1,225 @@
+"""
+Database-backed email outbox.
+
+Views call `enqueue()`, which is a single INSERT, instead of talking to the
+mail server inside the request. `manage.py send_queued_mail` drains the
+table: due rows are claimed with a guarded UPDATE (so several workers never
+send the same message), sent over one SMTP connection that stays open for
+the whole batch, and marked sent with one UPDATE. Failed messages are retried
+with exponential backoff up to settings.OUTBOX_MAX_ATTEMPTS, then marked
+failed with the last error kept on the row.
+
+Messages queued with sensitive=True (one-time codes, reset links) have
+their body redacted in the same UPDATE that marks them sent or failed, so
+the secret does not sit in the table until purge_sent() runs.
+
+settings.OUTBOX_SEND_NOW (off by default) makes enqueue() also try to deliver
+the message straight away, for setups without a worker; a failure leaves it
+queued for the worker as usual.
+
+Works with any EMAIL_BACKEND, including locmem in tests.
+"""
+from datetime import timedelta
+import secrets
+
+from django.conf import settings
+from django.core.mail import EmailMultiAlternatives, get_connection
+from django.db.models import Case, F, TextField, Value, When
+from django.utils import timezone
+
+from .models import OutgoingEmail
+
+BATCH_SIZE = 100
+# A claimed message whose worker died becomes due again after this long
+CLAIM_TIMEOUT = timedelta(minutes=10)
+
+PENDING = 'pending'
+SENDING = 'sending'
+SENT = 'sent'
+FAILED = 'failed'
+
+REDACTED = '[redacted after delivery]'
+
+
+def build(subject, body, to, html_body='', from_email=None, sensitive=False):
+    """Unsaved OutgoingEmail; `to` is an address or a list of them"""
+    if isinstance(to, str):
+        to = [to]
+    return OutgoingEmail(
+        subject=subject,
+        body=body,
+        html_body=html_body or '',
+        from_email=from_email or settings.DEFAULT_FROM_EMAIL,
+        to=list(to),
+        next_attempt_at=timezone.now(),
+        sensitive=sensitive,
+    )
+
+
+def enqueue(subject, body, to, html_body='', from_email=None, sensitive=False):
+    """Queue a message for the worker (see OUTBOX_SEND_NOW for sending it inline)"""
+    outgoing = build(subject, body, to, html_body, from_email, sensitive)
+    outgoing.save()
+    if settings.OUTBOX_SEND_NOW:
+        send_now(outgoing)
+    return outgoing
+
+
+def enqueue_many(messages):
+    """Queue unsaved OutgoingEmail objects (see build) with one INSERT"""
+    return OutgoingEmail.objects.bulk_create(messages, batch_size=500)
+
+
+def is_sent(pk):
+    """Whether OutgoingEmail `pk` has been delivered"""
+    return OutgoingEmail.objects.filter(pk=pk, status=SENT).exists()
+
+
+def _redacted(field):
+    """Expression blanking a sensitive row's body column in an UPDATE"""
+    return Case(When(sensitive=True, then=Value(REDACTED)), default=F(field), output_field=TextField())
+
+
+def retry_delay(attempts):
+    """Backoff before attempt number attempts + 1"""
+    delay = settings.OUTBOX_RETRY_DELAY * 2 ** max(0, attempts - 1)
+    return timedelta(seconds=min(delay, settings.OUTBOX_MAX_RETRY_DELAY))
+
+
+def claim(batch_size=BATCH_SIZE):
+    """Claim up to batch_size due messages for this worker and return them"""
+    now = timezone.now()
+    due = list(
+        OutgoingEmail.objects.filter(status__in=(PENDING, SENDING), next_attempt_at__lte=now)
+        .order_by('next_attempt_at').values_list('pk', flat=True)[:batch_size]
+    )
+    if not due:
+        return []
+    token = secrets.token_hex(16)
+    # Guarded on the same conditions, so a message another worker claimed in
+    # the meantime is left alone
+    OutgoingEmail.objects.filter(
+        pk__in=due, status__in=(PENDING, SENDING), next_attempt_at__lte=now
+    ).update(status=SENDING, claim=token, next_attempt_at=now + CLAIM_TIMEOUT)
+    return list(OutgoingEmail.objects.filter(claim=token, status=SENDING).order_by('pk'))
+
+
+def to_message(outgoing, connection):
+    message = EmailMultiAlternatives(
+        outgoing.subject, outgoing.body, outgoing.from_email or settings.DEFAULT_FROM_EMAIL,
+        outgoing.to, connection=connection,
+    )
+    if outgoing.html_body:
+        message.attach_alternative(outgoing.html_body, 'text/html')
+    return message
+
+
+def _reconnect(connection):
+    try:
+        connection.close()
+    except Exception:
+        pass
+    try:
+        connection.open()
+    except Exception:
+        # The next send_messages() call opens it again (and reports the error)
+        pass
+
+
+def _failed(outgoing, error):
+    attempts = outgoing.attempts + 1
+    fields = {'attempts': attempts, 'last_error': str(error)[:1000], 'claim': ''}
+    if attempts >= settings.OUTBOX_MAX_ATTEMPTS:
+        fields.update(status=FAILED, body=_redacted('body'), html_body=_redacted('html_body'))
+    else:
+        fields.update(status=PENDING, next_attempt_at=timezone.now() + retry_delay(attempts))
+    OutgoingEmail.objects.filter(pk=outgoing.pk, claim=outgoing.claim).update(**fields)
+    return fields['status']
+
+
+def send_batch(messages, connection):
+    """Send claimed messages over an open connection; returns (sent, retried, failed)"""
+    sent = []
+    retried = failed = 0
+    for outgoing in messages:
+        try:
+            if not connection.send_messages([to_message(outgoing, connection)]):
+                raise RuntimeError('Message was not accepted by the mail backend')
+        except Exception as e:
+            if _failed(outgoing, e) == FAILED:
+                failed += 1
+            else:
+                retried += 1
+            _reconnect(connection)
+        else:
+            sent.append(outgoing.pk)
+    if sent:
+        OutgoingEmail.objects.filter(pk__in=sent, claim=messages[0].claim).update(
+            status=SENT, sent_at=timezone.now(), attempts=F('attempts') + 1, claim='', last_error='',
+            body=_redacted('body'), html_body=_redacted('html_body'),
+        )
+    return len(sent), retried, failed
+
+
+def drain(connection=None, batch_size=BATCH_SIZE):
+    """
+    Send everything that is due, batch by batch, over one connection.
+    Returns (sent, retried, failed) totals.
+    """
+    own_connection = connection is None
+    if own_connection:
+        connection = get_connection(fail_silently=False)
+    totals = [0, 0, 0]
+    try:
+        opened = False
+        while True:
+            messages = claim(batch_size)
+            if not messages:
+                break
+            if not opened:
+                try:
+                    connection.open()
+                except Exception as e:
+                    # Server unreachable: count one attempt for the batch and
+                    # leave the rest of the queue for the next run
+                    for outgoing in messages:
+                        totals[1 if _failed(outgoing, e) == PENDING else 2] += 1
+                    break
+                opened = True
+            for i, count in enumerate(send_batch(messages, connection)):
+                totals[i] += count
+    finally:
+        if own_connection:
+            connection.close()
+    return tuple(totals)
+
+
+def send_now(outgoing):
+    """
+    Deliver one queued message immediately and return its new status. A failed
+    attempt is counted and the message stays due for the worker.
+    """
+    token = secrets.token_hex(16)
+    claimed = OutgoingEmail.objects.filter(pk=outgoing.pk, status=PENDING).update(
+        status=SENDING, claim=token, next_attempt_at=timezone.now() + CLAIM_TIMEOUT,
+    )
+    if claimed:
+        outgoing.status, outgoing.claim = SENDING, token
+        connection = get_connection(fail_silently=False)
+        try:
+            send_batch([outgoing], connection)
+        finally:
+            try:
+                connection.close()
+            except Exception:
+                pass
+    outgoing.refresh_from_db(fields=['status', 'attempts', 'last_error', 'sent_at', 'claim', 'next_attempt_at', 'body', 'html_body'])
+    return outgoing.status
+
+
+def purge_sent(keep=None):
+    """Delete sent messages older than settings.OUTBOX_KEEP_SENT seconds"""
+    keep = settings.OUTBOX_KEEP_SENT if keep is None else keep
+    cutoff = timezone.now() - timedelta(seconds=keep)
+    deleted, _ = OutgoingEmail.objects.filter(status=SENT, sent_at__lt=cutoff).delete()
+    return deleted
@@ -0,0 +1,248 @@
+"""
+Incrementally maintained sales rollups (DailySales, DailyProductSales).
+
+Every order write that can move an order between rollup buckets reports the
+change here as a delta: checkout adds the order (and its product lines), the
+state machine and the admin form move it from its old bucket to its new one,
+and deleting an order takes it back out. Each delta is an UPDATE ... SET
+col = col + n on the bucket row, inserting the row on first use, so the cost
+does not grow with the number of orders. `manage.py rebuild_sales_rollups`
+recomputes any range of days from the orders themselves.
+"""
+from collections import defaultdict
+from datetime import datetime, time, timedelta
+
+from django.db import IntegrityError, transaction
+from django.db.models import Count, F, Max, Min, Sum
+from django.db.models.functions import TruncDate
+from django.utils import timezone
+
+from .models import DailyProductSales, DailySales, Order, OrderItem
+
+DASHBOARD_DAYS = 30
+DASHBOARD_MAX_DAYS = 366
+DASHBOARD_DAY_CHOICES = (7, 30, 90, 365)
+# Rows shown in the city and product tables
+TOP_ROWS = 10
+
+BUCKET_FIELDS = ('payment_method', 'payment_status', 'order_status', 'city')
+# Order columns a rollup delta needs
+ORDER_FIELDS = ('created_at', 'amount', 'total_items') + BUCKET_FIELDS
+
+
+def order_day(created_at):
+    return timezone.localdate(created_at) if created_at else None
+
+
+def order_values(order):
+    """Rollup-relevant values of an Order instance as a dict"""
+    return {field: getattr(order, field) for field in ORDER_FIELDS}
+
+
+def _bucket(values):
+    day = order_day(values['created_at'])
+    if day is None:
+        return None
+    return (day,) + tuple(values[field] or '' for field in BUCKET_FIELDS)
+
+
+def _upsert(model, lookup, increments):
+    """Add `increments` to the row matching lookup, creating it if needed"""
+    changes = {field: F(field) + value for field, value in increments.items()}
+    if model.objects.filter(**lookup).update(**changes):
+        return
+    try:
+        with transaction.atomic():
+            model.objects.create(**lookup, **increments)
+    except IntegrityError:
+        # Created concurrently; add to it instead
+        model.objects.filter(**lookup).update(**changes)
+
+
+def apply_order_deltas(deltas):
+    """deltas: {bucket: [orders, revenue, items]}"""
+    for bucket, (orders, revenue, items) in deltas.items():
+        if orders or revenue or items:
+            lookup = dict(zip(('day',) + BUCKET_FIELDS, bucket))
+            _upsert(DailySales, lookup, {'orders': orders, 'revenue': revenue, 'items': items})
+
+
+def apply_product_deltas(deltas):
+    """deltas: {(day, product_id): [orders, quantity, revenue]}"""
+    for (day, product_id), (orders, quantity, revenue) in deltas.items():
+        if orders or quantity or revenue:
+            _upsert(DailyProductSales, {'day': day, 'product_id': product_id},
+                    {'orders': orders, 'quantity': quantity, 'revenue': revenue})
+
+
+def _add(deltas, values, sign):
+    bucket = _bucket(values)
+    if bucket is not None:
+        delta = deltas[bucket]
+        delta[0] += sign
+        delta[1] += sign * (values['amount'] or 0)
+        delta[2] += sign * (values['total_items'] or 0)
+
+
+def _product_deltas(day, lines, sign):
+    """lines: iterable of (product_id, quantity, revenue)"""
+    deltas = defaultdict(lambda: [0, 0, 0])
+    for product_id, quantity, revenue in lines:
+        if product_id is None:
+            continue
+        delta = deltas[(day, product_id)]
+        # One order per product, however many lines (sizes/colours) it has
+        delta[0] = sign
+        delta[1] += sign * quantity
+        delta[2] += sign * revenue
+    return deltas
+
+
+def add_order(order, items):
+    """A new order and its OrderItem lines (call inside the checkout transaction)"""
+    deltas = defaultdict(lambda: [0, 0, 0])
+    _add(deltas, order_values(order), 1)
+    apply_order_deltas(deltas)
+    day = order_day(order.created_at)
+    if day is not None:
+        lines = ((item.product_id, item.qty, item.line_total) for item in items)
+        apply_product_deltas(_product_deltas(day, lines, 1))
+
+
+def remove_order(order):
+    """An order about to be deleted (its lines are still in the database)"""
+    deltas = defaultdict(lambda: [0, 0, 0])
+    _add(deltas, order_values(order), -1)
+    apply_order_deltas(deltas)
+    day = order_day(order.created_at)
+    if day is not None:
+        lines = (
+            OrderItem.objects.filter(order_id=order.pk)
+            .values_list('product_id', 'qty', F('qty') * F('unit_price'))
+        )
+        apply_product_deltas(_product_deltas(day, lines, -1))
+
+
+def move_orders(changes):
+    """changes: iterable of (old values, new values) dicts with ORDER_FIELDS keys"""
+    deltas = defaultdict(lambda: [0, 0, 0])
+    for old, new in changes:
+        _add(deltas, old, -1)
+        _add(deltas, new, 1)
+    apply_order_deltas(deltas)
+
+
+def rebuild(start=None, end=None, chunk_days=7, log=None):
+    """
+    Recompute the rollups for days in [start, end] (default: every day with
+    orders), chunk_days at a time, each chunk in its own transaction.
+    Returns the number of days processed.
+    """
+    if start is None or end is None:
+        bounds = Order.objects.aggregate(first=Min('created_at'), last=Max('created_at'))
+        start = start or order_day(bounds['first'])
+        end = end or order_day(bounds['last'])
+    if start is None or end is None or start > end:
+        return 0
+
+    day = start
+    total = 0
+    step = timedelta(days=max(1, chunk_days))
+    while day <= end:
+        chunk_end = min(end, day + step - timedelta(days=1))
+        _rebuild_range(day, chunk_end)
+        total += (chunk_end - day).days + 1
+        if log:
+            log(f'Rebuilt {day} .. {chunk_end}')
+        day = chunk_end + timedelta(days=1)
+    return total
+
+
+@transaction.atomic
+def _rebuild_range(start, end):
+    DailySales.objects.filter(day__gte=start, day__lte=end).delete()
+    DailyProductSales.objects.filter(day__gte=start, day__lte=end).delete()
+    # Local-day boundaries, so the range scan can use the created_at index
+    lower = timezone.make_aware(datetime.combine(start, time.min))
+    upper = timezone.make_aware(datetime.combine(end + timedelta(days=1), time.min))
+    in_range = {'created_at__gte': lower, 'created_at__lt': upper}
+
+    rows = (
+        Order.objects.filter(**in_range)
+        .annotate(day=TruncDate('created_at'))
+        .values('day', *BUCKET_FIELDS)
+        .annotate(n=Count('order_id'), revenue_sum=Sum('amount'), items_sum=Sum('total_items'))
+        .order_by()
+    )
+    DailySales.objects.bulk_create([
+        DailySales(
+            day=row['day'], orders=row['n'], revenue=row['revenue_sum'] or 0, items=row['items_sum'] or 0,
+            **{field: row[field] or '' for field in BUCKET_FIELDS},
+        )
+        for row in rows
+    ], batch_size=1000)
+
+    product_rows = (
+        OrderItem.objects.filter(product__isnull=False, **{f'order__{key}': value for key, value in in_range.items()})
+        .annotate(day=TruncDate('order__created_at'))
+        .values('day', 'product_id')
+        .annotate(
+            n=Count('order_id', distinct=True),
+            quantity=Sum('qty'),
+            revenue_sum=Sum(F('qty') * F('unit_price')),
+        )
+        .order_by()
+    )
+    DailyProductSales.objects.bulk_create([
+        DailyProductSales(
+            day=row['day'], product_id=row['product_id'], orders=row['n'],
+            quantity=row['quantity'] or 0, revenue=row['revenue_sum'] or 0,
+        )
+        for row in product_rows
+    ], batch_size=1000)
+
+
+def _totals(rows):
+    return [
+        dict(row, aov=row['revenue'] // row['orders'] if row['orders'] else 0)
+        for row in rows
+    ]
+
+
+def dashboard(days=DASHBOARD_DAYS):
+    """
+    Figures for the admin sales dashboard over the last `days` days, read from
+    the rollup tables only (a few hundred rows however many orders there are).
+    """
+    end = timezone.localdate()
+    start = end - timedelta(days=days - 1)
+    sales = DailySales.objects.filter(day__gte=start, day__lte=end)
+    sums = {'orders': Sum('orders'), 'revenue': Sum('revenue'), 'items': Sum('items')}
+
+    totals = sales.aggregate(**sums)
+    totals = {key: value or 0 for key, value in totals.items()}
+    totals['aov'] = totals['revenue'] // totals['orders'] if totals['orders'] else 0
+
+    def breakdown(field, limit=None):
+        rows = sales.values(label=F(field)).annotate(**sums).order_by('-revenue', 'label')
+        return _totals(rows[:limit] if limit else rows)
+
+    return {
+        'days': days,
+        'start': start,
+        'end': end,
+        'totals': totals,
+        'by_day': _totals(sales.values('day').annotate(**sums).order_by('day')),
+        'breakdowns': [
+            ('Payment method', breakdown('payment_method')),
+            ('Payment status', breakdown('payment_status')),
+            ('Order status', breakdown('order_status')),
+            ('City', breakdown('city', TOP_ROWS)),
+        ],
+        'top_products': list(
+            DailyProductSales.objects.filter(day__gte=start, day__lte=end)
+            .values('product_id', 'product__product_name')
+            .annotate(orders=Sum('orders'), quantity=Sum('quantity'), revenue=Sum('revenue'))
+            .order_by('-revenue')[:TOP_ROWS]
+        ),
+    }
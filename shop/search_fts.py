@@ -0,0 +1,144 @@
+"""
+Optional SQLite FTS5 backend for shop.views.search.
+
+External-content FTS5 tables mirror Product and BlogPost and are kept in sync
+by triggers, so ranking (bm25) and highlighted snippets come straight from
+SQLite. Enable it with SHOP_SEARCH_BACKEND = 'fts5'; the tables are created by
+migration shop 0013 when that backend is selected, and otherwise by
+`manage.py rebuild_search_fts`. With the default in-memory backend no tables
+or triggers exist, so Product/BlogPost writes pay nothing for FTS.
+"""
+import re
+
+from django.conf import settings
+from django.db import connection
+from django.utils.html import escape
+from django.utils.safestring import mark_safe
+
+# Highlight markers that cannot appear in user text; swapped for <mark> after escaping
+_HL_OPEN = '\x02'
+_HL_CLOSE = '\x03'
+_QUERY_TOKEN_RE = re.compile(r'\w+', re.UNICODE)
+
+# fts table -> (content table, rowid column, indexed columns, bm25 column weights)
+FTS_TABLES = {
+    'shop_product_fts': ('shop_product', 'id', ('product_name', 'category', 'subcategory', 'desc'), (3.0, 2.0, 2.0, 1.0)),
+    'blog_blogpost_fts': ('blog_blogpost', 'post_id', ('title', 'head0', 'chead0', 'head1', 'chead1', 'head2', 'chead2', 'conclusion'), (3.0, 2.0, 1.0, 2.0, 1.0, 2.0, 1.0, 1.0)),
+}
+
+_installed = None
+
+
+def _quoted(columns, prefix=''):
+    return ', '.join(f'{prefix}"{c}"' for c in columns)
+
+
+def fts5_supported(conn=connection):
+    """True when the database is SQLite compiled with FTS5"""
+    if conn.vendor != 'sqlite':
+        return False
+    with conn.cursor() as cursor:
+        cursor.execute('PRAGMA compile_options')
+        return any(row[0] == 'ENABLE_FTS5' for row in cursor.fetchall())
+
+
+def install(conn=connection):
+    """Create the FTS5 tables and sync triggers, then index existing rows"""
+    global _installed
+    if not fts5_supported(conn):
+        return False
+    with conn.cursor() as cursor:
+        for fts, (table, rowid, columns, _) in FTS_TABLES.items():
+            cols = _quoted(columns)
+            cursor.execute(
+                f'CREATE VIRTUAL TABLE IF NOT EXISTS {fts} USING fts5('
+                f"{cols}, content='{table}', content_rowid='{rowid}', tokenize='porter unicode61')"
+            )
+            cursor.execute(
+                f'CREATE TRIGGER IF NOT EXISTS {fts}_ai AFTER INSERT ON {table} BEGIN '
+                f'INSERT INTO {fts}(rowid, {cols}) VALUES (new."{rowid}", {_quoted(columns, "new.")}); END'
+            )
+            cursor.execute(
+                f'CREATE TRIGGER IF NOT EXISTS {fts}_ad AFTER DELETE ON {table} BEGIN '
+                f"INSERT INTO {fts}({fts}, rowid, {cols}) VALUES ('delete', old.\"{rowid}\", {_quoted(columns, 'old.')}); END"
+            )
+            cursor.execute(
+                f'CREATE TRIGGER IF NOT EXISTS {fts}_au AFTER UPDATE ON {table} BEGIN '
+                f"INSERT INTO {fts}({fts}, rowid, {cols}) VALUES ('delete', old.\"{rowid}\", {_quoted(columns, 'old.')}); "
+                f'INSERT INTO {fts}(rowid, {cols}) VALUES (new."{rowid}", {_quoted(columns, "new.")}); END'
+            )
+            cursor.execute(f"INSERT INTO {fts}({fts}) VALUES ('rebuild')")
+    _installed = None
+    return True
+
+
+def uninstall(conn=connection):
+    """Drop the FTS5 tables and their triggers"""
+    global _installed
+    if conn.vendor != 'sqlite':
+        return
+    with conn.cursor() as cursor:
+        for fts in FTS_TABLES:
+            for suffix in ('ai', 'ad', 'au'):
+                cursor.execute(f'DROP TRIGGER IF EXISTS {fts}_{suffix}')
+            cursor.execute(f'DROP TABLE IF EXISTS {fts}')
+    _installed = None
+
+
+def is_selected():
+    return getattr(settings, 'SHOP_SEARCH_BACKEND', 'memory') == 'fts5'
+
+
+def is_enabled():
+    """True when the FTS5 backend is selected and its tables exist"""
+    global _installed
+    if not is_selected():
+        return False
+    if _installed is None:
+        if connection.vendor != 'sqlite':
+            _installed = False
+        else:
+            with connection.cursor() as cursor:
+                cursor.execute(
+                    "SELECT COUNT(*) FROM sqlite_master WHERE type = 'table' AND name IN (%s, %s)",
+                    list(FTS_TABLES),
+                )
+                _installed = cursor.fetchone()[0] == len(FTS_TABLES)
+    return _installed
+
+
+def build_match(query):
+    """Turn free text into a safe FTS5 MATCH expression (AND of prefix terms)"""
+    tokens = _QUERY_TOKEN_RE.findall(query.lower())
+    return ' '.join(f'"{t}"*' for t in tokens)
+
+
+def _search(fts, query, limit):
+    match = build_match(query)
+    if not match:
+        return []
+    weights = ', '.join(str(w) for w in FTS_TABLES[fts][3])
+    with connection.cursor() as cursor:
+        cursor.execute(
+            f"SELECT rowid, snippet({fts}, -1, %s, %s, '…', 16) FROM {fts} "
+            f'WHERE {fts} MATCH %s ORDER BY bm25({fts}, {weights}) LIMIT %s',
+            # LIMIT -1: every match
+            [_HL_OPEN, _HL_CLOSE, match, -1 if limit is None else limit],
+        )
+        return [(rowid, highlight(snippet)) for rowid, snippet in cursor.fetchall()]
+
+
+def highlight(snippet):
+    """Escape an FTS5 snippet and turn the match markers into <mark> tags"""
+    html = escape(snippet or '').replace(_HL_OPEN, '<mark>').replace(_HL_CLOSE, '</mark>')
+    return mark_safe(html)
+
+
+def search_products(query, limit=None):
+    """Return [(product id, snippet)] best match first (all matches by default)"""
+    return _search('shop_product_fts', query, limit)
+
+
+def search_posts(query, limit=100):
+    """Return [(post id, snippet)] best match first"""
+    return _search('blog_blogpost_fts', query, limit)
@@ -0,0 +1,195 @@
+"""
+In-memory inverted index used by shop.views.search.
+
+Products and blog posts are tokenised into postings (token -> {doc id: weighted
+term frequency}) and ranked with BM25. The index is built lazily from the
+database on first use and then kept current by the model signals in
+shop.signals, so a query never scans the Product or BlogPost tables.
+"""
+from collections import defaultdict
+import math
+import re
+import threading
+
+from .models import Product
+from blog.models import BlogPost
+
+TOKEN_RE = re.compile(r'[a-z0-9]+')
+
+# BM25 parameters
+K1 = 1.2
+B = 0.75
+
+# Indexed fields per document kind with their weights (title-like fields count more)
+PRODUCT_FIELDS = {
+    'product_name': 3,
+    'category': 2,
+    'subcategory': 2,
+    'desc': 1,
+}
+BLOG_FIELDS = {
+    'title': 3,
+    'head0': 2,
+    'head1': 2,
+    'head2': 2,
+    'chead0': 1,
+    'chead1': 1,
+    'chead2': 1,
+    'conclusion': 1,
+}
+
+
+def normalize(token):
+    """Fold simple plurals so 'shirt' matches 'shirts' and 't-shirts'"""
+    if len(token) > 3 and token.endswith('s') and not token.endswith('ss'):
+        return token[:-1]
+    return token
+
+
+def tokenize(text):
+    """Lowercase, split on non-alphanumerics and normalise tokens"""
+    return [normalize(t) for t in TOKEN_RE.findall((text or '').lower())]
+
+
+class InvertedIndex:
+    """Postings and document statistics for one document kind"""
+
+    def __init__(self, fields):
+        self.fields = fields
+        self.postings = defaultdict(dict)  # token -> {doc_id: tf}
+        self.doc_terms = {}                # doc_id -> {token: tf}
+        self.doc_len = {}                  # doc_id -> weighted length
+        self.total_len = 0
+
+    def add(self, doc_id, values):
+        """(Re)index one document from a {field: text} mapping"""
+        self.remove(doc_id)
+        terms = defaultdict(int)
+        for field, weight in self.fields.items():
+            for token in tokenize(values.get(field)):
+                terms[token] += weight
+        length = sum(terms.values())
+        for token, tf in terms.items():
+            self.postings[token][doc_id] = tf
+        self.doc_terms[doc_id] = dict(terms)
+        self.doc_len[doc_id] = length
+        self.total_len += length
+
+    def remove(self, doc_id):
+        terms = self.doc_terms.pop(doc_id, None)
+        if terms is None:
+            return
+        for token in terms:
+            docs = self.postings.get(token)
+            if docs is not None:
+                docs.pop(doc_id, None)
+                if not docs:
+                    del self.postings[token]
+        self.total_len -= self.doc_len.pop(doc_id, 0)
+
+    def search(self, tokens):
+        """Return [(doc_id, score)] for docs containing every token, best first"""
+        if not tokens or not self.doc_len:
+            return []
+        tokens = list(dict.fromkeys(tokens))
+        postings = [self.postings.get(t) for t in tokens]
+        if not all(postings):
+            return []
+        # Intersect starting from the rarest term
+        postings.sort(key=len)
+        candidates = set(postings[0])
+        for docs in postings[1:]:
+            candidates.intersection_update(docs)
+            if not candidates:
+                return []
+
+        n_docs = len(self.doc_len)
+        avg_len = self.total_len / n_docs if n_docs else 0
+        scores = {}
+        for docs in postings:
+            idf = math.log(1 + (n_docs - len(docs) + 0.5) / (len(docs) + 0.5))
+            for doc_id in candidates:
+                tf = docs[doc_id]
+                norm = K1 * (1 - B + B * self.doc_len[doc_id] / avg_len) if avg_len else K1
+                scores[doc_id] = scores.get(doc_id, 0.0) + idf * tf * (K1 + 1) / (tf + norm)
+        return sorted(scores.items(), key=lambda item: (-item[1], item[0]))
+
+
+class SearchIndex:
+    """Product and blog indexes, built on first use and updated incrementally"""
+
+    def __init__(self):
+        self._lock = threading.RLock()
+        self.products = None
+        self.posts = None
+
+    def _ensure_built(self):
+        if self.products is not None:
+            return
+        with self._lock:
+            if self.products is not None:
+                return
+            products = InvertedIndex(PRODUCT_FIELDS)
+            for row in Product.objects.values('id', *PRODUCT_FIELDS).iterator():
+                products.add(row['id'], row)
+            posts = InvertedIndex(BLOG_FIELDS)
+            for row in BlogPost.objects.values('post_id', *BLOG_FIELDS).iterator():
+                posts.add(row['post_id'], row)
+            self.posts = posts
+            self.products = products
+
+    def search_products(self, query, limit=None):
+        self._ensure_built()
+        with self._lock:
+            return self.products.search(tokenize(query))[:limit]
+
+    def search_posts(self, query, limit=100):
+        self._ensure_built()
+        with self._lock:
+            return self.posts.search(tokenize(query))[:limit]
+
+    def update_product(self, product):
+        with self._lock:
+            if self.products is not None:
+                self.products.add(product.pk, {f: getattr(product, f) for f in PRODUCT_FIELDS})
+
+    def remove_product(self, pk):
+        with self._lock:
+            if self.products is not None:
+                self.products.remove(pk)
+
+    def update_post(self, post):
+        with self._lock:
+            if self.posts is not None:
+                self.posts.add(post.pk, {f: getattr(post, f) for f in BLOG_FIELDS})
+
+    def remove_post(self, pk):
+        with self._lock:
+            if self.posts is not None:
+                self.posts.remove(pk)
+
+    def reset(self):
+        """Forget everything; the next query rebuilds from the database"""
+        with self._lock:
+            self.products = None
+            self.posts = None
+
+
+search_index = SearchIndex()
+
+
+def load_ranked(model, ranked):
+    """
+    Fetch the model rows for [(pk, score_or_snippet)] in one query, preserving
+    rank order. String values (FTS5 snippets) are attached as `obj.snippet`.
+    """
+    rows = model.objects.in_bulk([pk for pk, _ in ranked])
+    results = []
+    for pk, extra in ranked:
+        obj = rows.get(pk)
+        if obj is None:
+            continue
+        if isinstance(extra, str):
+            obj.snippet = extra
+        results.append(obj)
+    return results
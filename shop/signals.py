@@ -0,0 +1,82 @@
+from django.db import transaction
+from django.db.models.signals import post_save, post_delete, pre_delete
+from django.dispatch import receiver
+
+from .models import Product, Order, OrderItem, OrderUpdate
+from blog.models import BlogPost
+from . import catalog
+from .search_index import search_index
+from .suggest import suggest_index
+from .fuzzy import trigram_index
+from . import admin_fragments, events, rollups, tracking
+
+
+# In-memory structures are only touched once the write has committed, so a
+# rolled back transaction never leaves them ahead of the database.
+
+@receiver(post_save, sender=Product)
+def product_saved(sender, instance, **kwargs):
+    """Keep in-memory catalog structures in sync with Product writes"""
+    transaction.on_commit(catalog.invalidate_category_slides)
+    transaction.on_commit(lambda: search_index.update_product(instance))
+    transaction.on_commit(lambda: suggest_index.update_product(instance))
+    transaction.on_commit(lambda: trigram_index.update_product(instance))
+
+
+@receiver(post_delete, sender=Product)
+def product_deleted(sender, instance, **kwargs):
+    transaction.on_commit(catalog.invalidate_category_slides)
+    pk = instance.pk
+    transaction.on_commit(lambda: search_index.remove_product(pk))
+    transaction.on_commit(lambda: suggest_index.remove_product(pk))
+    transaction.on_commit(lambda: trigram_index.remove_product(pk))
+
+
+@receiver(post_save, sender=BlogPost)
+def blogpost_saved(sender, instance, **kwargs):
+    transaction.on_commit(lambda: search_index.update_post(instance))
+    transaction.on_commit(lambda: suggest_index.update_post(instance))
+
+
+@receiver(post_delete, sender=BlogPost)
+def blogpost_deleted(sender, instance, **kwargs):
+    pk = instance.pk
+    transaction.on_commit(lambda: search_index.remove_post(pk))
+    transaction.on_commit(lambda: suggest_index.remove_post(pk))
+
+
+@receiver(post_save, sender=OrderItem)
+@receiver(post_delete, sender=OrderItem)
+def orderitem_changed(sender, instance, **kwargs):
+    """Keep Order.total_items/subtotal consistent when a line is edited or removed"""
+    # bulk_create at checkout sends no signals; the view sets the totals itself
+    if kwargs.get('raw'):
+        return
+    Order.objects.filter(pk=instance.order_id).update(**Order.totals_expressions())
+    order_id = instance.order_id
+    transaction.on_commit(lambda: admin_fragments.invalidate(order_id))
+
+
+@receiver(post_save, sender=Order)
+@receiver(post_delete, sender=Order)
+@receiver(post_save, sender=OrderUpdate)
+@receiver(post_delete, sender=OrderUpdate)
+def order_tracking_changed(sender, instance, **kwargs):
+    """Drop the cached tracker response and admin fragments for the affected order"""
+    order_id = instance.pk if sender is Order else instance.order_id
+    transaction.on_commit(lambda: tracking.invalidate(order_id))
+    transaction.on_commit(lambda: admin_fragments.invalidate(order_id))
+
+
+@receiver(pre_delete, sender=Order)
+def order_deleting(sender, instance, **kwargs):
+    """Take the order out of the sales rollups while its lines still exist"""
+    rollups.remove_order(instance)
+
+
+@receiver(post_save, sender=OrderUpdate)
+def order_update_created(sender, instance, created, **kwargs):
+    """Push new updates to open tracker streams"""
+    if created and not kwargs.get('raw'):
+        transaction.on_commit(lambda: events.publish_updates([instance]))
+
@@ -0,0 +1,289 @@
+"""
+Order state machine.
+
+The single place that knows which order_status / payment_status moves are
+allowed and what each one writes: the timeline OrderUpdate, shipping and
+delivery dates, tracking entries. Checkout, the payment callbacks, the admin
+change form and the admin bulk actions all go through `order_state`.
+
+Timeline rows are always inserted with bulk_create, so writing one or five
+thousand costs one INSERT; listeners registered with add_listener (tracker
+cache, live streams) are called with the new rows after commit.
+"""
+from collections import defaultdict
+from datetime import date
+
+from django.db import transaction
+from django.db.models import F
+from django.db.models.functions import Coalesce
+
+from .models import Order, OrderUpdate
+from . import events, rollups, tracking
+
+# order_status -> statuses it may move to
+TRANSITIONS = {
+    'pending': {'confirmed', 'processing', 'shipped', 'cancelled'},
+    'confirmed': {'processing', 'shipped', 'cancelled'},
+    'processing': {'shipped', 'cancelled'},
+    'shipped': {'out_for_delivery', 'delivered'},
+    'out_for_delivery': {'delivered'},
+    'delivered': {'refunded'},
+    'cancelled': {'refunded'},
+    'refunded': set(),
+}
+
+# Timeline entry written for each target status
+STATUS_TYPES = {
+    'pending': 'order_placed',
+    'confirmed': 'order_confirmed',
+    'processing': 'processing',
+    'shipped': 'shipped',
+    'out_for_delivery': 'out_for_delivery',
+    'delivered': 'delivered',
+    'cancelled': 'cancelled',
+    'refunded': 'refunded',
+}
+STATUS_MESSAGES = {
+    'pending': 'Order status set to Pending.',
+    'confirmed': 'Order has been confirmed and is being prepared for processing.',
+    'processing': 'Your order is being processed and prepared for shipment.',
+    'shipped': 'Your order has been shipped. Tracking number: {tracking_number}.',
+    'out_for_delivery': 'Your order is out for delivery and will reach you soon.',
+    'delivered': 'Your order has been delivered successfully. Thank you for shopping with us!',
+    'cancelled': 'Order has been cancelled.',
+    'refunded': 'Order has been refunded.',
+}
+
+# Date columns stamped (if still empty) when an order reaches a status
+STATUS_DATES = {
+    'shipped': 'shipping_date',
+    'delivered': 'delivered_date',
+}
+
+# payment_status -> statuses it may be reached from
+PAYMENT_SOURCES = {
+    'paid': {'pending', 'cod_pending', 'failed'},
+    'failed': {'pending'},
+    'refunded': {'paid'},
+}
+
+# Most likely current payment_status first
+PAYMENT_SOURCE_ORDER = ['pending', 'cod_pending', 'failed', 'paid']
+
+PLACED_MESSAGES = {
+    'cod': 'Order placed with Cash on Delivery',
+}
+PLACED_MESSAGE = 'The order has been placed'
+
+
+class TransitionResult:
+    """Outcome of a batch: changed order ids and why the rest were skipped"""
+
+    def __init__(self):
+        self.changed = []
+        self.skipped = {}   # order id -> reason
+
+    def __len__(self):
+        return len(self.changed)
+
+    def skip(self, order_id, reason):
+        self.skipped[order_id] = reason
+
+
+class _Contended(Exception):
+    """Rolls back a batch UPDATE that matched fewer rows than were read"""
+
+
+class OrderStateMachine:
+
+    def __init__(self, transitions):
+        self.transitions = transitions
+        self.sources = defaultdict(set)
+        for source, targets in transitions.items():
+            for target in targets:
+                self.sources[target].add(source)
+        self._listeners = []
+
+    # -- declarations --------------------------------------------------
+
+    def can_transition(self, current, target):
+        return target in self.transitions.get(current, ())
+
+    def check(self, current, target):
+        """None if current -> target is allowed, else the reason it is not"""
+        if target not in STATUS_TYPES:
+            return f'Unknown status "{target}"'
+        if current == target:
+            return f'Already {target}'
+        if not self.can_transition(current, target):
+            return f'Cannot move from {current} to {target}'
+        return None
+
+    def timeline_entry(self, order_id, target, tracking_number=None, city=None):
+        """Unsaved OrderUpdate recording an order reaching `target`"""
+        return OrderUpdate(
+            order_id=order_id,
+            status_type=STATUS_TYPES.get(target, 'other'),
+            update_desc=STATUS_MESSAGES.get(target, f'Order status changed to {target}.').format(
+                tracking_number=tracking_number or 'Will be updated soon'
+            ),
+            tracking_number=tracking_number if target == 'shipped' else None,
+            location=city if target in ('shipped', 'out_for_delivery') else None,
+        )
+
+    # -- notification hooks ----------------------------------------------
+
+    def add_listener(self, listener):
+        """Call listener(updates) after commit whenever timeline rows are written"""
+        self._listeners.append(listener)
+        return listener
+
+    def record(self, updates):
+        """Insert timeline rows in one statement and notify listeners on commit"""
+        updates = [update for update in updates if update is not None]
+        if not updates:
+            return []
+        OrderUpdate.objects.bulk_create(updates)
+        for listener in self._listeners:
+            transaction.on_commit(lambda listener=listener: listener(updates))
+        return updates
+
+    # -- single order ----------------------------------------------------
+
+    def placed(self, order):
+        """Timeline row for a freshly saved order (call inside its transaction)"""
+        desc = PLACED_MESSAGES.get(order.payment_method, PLACED_MESSAGE)
+        return self.record([OrderUpdate(order_id=order.pk, status_type='order_placed', update_desc=desc)])
+
+    def form_changes(self, order, initial):
+        """
+        Diff an edited (unsaved) order against the form's initial data: stamp
+        status dates on `order` and return the timeline rows to record once it
+        is saved. No query is needed to find the previous values.
+        """
+        updates = []
+        previous_status = initial.get('order_status')
+        target = order.order_status
+        if previous_status != target:
+            updates.append(self.timeline_entry(order.pk, target, order.tracking_number, order.city))
+            column = STATUS_DATES.get(target)
+            if column and not getattr(order, column):
+                setattr(order, column, date.today())
+        if order.tracking_number and order.tracking_number != initial.get('tracking_number'):
+            updates.append(OrderUpdate(
+                order_id=order.pk,
+                status_type='shipped' if target == 'shipped' else 'other',
+                update_desc=f'Tracking number updated: {order.tracking_number}',
+                tracking_number=order.tracking_number,
+                location=order.city,
+            ))
+        return updates
+
+    def set_payment_status(self, order_id, target, update_desc, status_type='other'):
+        """
+        Move payment_status with guarded UPDATE ... WHERE payment_status = ?
+        statements, without reading the row first. The timeline row is written
+        only when the order actually changed. Returns True if it did.
+        """
+        with transaction.atomic():
+            # One guarded UPDATE per possible source status (usually only the
+            # first runs) so the sales rollup knows which bucket it left
+            previous = None
+            for source in sorted(PAYMENT_SOURCES[target], key=PAYMENT_SOURCE_ORDER.index):
+                if Order.objects.filter(pk=order_id, payment_status=source).update(payment_status=target):
+                    previous = source
+                    break
+            if previous is not None:
+                self.record([OrderUpdate(order_id=order_id, status_type=status_type, update_desc=update_desc)])
+                new = Order.objects.filter(pk=order_id).values(*rollups.ORDER_FIELDS).first()
+                if new is not None:
+                    rollups.move_orders([(dict(new, payment_status=previous), new)])
+        return previous is not None
+
+    def mark_paid(self, order_id, update_desc):
+        """Record a successful payment; False if the order is missing or not awaiting payment"""
+        return self.set_payment_status(order_id, 'paid', update_desc, status_type='payment_received')
+
+    # -- batches -----------------------------------------------------------
+
+    def apply(self, targets):
+        """
+        Move many orders at once. `targets` maps order id -> target status.
+
+        Rows are read once (locked where the database supports it), ineligible
+        orders are reported in the result instead of raising, and each
+        (target, current status) pair is applied with one UPDATE guarded on
+        that status. Only rows the UPDATE changed get a timeline row and a
+        rollup move; all timeline rows go in with one bulk_create.
+        """
+        result = TransitionResult()
+        if not targets:
+            return result
+        with transaction.atomic():
+            rows = {
+                row['order_id']: row
+                for row in Order.objects.select_for_update()
+                .filter(order_id__in=list(targets))
+                .values('order_id', 'tracking_number', *rollups.ORDER_FIELDS)
+            }
+            # Grouped by the status each row was read in, so the guarded
+            # UPDATE only touches rows still in that state
+            groups = defaultdict(list)
+            for order_id, target in targets.items():
+                row = rows.get(order_id)
+                reason = 'Order not found' if row is None else self.check(row['order_status'], target)
+                if reason:
+                    result.skip(order_id, reason)
+                else:
+                    groups[target, row['order_status']].append(order_id)
+
+            today = date.today()
+            updates = []
+            moves = []
+            for (target, source), order_ids in groups.items():
+                fields = {'order_status': target}
+                if target in STATUS_DATES:
+                    column = STATUS_DATES[target]
+                    fields[column] = Coalesce(F(column), today)
+                order_ids = self._move(order_ids, source, fields, result)
+                for order_id in order_ids:
+                    row = rows[order_id]
+                    updates.append(self.timeline_entry(order_id, target, row['tracking_number'], row['city']))
+                    moves.append((row, dict(row, order_status=target)))
+                result.changed.extend(order_ids)
+            self.record(updates)
+            rollups.move_orders(moves)
+        return result
+
+    def _move(self, order_ids, source, fields, result):
+        """
+        UPDATE the orders still in `source`; returns the ids this call changed.
+        When the rowcount falls short some rows moved since they were read, so
+        the batch is undone and each order is retried with its own UPDATE.
+        """
+        try:
+            with transaction.atomic():
+                if Order.objects.filter(order_id__in=order_ids, order_status=source).update(**fields) == len(order_ids):
+                    return order_ids
+                raise _Contended
+        except _Contended:
+            pass
+        changed = []
+        for order_id in order_ids:
+            if Order.objects.filter(order_id=order_id, order_status=source).update(**fields):
+                changed.append(order_id)
+            else:
+                result.skip(order_id, 'Changed by someone else')
+        return changed
+
+    def apply_all(self, order_ids, target):
+        """apply() for a single target status"""
+        return self.apply({order_id: target for order_id in order_ids})
+
+
+order_state = OrderStateMachine(TRANSITIONS)
+
+# bulk_create sends no model signals, so the tracker cache and live streams
+# hear about timeline rows from here
+order_state.add_listener(lambda updates: tracking.invalidate_many({update.order_id for update in updates}))
+order_state.add_listener(events.publish_updates)
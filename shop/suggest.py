@@ -0,0 +1,165 @@
+"""
+Prefix index behind the /shop/search/suggest/ typeahead endpoint.
+
+Suggestions live in one sorted array of (key, kind, ref) entries, where key is
+a lowercased phrase or one of its word-suffixes, so both "blu" and "shi" find
+"Blue Shirt". A prefix lookup is a bisect plus a short forward scan. The array
+is built from the database on first use and patched incrementally by the
+Product/BlogPost signals in shop.signals.
+"""
+from bisect import bisect_left, insort
+from collections import Counter
+import re
+import threading
+
+from .models import Product
+from blog.models import BlogPost
+
+_WORD_RE = re.compile(r'\w+')
+
+# Entry kinds, in the order they are presented for equally good matches
+KIND_ORDER = {'category': 0, 'subcategory': 1, 'product': 2, 'post': 3}
+
+
+def suffix_keys(text):
+    """The phrase itself plus every suffix starting at a word boundary"""
+    text = ' '.join((text or '').lower().split())
+    if not text:
+        return []
+    return [text[m.start():] for m in _WORD_RE.finditer(text)] or [text]
+
+
+class SuggestIndex:
+
+    def __init__(self):
+        self._lock = threading.RLock()
+        self._entries = []    # sorted [(key, kind, ref)]
+        self._labels = {}     # (kind, ref) -> display text
+        self._keys = {}       # (kind, ref) -> keys currently in _entries
+        self._counts = Counter()  # (kind, name) -> number of products using it
+        self._product_groups = {}  # product pk -> (category, subcategory)
+        self._bulk = False        # append instead of insort while building
+        self._built = False
+
+    def _ensure_built(self):
+        if self._built:
+            return
+        with self._lock:
+            if self._built:
+                return
+            self._entries = []
+            self._labels, self._keys = {}, {}
+            self._counts, self._product_groups = Counter(), {}
+            self._bulk = True
+            for row in Product.objects.values('id', 'product_name', 'category', 'subcategory').iterator():
+                self._add_product(row['id'], row['product_name'], row['category'], row['subcategory'])
+            for post_id, title in BlogPost.objects.values_list('post_id', 'title').iterator():
+                self._set(('post', post_id), title)
+            self._entries.sort()
+            self._bulk = False
+            self._built = True
+
+    def _set(self, ident, label):
+        """Insert or replace the entries for one suggestion"""
+        self._unset(ident)
+        keys = suffix_keys(label)
+        if not keys:
+            return
+        self._labels[ident] = label
+        self._keys[ident] = keys
+        for key in keys:
+            if self._bulk:
+                self._entries.append((key,) + ident)
+            else:
+                insort(self._entries, (key,) + ident)
+
+    def _unset(self, ident):
+        if self._bulk:
+            return
+        for key in self._keys.pop(ident, ()):
+            entry = (key,) + ident
+            i = bisect_left(self._entries, entry)
+            if i < len(self._entries) and self._entries[i] == entry:
+                del self._entries[i]
+        self._labels.pop(ident, None)
+
+    def _add_group(self, kind, name):
+        if not name:
+            return
+        self._counts[(kind, name)] += 1
+        if self._counts[(kind, name)] == 1:
+            self._set((kind, name), name)
+
+    def _drop_group(self, kind, name):
+        if not name or not self._counts[(kind, name)]:
+            return
+        self._counts[(kind, name)] -= 1
+        if not self._counts[(kind, name)]:
+            del self._counts[(kind, name)]
+            self._unset((kind, name))
+
+    def _add_product(self, pk, name, category, subcategory):
+        self._set(('product', pk), name)
+        self._product_groups[pk] = (category, subcategory)
+        self._add_group('category', category)
+        self._add_group('subcategory', subcategory)
+
+    def _remove_product(self, pk):
+        self._unset(('product', pk))
+        category, subcategory = self._product_groups.pop(pk, (None, None))
+        self._drop_group('category', category)
+        self._drop_group('subcategory', subcategory)
+
+    def suggest(self, prefix, limit=8):
+        """Return up to `limit` [(kind, ref, label)] whose text has a word starting with prefix"""
+        prefix = ' '.join((prefix or '').lower().split())
+        if not prefix:
+            return []
+        self._ensure_built()
+        with self._lock:
+            entries = self._entries
+            seen = set()
+            matches = []
+            i = bisect_left(entries, (prefix,))
+            # Scan a bounded window so very short prefixes stay cheap
+            while i < len(entries) and len(seen) < limit * 4:
+                key, kind, ref = entries[i]
+                if not key.startswith(prefix):
+                    break
+                if (kind, ref) not in seen:
+                    seen.add((kind, ref))
+                    # Whole-phrase matches rank ahead of mid-phrase word matches
+                    whole = key == self._keys[(kind, ref)][0]
+                    matches.append((not whole, KIND_ORDER[kind], len(key), kind, ref, self._labels[(kind, ref)]))
+                i += 1
+        matches.sort(key=lambda m: m[:3])
+        return [(kind, ref, label) for _, _, _, kind, ref, label in matches[:limit]]
+
+    def update_product(self, product):
+        with self._lock:
+            if self._built:
+                self._remove_product(product.pk)
+                self._add_product(product.pk, product.product_name, product.category, product.subcategory)
+
+    def remove_product(self, pk):
+        with self._lock:
+            if self._built:
+                self._remove_product(pk)
+
+    def update_post(self, post):
+        with self._lock:
+            if self._built:
+                self._set(('post', post.pk), post.title)
+
+    def remove_post(self, pk):
+        with self._lock:
+            if self._built:
+                self._unset(('post', pk))
+
+    def reset(self):
+        """Forget everything; the next query rebuilds from the database"""
+        with self._lock:
+            self._built = False
+
+
+suggest_index = SuggestIndex()
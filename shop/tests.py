@@ -1,3 +1,1040 @@
-from django.test import TestCase
+import csv
+import datetime
+import importlib
+import io
+import json
+import time
+from unittest import mock
 
-# Create your tests here.
+from django.apps import apps
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core import mail
+from django.core.cache import cache
+from django.core.mail.backends.base import BaseEmailBackend
+from django.core.management import call_command
+from django.db import connection
+from django.test import AsyncClient, TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+
+from . import (
+    admin_changelist, admin_fragments, catalog, events, exports, facets, history, idempotency, listing, notifications,
+    orders, outbox, rollups, search_fts, tracking,
+)
+from .models import (
+    DailyProductSales, DailySales, IdempotencyKey, Order, OrderItem, OrderUpdate, OutgoingEmail, Product,
+    parse_item_json,
+)
+from .orders import CheckoutError, place_order
+from .state_machine import order_state
+from .search_index import search_index
+from .suggest import suggest_index
+from .fuzzy import trigram_index
+
+
+def make_product(name, category="Men's Fashion", subcategory='Shirts', price=500, **fields):
+    return Product.objects.create(
+        product_name=name, category=category, subcategory=subcategory, price=price,
+        desc=fields.pop('desc', 'Everyday wear'), pub_date=fields.pop('pub_date', datetime.date(2024, 1, 1)), **fields
+    )
+
+
+def cart_json(*products, quantity=1):
+    return json.dumps({f'pr{p.pk}': [quantity, p.product_name, p.price] for p in products})
+
+
+def order_fields(**fields):
+    return dict({
+        'name': 'Asha', 'email': 'asha@example.com', 'phone': '9999999999', 'address': '1 Main St',
+        'city': 'Pune', 'zip_code': '411001',
+    }, **fields)
+
+
+class CategorySlidesTests(TestCase):
+
+    def setUp(self):
+        catalog.invalidate_category_slides()
+        self.addCleanup(catalog.invalidate_category_slides)
+        self.shirts = [make_product(f'Shirt {n}') for n in range(5)]
+        self.dress = make_product('Red Cotton Dress', category="Women's Fashion", subcategory='Dresses')
+
+    def test_one_query_then_cached(self):
+        with self.assertNumQueries(1):
+            slides = catalog.get_category_slides()
+        men, women = slides
+        self.assertEqual(men[0], self.shirts)
+        self.assertEqual((list(men[1]), men[2]), ([1], 2))
+        self.assertEqual((women[0], women[2]), ([self.dress], 1))
+        with self.assertNumQueries(0):
+            self.assertIs(catalog.get_category_slides(), slides)
+
+    def test_product_writes_rebuild_the_carousel(self):
+        catalog.get_category_slides()
+        with self.captureOnCommitCallbacks(execute=True):
+            jeans = make_product('Slim Jeans')
+        self.assertIn(jeans, catalog.get_category_slides()[0][0])
+        with self.captureOnCommitCallbacks(execute=True):
+            self.dress.delete()
+        self.assertEqual(len(catalog.get_category_slides()), 1)
+
+    def test_home_page(self):
+        response = self.client.get('/shop/')
+        self.assertContains(response, 'Red Cotton Dress')
+
+
+class CategoryListingTests(TestCase):
+
+    def setUp(self):
+        # Equal pub_dates so pages split inside a run of ties
+        self.shirts = [
+            make_product(f'Shirt {n}', pub_date=datetime.date(2024, 1, 1 + n // 3)) for n in range(7)
+        ]
+        make_product('Red Cotton Dress', category="Women's Fashion", subcategory='Dresses')
+
+    def test_pages_cover_the_category_newest_first(self):
+        newest = sorted(self.shirts, key=lambda p: (p.pub_date, p.pk), reverse=True)
+        pages, cursor = [], None
+        while True:
+            products, cursor = listing.get_category_page("Men's Fashion", cursor, limit=3)
+            pages.append([p.pk for p in products])
+            if cursor is None:
+                break
+        self.assertEqual(pages, [[p.pk for p in newest[i:i + 3]] for i in (0, 3, 6)])
+        self.assertEqual(listing.get_category_page("Men's Fashion", 'garbage', limit=1)[0], newest[:1])
+
+    def test_load_more_endpoint(self):
+        first = self.client.get('/shop/category/men/more/', {'limit': 5}).json()
+        self.assertEqual(len(first['products']), 5)
+        rest = self.client.get('/shop/category/men/more/', {'cursor': first['next_cursor']}).json()
+        self.assertEqual([p['product_name'] for p in rest['products']], ['Shirt 1', 'Shirt 0'])
+        self.assertIsNone(rest['next_cursor'])
+        self.assertEqual(self.client.get('/shop/category/shoes/more/').status_code, 404)
+
+    def test_category_page(self):
+        response = self.client.get('/shop/mencat/')
+        self.assertContains(response, 'Shirt 6')
+        self.assertNotContains(response, 'Red Cotton Dress')
+
+
+class SearchIndexTests(TestCase):
+
+    def setUp(self):
+        search_index.reset()
+        self.addCleanup(search_index.reset)
+        self.shirt = make_product('Blue Linen Shirt')
+        make_product('Red Cotton Dress', category="Women's Fashion", subcategory='Dresses')
+
+    def ids(self, query):
+        return [pk for pk, _ in search_index.search_products(query)]
+
+    def test_ranks_name_matches(self):
+        self.assertEqual(self.ids('linen'), [self.shirt.pk])
+        self.assertEqual(self.ids('shirts'), [self.shirt.pk])
+        self.assertEqual(self.ids('velvet'), [])
+
+    def test_product_save_updates_index(self):
+        self.assertEqual(self.ids('linen'), [self.shirt.pk])
+        self.shirt.product_name = 'Blue Velvet Shirt'
+        with self.captureOnCommitCallbacks(execute=True):
+            self.shirt.save()
+        self.assertEqual(self.ids('linen'), [])
+        self.assertEqual(self.ids('velvet'), [self.shirt.pk])
+
+    def test_product_delete_updates_index(self):
+        self.assertEqual(self.ids('linen'), [self.shirt.pk])
+        pk = self.shirt.pk
+        with self.captureOnCommitCallbacks(execute=True):
+            self.shirt.delete()
+        self.assertNotIn(pk, self.ids('shirt'))
+
+    def test_search_view(self):
+        response = self.client.get('/shop/search/', {'search': 'linen'})
+        self.assertContains(response, 'Blue Linen Shirt')
+        self.assertNotContains(response, 'Red Cotton Dress')
+
+
+@override_settings(SHOP_SEARCH_BACKEND='fts5')
+class FtsSearchTests(TestCase):
+
+    def setUp(self):
+        if not search_fts.fts5_supported():
+            self.skipTest('SQLite without FTS5')
+        self.shirt = make_product('Blue Linen Shirt')
+        # Migration 0013 ran with the default in-memory backend
+        self.migrated = self.fts_objects()
+        search_fts.install()
+        self.addCleanup(search_fts.uninstall)
+
+    def fts_objects(self):
+        with connection.cursor() as cursor:
+            cursor.execute("SELECT name FROM sqlite_master WHERE name LIKE '%%_fts%%'")
+            return [row[0] for row in cursor.fetchall()]
+
+    def ids(self, query):
+        return [pk for pk, _ in search_fts.search_products(query)]
+
+    def test_triggers_keep_the_index_in_sync(self):
+        [(pk, snippet)] = search_fts.search_products('linen')
+        self.assertEqual(pk, self.shirt.pk)
+        self.assertIn('<mark>Linen</mark>', snippet)
+        dress = make_product('Red Cotton Dress', category="Women's Fashion", subcategory='Dresses')
+        self.assertEqual(self.ids('cott'), [dress.pk])
+        self.shirt.product_name = 'Blue Velvet Shirt'
+        self.shirt.save()
+        self.assertEqual(self.ids('linen'), [])
+        self.assertEqual(self.ids('velvet'), [self.shirt.pk])
+        dress.delete()
+        self.assertEqual(self.ids('cotton'), [])
+
+    def test_search_view_uses_fts(self):
+        self.assertTrue(search_fts.is_enabled())
+        with override_settings(SHOP_SEARCH_BACKEND='memory'):
+            self.assertFalse(search_fts.is_enabled())
+        self.assertContains(self.client.get('/shop/search/', {'search': 'lin'}), 'Blue Linen Shirt')
+
+    def test_no_triggers_unless_selected(self):
+        self.assertEqual(self.migrated, [])
+        self.assertIn('shop_product_fts_au', self.fts_objects())
+        search_fts.uninstall()
+        self.assertEqual(self.fts_objects(), [])
+
+
+class SuggestIndexTests(TestCase):
+
+    def setUp(self):
+        suggest_index.reset()
+        self.addCleanup(suggest_index.reset)
+        self.shirt = make_product('Blue Linen Shirt')
+
+    def products(self, prefix):
+        return [ref for kind, ref, _ in suggest_index.suggest(prefix) if kind == 'product']
+
+    def test_matches_word_prefixes(self):
+        self.assertEqual(self.products('blu'), [self.shirt.pk])
+        self.assertEqual(self.products('lin'), [self.shirt.pk])
+        self.assertIn(('subcategory', 'Shirts', 'Shirts'), suggest_index.suggest('shi'))
+
+    def test_product_save_updates_suggestions(self):
+        self.assertEqual(self.products('lin'), [self.shirt.pk])
+        self.shirt.product_name = 'Blue Velvet Shirt'
+        self.shirt.subcategory = 'Tops'
+        with self.captureOnCommitCallbacks(execute=True):
+            self.shirt.save()
+        self.assertEqual(self.products('lin'), [])
+        self.assertEqual(self.products('velv'), [self.shirt.pk])
+        # The old subcategory had no other product left
+        self.assertEqual([s for s in suggest_index.suggest('shirts') if s[0] == 'subcategory'], [])
+
+    def test_endpoint(self):
+        response = self.client.get('/shop/search/suggest/', {'q': 'blu'})
+        self.assertEqual(response.status_code, 200)
+        self.assertIn('Blue Linen Shirt', response.content.decode())
+
+
+class TrigramIndexTests(TestCase):
+
+    def setUp(self):
+        trigram_index.reset()
+        self.addCleanup(trigram_index.reset)
+        self.shirt = make_product('Blue Linen Shirt')
+
+    def test_corrects_typos(self):
+        hits, corrected = trigram_index.search('linnen shrit')
+        self.assertEqual([pk for pk, _ in hits], [self.shirt.pk])
+        self.assertEqual(corrected, 'linen shirt')
+        self.assertEqual(trigram_index.search('zzzz'), ([], ''))
+
+    def test_product_save_updates_vocabulary(self):
+        self.assertTrue(trigram_index.search('linnen')[0])
+        self.shirt.product_name = 'Blue Velvet Shirt'
+        with self.captureOnCommitCallbacks(execute=True):
+            self.shirt.save()
+        self.assertEqual(trigram_index.search('linnen'), ([], ''))
+        hits, corrected = trigram_index.search('velvot')
+        self.assertEqual(([pk for pk, _ in hits], corrected), ([self.shirt.pk], 'velvet'))
+
+    def test_search_view_falls_back_to_fuzzy_matches(self):
+        response = self.client.get('/shop/search/', {'search': 'linnen'})
+        self.assertContains(response, 'Blue Linen Shirt')
+
+
+class SearchFacetTests(TestCase):
+
+    def setUp(self):
+        search_index.reset()
+        self.addCleanup(search_index.reset)
+        # More matches than fit on one results page
+        self.cheap = [make_product(f'Linen Shirt {n}', price=300) for n in range(facets.RESULTS_PER_PAGE)]
+        self.dear = [
+            make_product(f'Linen Dress {n}', category="Women's Fashion", subcategory='Dresses', price=1500,
+                         pub_date=datetime.date(2024, 3, 5))
+            for n in range(3)
+        ]
+
+    def test_counts_cover_every_match_in_one_query(self):
+        ids = [p.pk for p in self.cheap + self.dear]
+        with self.assertNumQueries(1):
+            counts = facets.facet_counts(ids)
+        self.assertEqual(counts['category'], [("Men's Fashion", "Men's Fashion", 24), ("Women's Fashion", "Women's Fashion", 3)])
+        self.assertEqual(counts['price'], [('0-499', 'Under ₹500', 24), ('1000-1999', '₹1,000 - ₹1,999', 3)])
+        self.assertEqual([(v, n) for v, _, n in counts['month']], [('2024-03', 3), ('2024-01', 24)])
+
+    def test_filters_keep_rank_order(self):
+        ranked = [self.dear[2].pk, self.cheap[0].pk, self.dear[0].pk]
+        filters = facets.parse_filters({'price': '1000-1999', 'month': 'May', 'category': ' '})
+        self.assertEqual(filters, {'price': '1000-1999'})
+        self.assertEqual(facets.apply_filters(ranked, filters), [self.dear[2].pk, self.dear[0].pk])
+
+    def test_search_view_counts_all_matches(self):
+        response = self.client.get('/shop/search/', {'search': 'linen'})
+        self.assertEqual(response.context['product_count'], 27)
+        self.assertEqual(len(response.context['products']), facets.RESULTS_PER_PAGE)
+        response = self.client.get('/shop/search/', {'search': 'linen', 'subcategory': 'Dresses'})
+        self.assertEqual(response.context['product_count'], 3)
+        category = next(group for group in response.context['facets'] if group['name'] == 'category')
+        # Facet counts ignore the active filters
+        self.assertEqual([option['count'] for option in category['options']], [24, 3])
+
+
+class OrderItemTests(TestCase):
+
+    def setUp(self):
+        self.shirt = make_product('Blue Linen Shirt', price=500)
+        self.item_json = json.dumps({
+            f'pr{self.shirt.pk}_M_Blue': [2, 'Blue Linen Shirt', 1, 'M', 'Blue'],
+            'pr999999': [1, 'Retired Scarf', '250'],
+            'pr1': ['x', 'Bad quantity', 10],
+            'pr2': [0, 'Empty line', 10],
+            'gift': 'not a line',
+        })
+
+    def test_parse_skips_malformed_lines(self):
+        lines = parse_item_json(self.item_json)
+        self.assertEqual([(line['name'], line['qty'], line['size']) for line in lines],
+                         [('Blue Linen Shirt', 2, 'M'), ('Retired Scarf', 1, '')])
+        self.assertEqual(parse_item_json('not json'), [])
+
+    def test_build_prices_from_products(self):
+        order = Order(item_json=self.item_json)
+        with self.assertNumQueries(1):
+            shirt, scarf = OrderItem.build_for_order(order)
+        # The cart's price of 1 is ignored for a known product
+        self.assertEqual((shirt.product_id, shirt.unit_price, shirt.line_total, shirt.color), (self.shirt.pk, 500, 1000, 'Blue'))
+        self.assertEqual((scarf.product_id, scarf.unit_price), (None, 250))
+
+    def test_backfill_keeps_cart_prices(self):
+        migration = importlib.import_module('shop.migrations.0015_backfill_orderitems')
+        order = Order.objects.create(item_json=self.item_json, **order_fields())
+        migration.backfill_order_items(apps, None)
+        migration.backfill_order_items(apps, None)
+        self.assertEqual(
+            list(order.items.values_list('product_id', 'name', 'qty', 'unit_price')),
+            [(self.shirt.pk, 'Blue Linen Shirt', 2, 1), (None, 'Retired Scarf', 1, 250)],
+        )
+
+
+class OrderTotalsTests(TestCase):
+
+    def setUp(self):
+        self.shirt = make_product('Blue Linen Shirt', price=500)
+        self.order = Order(item_json=cart_json(self.shirt, quantity=3), **order_fields())
+        self.items = OrderItem.build_for_order(self.order)
+        self.order.set_totals(self.items)
+        self.order.save()
+        OrderItem.objects.bulk_create(self.items)
+
+    def test_totals_set_before_the_insert(self):
+        self.order.refresh_from_db()
+        self.assertEqual((self.order.total_items, self.order.subtotal, self.order.get_total_items()), (3, 1500, 3))
+
+    def test_line_edits_update_the_order(self):
+        item = self.order.items.get()
+        item.qty = 1
+        item.save()
+        OrderItem.objects.create(order=self.order, name='Scarf', qty=2, unit_price=250)
+        self.order.refresh_from_db()
+        self.assertEqual((self.order.total_items, self.order.subtotal), (3, 1000))
+        self.order.items.get(name='Scarf').delete()
+        self.order.refresh_from_db()
+        self.assertEqual((self.order.total_items, self.order.subtotal), (1, 500))
+
+    def test_backfill_command(self):
+        Order.objects.update(total_items=0, subtotal=0)
+        call_command('backfill_order_totals', batch_size=1, stdout=io.StringIO())
+        self.order.refresh_from_db()
+        self.assertEqual((self.order.total_items, self.order.subtotal), (3, 1500))
+
+
+class CheckoutTests(TestCase):
+
+    def setUp(self):
+        self.shirt = make_product('Blue Linen Shirt', price=500)
+
+    def test_one_transaction_writes_order_lines_and_update(self):
+        order = place_order(items_json=cart_json(self.shirt, quantity=2), payment_method='cod', amount='900', **order_fields())
+        order.refresh_from_db()
+        self.assertEqual((order.payment_status, order.amount, order.total_items, order.subtotal), ('cod_pending', 900, 2, 1000))
+        self.assertEqual(list(order.items.values_list('product_id', 'qty')), [(self.shirt.pk, 2)])
+        self.assertEqual(list(OrderUpdate.objects.filter(order_id=order.pk).values_list('status_type', flat=True)), ['order_placed'])
+
+    def test_rejected_input_writes_nothing(self):
+        with self.assertRaisesMessage(CheckoutError, 'cart is empty'):
+            place_order(items_json='{}', **order_fields())
+        with self.assertRaisesMessage(CheckoutError, 'payment method'):
+            place_order(items_json=cart_json(self.shirt), payment_method='cash', **order_fields())
+        self.assertFalse(Order.objects.exists())
+
+    def test_failure_rolls_back_the_order(self):
+        with mock.patch.object(orders.order_state, 'placed', side_effect=RuntimeError('boom')):
+            with self.assertRaises(RuntimeError):
+                place_order(items_json=cart_json(self.shirt), **order_fields())
+        self.assertFalse(Order.objects.exists())
+        self.assertFalse(OrderItem.objects.exists())
+
+    def test_cart_form(self):
+        data = dict(order_fields(), itemsJson=cart_json(self.shirt), address1='1 Main St')
+        response = self.client.post('/shop/cart/', data)
+        self.assertEqual(response.context['id'], Order.objects.get().pk)
+        response = self.client.post('/shop/cart/', dict(data, itemsJson='{}'))
+        self.assertContains(response, 'Your cart is empty')
+        self.assertEqual(Order.objects.count(), 1)
+
+
+class IdempotentCheckoutTests(TestCase):
+
+    def setUp(self):
+        self.shirt = make_product('Blue Linen Shirt')
+        self.key = idempotency.make_key('asha@example.com', idempotency.new_token())
+
+    def place(self):
+        return place_order(items_json=cart_json(self.shirt), idempotency_key=self.key, **order_fields())
+
+    def test_replay_returns_the_first_order(self):
+        first = self.place()
+        with self.assertNumQueries(1):
+            second = self.place()
+        self.assertEqual(second.pk, first.pk)
+        self.assertEqual(Order.objects.count(), 1)
+        self.assertEqual(OrderItem.objects.count(), 1)
+        self.assertEqual(OrderUpdate.objects.count(), 1)
+
+    def test_lost_race_returns_the_winning_order(self):
+        first = self.place()
+        lookup = idempotency.lookup
+        # The duplicate's early lookup runs before the winner commits
+        with mock.patch.object(idempotency, 'lookup', side_effect=[None, lookup(idempotency.SCOPE_CHECKOUT, self.key)]):
+            second = self.place()
+        self.assertEqual(second.pk, first.pk)
+        self.assertEqual(Order.objects.count(), 1)
+        self.assertEqual(OrderItem.objects.count(), 1)
+        self.assertEqual(OrderUpdate.objects.count(), 1)
+
+    def test_without_key_every_submission_is_an_order(self):
+        place_order(items_json=cart_json(self.shirt), **order_fields())
+        place_order(items_json=cart_json(self.shirt), **order_fields())
+        self.assertEqual(Order.objects.count(), 2)
+
+    def test_cart_form_double_submit(self):
+        token = self.client.get('/shop/cart/').context['idempotency_key']
+        data = dict(order_fields(), itemsJson=cart_json(self.shirt), address1='1 Main St', idempotency_key=token)
+        self.client.post('/shop/cart/', data)
+        self.client.post('/shop/cart/', data)
+        self.assertEqual(Order.objects.count(), 1)
+
+    def test_expired_key_is_dropped(self):
+        self.place()
+        IdempotencyKey.objects.update(expires_at=timezone.now())
+        self.assertIsNone(idempotency.lookup(idempotency.SCOPE_CHECKOUT, self.key))
+        self.assertFalse(IdempotencyKey.objects.exists())
+
+
+class PaymentCallbackTests(TestCase):
+
+    def setUp(self):
+        self.user = get_user_model().objects.create_user(
+            email='asha@example.com', name='Asha', tc=True, password='secret-pass', is_email_verified=True,
+        )
+        self.client.force_login(self.user)
+        shirt = make_product('Blue Linen Shirt')
+        self.order = place_order(items_json=cart_json(shirt), payment_method='upi', user=self.user, **order_fields())
+
+    def callback(self, token='retry-token'):
+        return self.client.post('/shop/upi-payment-success/', {'order_id': self.order.pk}, HTTP_IDEMPOTENCY_KEY=token).json()
+
+    def payment_updates(self):
+        return OrderUpdate.objects.filter(order_id=self.order.pk, status_type='payment_received').count()
+
+    def test_replayed_callback_is_applied_once(self):
+        self.assertEqual(self.callback(), {'success': True})
+        with self.assertNumQueries(3):
+            # Session, user and the key lookup; no order writes
+            self.assertEqual(self.callback(), {'success': True})
+        self.assertEqual(self.callback('another-token'), {'success': True})
+        self.assertEqual(self.payment_updates(), 1)
+        self.assertEqual(Order.objects.get(pk=self.order.pk).payment_status, 'paid')
+
+
+class PaymentStatusTests(TestCase):
+
+    def setUp(self):
+        shirt = make_product('Blue Linen Shirt')
+        self.order = place_order(items_json=cart_json(shirt), payment_method='upi', **order_fields())
+
+    def payment_updates(self):
+        return OrderUpdate.objects.filter(order_id=self.order.pk, status_type='payment_received').count()
+
+    def test_mark_paid_twice_changes_once(self):
+        self.assertTrue(order_state.mark_paid(self.order.pk, 'UPI payment received'))
+        self.assertFalse(order_state.mark_paid(self.order.pk, 'UPI payment received'))
+        self.order.refresh_from_db()
+        self.assertEqual(self.order.payment_status, 'paid')
+        self.assertEqual(self.payment_updates(), 1)
+
+    def test_guarded_on_source_status(self):
+        self.assertFalse(order_state.set_payment_status(self.order.pk, 'refunded', 'Refunded'))
+        self.assertTrue(order_state.set_payment_status(self.order.pk, 'failed', 'Payment failed'))
+        self.assertTrue(order_state.mark_paid(self.order.pk, 'Paid on retry'))
+        self.assertFalse(order_state.mark_paid(0, 'No such order'))
+        self.order.refresh_from_db()
+        self.assertEqual(self.order.payment_status, 'paid')
+        self.assertEqual(self.payment_updates(), 1)
+
+    def test_callback_for_an_unpayable_order_fails_without_caching(self):
+        user = get_user_model().objects.create_user(email='asha@example.com', name='Asha', tc=True, password='secret-pass')
+        self.client.force_login(user)
+        Order.objects.filter(pk=self.order.pk).update(payment_status='refunded')
+        response = self.client.post('/shop/card-payment-success/', {'order_id': self.order.pk}, HTTP_IDEMPOTENCY_KEY='t')
+        self.assertEqual(response.json(), {'success': False, 'error': 'Order is not awaiting payment'})
+        self.assertFalse(IdempotencyKey.objects.exists())
+        Order.objects.filter(pk=self.order.pk).update(payment_status='pending')
+        response = self.client.post('/shop/card-payment-success/', {'order_id': self.order.pk}, HTTP_IDEMPOTENCY_KEY='t')
+        self.assertEqual(response.json(), {'success': True})
+        self.assertEqual(self.payment_updates(), 1)
+        response = self.client.post('/shop/card-payment-success/', {'order_id': 0})
+        self.assertEqual(response.json(), {'success': False, 'error': 'Order not found'})
+
+
+class OrderHistoryPageTests(TestCase):
+
+    def setUp(self):
+        shirt = make_product('Blue Linen Shirt')
+        self.user = get_user_model().objects.create_user(
+            email='asha@example.com', name='Asha', tc=True, password='secret-pass', is_email_verified=True,
+        )
+        # Repeated quantities so pages split inside runs of equal sort values
+        self.orders = [
+            place_order(items_json=cart_json(shirt, quantity=quantity), user=self.user, **order_fields())
+            for quantity in (1, 2, 2, 2, 3, 1, 2)
+        ]
+
+    def walk(self, sort, limit, **kwargs):
+        pages, cursor = [], None
+        while True:
+            orders, cursor = history.get_orders_page(self.user, sort=sort, cursor=cursor, limit=limit, **kwargs)
+            pages.append([order.pk for order in orders])
+            if cursor is None:
+                return pages
+
+    def test_pages_cover_every_order_once_in_sort_order(self):
+        by_items = sorted(self.orders, key=lambda order: (-order.total_items, -order.pk))
+        self.assertEqual(self.walk('items', 3), [
+            [order.pk for order in by_items[:3]],
+            [order.pk for order in by_items[3:6]],
+            [by_items[6].pk],
+        ])
+        newest = sorted((order.pk for order in self.orders), reverse=True)
+        self.assertEqual(sum(self.walk('newest', 2), []), newest)
+        self.assertEqual(sum(self.walk('oldest', 4), []), newest[::-1])
+
+    def test_full_last_page_has_no_cursor(self):
+        orders, cursor = history.get_orders_page(self.user, limit=7)
+        self.assertEqual(len(orders), 7)
+        self.assertIsNone(cursor)
+        self.assertEqual(history.get_orders_page(self.user, cursor='garbage')[0][0].pk, self.orders[-1].pk)
+
+    def test_filters_and_latest_update(self):
+        pages = self.walk('items', 2, filters=history.parse_filters({'min_items': '2', 'max_items': 'x'}))
+        self.assertEqual(len(sum(pages, [])), 5)
+        pages = self.walk('subtotal', 2, filters=history.parse_filters({'max_total': '1000'}))
+        self.assertEqual(len(sum(pages, [])), 6)
+        order = history.get_orders_page(self.user, limit=1)[0][0]
+        self.assertEqual(order.latest_update_status, 'order_placed')
+
+    def test_my_orders_page(self):
+        self.client.force_login(self.user)
+        response = self.client.get('/account/orders/', {'sort': 'items', 'min_total': '1500'})
+        self.assertEqual([order.pk for order in response.context['orders']], [self.orders[4].pk])
+        self.assertIsNone(response.context['next_cursor'])
+
+
+class TrackerTests(TestCase):
+
+    def setUp(self):
+        cache.clear()
+        self.addCleanup(cache.clear)
+        shirt = make_product('Blue Linen Shirt')
+        self.order = place_order(items_json=cart_json(shirt), **order_fields())
+
+    def lookup(self, email='asha@example.com'):
+        return json.loads(tracking.tracker_payload(self.order.pk, email))
+
+    def test_one_round_trip_then_cached(self):
+        with self.assertNumQueries(2):
+            payload = self.lookup()
+        self.assertEqual(payload['order']['order_status'], 'pending')
+        self.assertEqual([update['status_type'] for update in payload['updates']], ['order_placed'])
+        with self.assertNumQueries(0):
+            self.assertEqual(self.lookup(), payload)
+        # The cached entry is not handed out for another email
+        self.assertEqual(self.lookup('ravi@example.com'), {'status': 'noitem'})
+
+    def test_order_writes_invalidate_the_entry(self):
+        self.lookup()
+        with self.captureOnCommitCallbacks(execute=True):
+            order_state.apply_all([self.order.pk], 'confirmed')
+        payload = self.lookup()
+        self.assertEqual(payload['order']['order_status'], 'confirmed')
+        self.assertEqual(len(payload['updates']), 2)
+
+    @override_settings(SHOP_TRACKER_CACHE_TIMEOUT=7)
+    def test_entries_expire_after_the_configured_timeout(self):
+        with mock.patch.object(tracking.cache, 'set') as cache_set:
+            self.lookup()
+        self.assertEqual(cache_set.call_args.args[2], 7)
+
+    def test_tracker_view(self):
+        response = self.client.post('/shop/tracker/', {'orderId': self.order.pk, 'email': 'asha@example.com'})
+        self.assertEqual(json.loads(response.content)['order']['order_id'], self.order.pk)
+        response = self.client.post('/shop/tracker/', {'orderId': 'x', 'email': 'asha@example.com'})
+        self.assertEqual(json.loads(response.content), {'status': 'error'})
+
+
+@override_settings(SHOP_TRACKER_STREAM=True)
+class TrackerStreamTests(TestCase):
+
+    def setUp(self):
+        shirt = make_product('Blue Linen Shirt')
+        self.order = place_order(items_json=cart_json(shirt), **order_fields())
+        self.token = tracking.stream_token(self.order.pk)
+
+    def test_wsgi_answers_no_content(self):
+        response = self.client.get('/shop/tracker/events/', {'token': self.token})
+        self.assertEqual(response.status_code, 204)
+        with self.settings(SHOP_TRACKER_STREAM=False):
+            response = self.client.get('/shop/tracker/events/', {'token': self.token})
+        self.assertEqual(response.status_code, 204)
+
+    async def test_asgi_checks_the_token(self):
+        response = await AsyncClient().get('/shop/tracker/events/', {'token': 'forged'})
+        self.assertEqual(response.status_code, 403)
+
+    def test_tokens_expire(self):
+        self.assertEqual(tracking.stream_order_id(self.token), self.order.pk)
+        later = time.time() + tracking.STREAM_TOKEN_MAX_AGE + 1
+        with mock.patch('django.core.signing.time.time', return_value=later):
+            self.assertIsNone(tracking.stream_order_id(self.token))
+
+    async def test_stream_replays_then_pushes_updates(self):
+        broker = events.get_broker()
+        channel = events.order_channel(self.order.pk)
+        stream = events.order_event_stream(self.order.pk, last_event_id='0')
+        self.assertEqual(await anext(stream), f'retry: {events.RETRY_MS}\n\n')
+        self.assertIn('"status_type": "order_placed"', await anext(stream))
+        broker.publish(channel, {'id': 10 ** 9, 'status_type': 'shipped'})
+        self.assertTrue((await anext(stream)).startswith(f'id: {10 ** 9}\nevent: update\n'))
+        await stream.aclose()
+        self.assertEqual(broker.subscriber_count(channel), 0)
+
+
+class AdminStatusActionTests(TestCase):
+
+    def setUp(self):
+        shirt = make_product('Blue Linen Shirt')
+        self.orders = [place_order(items_json=cart_json(shirt), **order_fields()).pk for _ in range(5)]
+        Order.objects.filter(pk=self.orders[4]).update(order_status='cancelled')
+        admin = get_user_model().objects.create_superuser(
+            email='admin@example.com', name='Admin', tc=True, password='secret-pass',
+        )
+        self.client.force_login(admin)
+
+    def test_query_count_does_not_grow_with_the_selection(self):
+        # The first call also creates the rollup bucket for the new status
+        order_state.apply_all(self.orders[:1], 'confirmed')
+        with CaptureQueriesContext(connection) as one:
+            order_state.apply_all(self.orders[1:2], 'confirmed')
+        with self.assertNumQueries(len(one)):
+            order_state.apply_all(self.orders[2:4], 'confirmed')
+
+    def test_action_reports_skipped_orders(self):
+        response = self.client.post('/admin/shop/order/', {
+            'action': 'mark_as_shipped', '_selected_action': self.orders,
+        }, follow=True)
+        self.assertEqual(
+            dict(Order.objects.values_list('order_id', 'order_status')),
+            dict.fromkeys(self.orders[:4], 'shipped') | {self.orders[4]: 'cancelled'},
+        )
+        self.assertEqual(OrderUpdate.objects.filter(status_type='shipped').count(), 4)
+        self.assertEqual([str(m) for m in response.context['messages']], [
+            '4 order(s) marked as Shipped.',
+            f'1 order(s) skipped: #{self.orders[4]} (Cannot move from cancelled to shipped)',
+        ])
+
+
+class OrderStateMachineTests(TestCase):
+
+    def setUp(self):
+        shirt = make_product('Blue Linen Shirt')
+        self.pending, self.shipped, self.refunded = [
+            place_order(items_json=cart_json(shirt), **order_fields()).pk for _ in range(3)
+        ]
+        order_state.apply_all([self.shipped], 'shipped')
+        Order.objects.filter(pk=self.refunded).update(order_status='refunded')
+
+    def test_apply_all_reports_skip_reasons(self):
+        result = order_state.apply_all([self.pending, self.shipped, self.refunded, 0], 'shipped')
+        self.assertEqual(result.changed, [self.pending])
+        self.assertEqual(result.skipped, {
+            self.shipped: 'Already shipped',
+            self.refunded: 'Cannot move from refunded to shipped',
+            0: 'Order not found',
+        })
+        result = order_state.apply_all([self.pending], 'lost')
+        self.assertEqual(result.skipped, {self.pending: 'Unknown status "lost"'})
+
+    def test_apply_writes_status_dates_and_timeline(self):
+        result = order_state.apply({self.pending: 'shipped', self.shipped: 'delivered'})
+        self.assertEqual(sorted(result.changed), sorted([self.pending, self.shipped]))
+        pending = Order.objects.get(pk=self.pending)
+        self.assertEqual(pending.order_status, 'shipped')
+        self.assertIsNotNone(pending.shipping_date)
+        self.assertIsNotNone(Order.objects.get(pk=self.shipped).delivered_date)
+        self.assertEqual(
+            list(OrderUpdate.objects.filter(order_id=self.shipped).values_list('status_type', flat=True).order_by('update_id')),
+            ['order_placed', 'shipped', 'delivered'],
+        )
+
+    def test_listeners_run_on_commit(self):
+        seen = []
+        order_state.add_listener(seen.extend)
+        self.addCleanup(order_state._listeners.remove, seen.extend)
+        with self.captureOnCommitCallbacks(execute=True):
+            order_state.apply_all([self.pending], 'confirmed')
+        self.assertEqual([(update.order_id, update.status_type) for update in seen], [(self.pending, 'order_confirmed')])
+
+    def test_form_changes(self):
+        order = Order.objects.get(pk=self.pending)
+        order.order_status, order.tracking_number = 'shipped', 'TRK1234'
+        updates = order_state.form_changes(order, {'order_status': 'pending', 'tracking_number': None})
+        self.assertEqual([update.status_type for update in updates], ['shipped', 'shipped'])
+        self.assertIsNotNone(order.shipping_date)
+        self.assertEqual(order_state.form_changes(order, {'order_status': 'shipped', 'tracking_number': 'TRK1234'}), [])
+
+
+class AdminFragmentTests(TestCase):
+
+    def setUp(self):
+        cache.clear()
+        self.addCleanup(cache.clear)
+        shirt = make_product('Blue Linen Shirt', price=500)
+        self.order = place_order(items_json=cart_json(shirt, quantity=2), **order_fields())
+
+    def fragments(self):
+        return admin_fragments.order_fragments(Order.objects.get(pk=self.order.pk))
+
+    def test_rendered_once_then_cached(self):
+        fragments = self.fragments()
+        self.assertIn('Blue Linen Shirt', fragments['items'])
+        self.assertIn('1,000', fragments['items'])
+        self.assertIn(admin_fragments.STATUS_COLORS['order_placed'], fragments['timeline'])
+        order = Order.objects.get(pk=self.order.pk)
+        with self.assertNumQueries(1):
+            # Only the newest update_id is read to validate the entry
+            self.assertEqual(admin_fragments.order_fragments(order), fragments)
+        with self.assertNumQueries(0):
+            admin_fragments.order_fragments(order)
+
+    def test_new_updates_and_line_edits_refresh_the_panels(self):
+        self.fragments()
+        order_state.apply_all([self.order.pk], 'shipped')
+        self.assertIn(admin_fragments.STATUS_COLORS['shipped'], self.fragments()['timeline'])
+        with self.captureOnCommitCallbacks(execute=True):
+            self.order.items.update(name='Renamed Shirt')
+            self.order.items.get().save()
+        self.assertIn('Renamed Shirt', self.fragments()['items'])
+
+
+class OrderChangelistTests(TestCase):
+
+    def setUp(self):
+        shirt = make_product('Blue Linen Shirt')
+        self.asha = place_order(items_json=cart_json(shirt), **order_fields())
+        self.ravi = place_order(items_json=cart_json(shirt), **order_fields(
+            name='Ravi', email='ravi@example.com', phone='8888888888', city='Mumbai'))
+        Order.objects.filter(pk=self.ravi.pk).update(tracking_number='TRK42XY')
+
+    def search(self, term):
+        found = admin_changelist.indexed_order_search(Order.objects.all(), term)
+        return None if found is None else sorted(found.values_list('pk', flat=True))
+
+    def test_shaped_terms_use_indexed_columns(self):
+        self.assertEqual(self.search(f'#{self.ravi.pk}'), [self.ravi.pk])
+        self.assertEqual(self.search('88888'), [self.ravi.pk])
+        self.assertEqual(self.search('trk42'), [self.ravi.pk])
+        self.assertEqual(self.search('ASHA@example.com'), [self.asha.pk])
+        # Emails match exactly, never by substring
+        self.assertEqual(self.search('asha@example'), [])
+        # Names and cities are left to icontains
+        self.assertIsNone(self.search('Mumbai'))
+        self.assertIsNone(self.search('Ravi K'))
+
+    def test_estimated_count(self):
+        unfiltered = admin_changelist.EstimatedCountPaginator(Order.objects.all(), 10)
+        self.assertEqual(unfiltered.count, 2)
+        with mock.patch.object(admin_changelist, 'estimated_row_count', return_value=50000):
+            self.assertEqual(admin_changelist.EstimatedCountPaginator(Order.objects.all(), 10).count, 50000)
+        with mock.patch.object(admin_changelist, 'EXACT_COUNT_LIMIT', 0):
+            # Filtered counts stop one row past the limit
+            filtered = admin_changelist.EstimatedCountPaginator(Order.objects.filter(amount=0), 10)
+            self.assertEqual(filtered.count, 1)
+        self.assertEqual(admin_changelist.estimated_row_count(Order), self.ravi.pk)
+
+    def test_changelist_search(self):
+        admin = get_user_model().objects.create_superuser(
+            email='admin@example.com', name='Admin', tc=True, password='secret-pass',
+        )
+        self.client.force_login(admin)
+        response = self.client.get('/admin/shop/order/', {'q': 'TRK42'})
+        self.assertEqual([order.pk for order in response.context['cl'].result_list], [self.ravi.pk])
+        response = self.client.get('/admin/shop/order/', {'q': 'Mumbai'})
+        self.assertEqual([order.pk for order in response.context['cl'].result_list], [self.ravi.pk])
+
+
+class OrderExportTests(TestCase):
+
+    def setUp(self):
+        shirt = make_product('Blue Linen Shirt', price=500)
+        self.orders = [place_order(items_json=cart_json(shirt, quantity=n), **order_fields()) for n in (1, 2, 3)]
+        # Not backfilled yet: its lines only exist in item_json
+        self.legacy = Order.objects.create(
+            item_json=json.dumps({'pr999999_L': [1, 'Retired Scarf', 250, 'L', '']}), **order_fields(name='Ravi'),
+        )
+
+    def test_ndjson_reads_in_chunks_with_item_json_fallback(self):
+        with self.assertNumQueries(3):
+            # One order query read in two chunks, plus one OrderItem query per chunk
+            records = [json.loads(line) for line in exports.iter_export(Order.objects.all(), 'ndjson', chunk_size=2)]
+        self.assertEqual([record['order_id'] for record in records], [order.pk for order in self.orders] + [self.legacy.pk])
+        self.assertEqual(records[1]['items'], [{'name': 'Blue Linen Shirt', 'qty': 2, 'unit_price': 500, 'size': '', 'color': ''}])
+        self.assertEqual(records[3]['items'], [{'name': 'Retired Scarf', 'qty': 1, 'unit_price': 250, 'size': 'L', 'color': ''}])
+        self.assertEqual(records[0]['latest_update_status'], 'order_placed')
+        self.assertIsNone(records[3]['latest_update_status'])
+
+    def test_csv(self):
+        rows = list(csv.reader(exports.iter_export(Order.objects.filter(name='Ravi'), 'csv')))
+        self.assertEqual(rows[0], list(exports.COLUMNS))
+        record = dict(zip(rows[0], rows[1]))
+        self.assertEqual((record['name'], record['tracking_number']), ('Ravi', ''))
+        self.assertEqual(json.loads(record['items'])[0]['name'], 'Retired Scarf')
+
+    def test_admin_action_streams(self):
+        admin = get_user_model().objects.create_superuser(
+            email='admin@example.com', name='Admin', tc=True, password='secret-pass',
+        )
+        self.client.force_login(admin)
+        response = self.client.post('/admin/shop/order/', {
+            'action': 'export_ndjson', '_selected_action': [self.orders[0].pk, self.legacy.pk],
+        })
+        self.assertTrue(response.streaming)
+        self.assertEqual(response['Content-Type'], 'application/x-ndjson')
+        self.assertEqual(len(b''.join(response.streaming_content).splitlines()), 2)
+
+
+class SalesRollupTests(TestCase):
+
+    def setUp(self):
+        self.shirt = make_product('Blue Linen Shirt')
+        self.dress = make_product('Red Cotton Dress', price=900)
+        self.orders = [
+            place_order(items_json=cart_json(self.shirt, self.dress, quantity=2), payment_method=method,
+                        amount=2800, **order_fields())
+            for method in ('upi', 'cod', 'cc')
+        ]
+
+    def snapshot(self):
+        return (
+            sorted(DailySales.objects.filter(orders__gt=0).values_list(
+                'day', 'payment_method', 'payment_status', 'order_status', 'city', 'orders', 'revenue', 'items')),
+            sorted(DailyProductSales.objects.filter(orders__gt=0).values_list(
+                'day', 'product_id', 'orders', 'quantity', 'revenue')),
+        )
+
+    def assertMatchesRebuild(self):
+        incremental = self.snapshot()
+        rollups.rebuild()
+        self.assertEqual(incremental, self.snapshot())
+        return incremental
+
+    def test_checkout_adds_orders(self):
+        sales, products = self.assertMatchesRebuild()
+        self.assertEqual(sum(row[5] for row in sales), 3)
+        self.assertEqual(sum(row[6] for row in sales), 3 * 2800)
+        self.assertEqual({row[1]: row[3] for row in products}, {self.shirt.pk: 6, self.dress.pk: 6})
+
+    def test_payment_and_status_moves(self):
+        order_state.mark_paid(self.orders[0].pk, 'Paid')
+        order_state.set_payment_status(self.orders[2].pk, 'failed', 'Payment failed')
+        order_state.mark_paid(self.orders[2].pk, 'Paid on retry')
+        order_state.apply_all([order.pk for order in self.orders[:2]], 'shipped')
+        sales, _ = self.assertMatchesRebuild()
+        self.assertEqual(sorted(row[2] for row in sales), ['cod_pending', 'paid', 'paid'])
+
+    def test_apply_records_only_rows_it_changed(self):
+        first, second, _ = [order.pk for order in self.orders]
+        check = order_state.check
+
+        def ship_second_meanwhile(current, target):
+            # Another admin ships the second order after this batch read it
+            if not OrderUpdate.objects.filter(order_id=second, status_type='shipped').exists():
+                with mock.patch.object(order_state, 'check', check):
+                    order_state.apply_all([second], 'shipped')
+            return check(current, target)
+
+        with mock.patch.object(order_state, 'check', side_effect=ship_second_meanwhile):
+            result = order_state.apply_all([first, second], 'shipped')
+        self.assertEqual(result.changed, [first])
+        self.assertEqual(result.skipped, {second: 'Changed by someone else'})
+        self.assertEqual(OrderUpdate.objects.filter(status_type='shipped').count(), 2)
+        self.assertMatchesRebuild()
+
+    def test_admin_edit_and_delete(self):
+        admin = get_user_model().objects.create_superuser(
+            email='admin@example.com', name='Admin', tc=True, password='secret-pass',
+        )
+        self.client.force_login(admin)
+        order = self.orders[2]
+        response = self.client.post(f'/admin/shop/order/{order.pk}/change/', {
+            'name': order.name, 'email': order.email, 'phone': order.phone, 'address': order.address,
+            'zip_code': order.zip_code, 'payment_method': order.payment_method,
+            'payment_status': order.payment_status, 'order_status': 'confirmed', 'amount': '1400',
+            'city': 'Mumbai', 'user': '', 'notes': '',
+            'orderupdate_set-TOTAL_FORMS': '0', 'orderupdate_set-INITIAL_FORMS': '0',
+        })
+        self.assertEqual(response.status_code, 302)
+        self.orders[1].delete()
+        sales, _ = self.assertMatchesRebuild()
+        self.assertEqual(sorted((row[4], row[6]) for row in sales), [('Mumbai', 1400), ('Pune', 2800)])
+
+
+class RefusingEmailBackend(BaseEmailBackend):
+    """Mail backend whose server rejects every message"""
+
+    def send_messages(self, email_messages):
+        raise ConnectionError('550 mailbox unavailable')
+
+
+@override_settings(OUTBOX_MAX_ATTEMPTS=3, OUTBOX_RETRY_DELAY=30, OUTBOX_MAX_RETRY_DELAY=100)
+class OutboxTests(TestCase):
+
+    def make_due(self):
+        OutgoingEmail.objects.update(next_attempt_at=timezone.now())
+
+    def test_enqueue_then_drain(self):
+        self.assertFalse(settings.OUTBOX_SEND_NOW)
+        queued = outbox.enqueue('Hello', 'Body', 'asha@example.com', html_body='<p>Body</p>')
+        self.assertEqual(queued.status, outbox.PENDING)
+        self.assertEqual(mail.outbox, [])
+        self.assertEqual(outbox.drain(), (1, 0, 0))
+        self.assertEqual(outbox.drain(), (0, 0, 0))
+        queued.refresh_from_db()
+        self.assertEqual((queued.status, queued.attempts, queued.body), (outbox.SENT, 1, 'Body'))
+        self.assertTrue(outbox.is_sent(queued.pk))
+        self.assertEqual(mail.outbox[0].to, ['asha@example.com'])
+        self.assertEqual(mail.outbox[0].alternatives[0][1], 'text/html')
+
+    def test_sensitive_bodies_are_redacted_once_handled(self):
+        sent = outbox.enqueue('Code', 'Your code is 123456', 'asha@example.com', html_body='<b>123456</b>', sensitive=True)
+        outbox.drain()
+        self.assertIn('123456', mail.outbox[0].body)
+        sent.refresh_from_db()
+        self.assertEqual((sent.body, sent.html_body), (outbox.REDACTED, outbox.REDACTED))
+        with self.settings(EMAIL_BACKEND='shop.tests.RefusingEmailBackend', OUTBOX_MAX_ATTEMPTS=1):
+            failed = outbox.enqueue('Code', 'Your code is 654321', 'asha@example.com', sensitive=True)
+            self.assertEqual(outbox.drain(), (0, 0, 1))
+        failed.refresh_from_db()
+        self.assertEqual((failed.status, failed.body), (outbox.FAILED, outbox.REDACTED))
+
+    def test_retry_delay_backs_off_up_to_the_cap(self):
+        self.assertEqual(
+            [outbox.retry_delay(attempts).total_seconds() for attempts in (1, 2, 3, 4)],
+            [30, 60, 100, 100],
+        )
+
+    @override_settings(EMAIL_BACKEND='shop.tests.RefusingEmailBackend')
+    def test_failed_sends_are_retried_then_marked_failed(self):
+        queued = outbox.enqueue('Hello', 'Body', 'asha@example.com')
+        self.assertEqual(outbox.drain(), (0, 1, 0))
+        queued.refresh_from_db()
+        self.assertEqual((queued.status, queued.attempts), (outbox.PENDING, 1))
+        self.assertIn('550', queued.last_error)
+        self.assertGreater(queued.next_attempt_at, timezone.now() + datetime.timedelta(seconds=25))
+        # Not due yet
+        self.assertEqual(outbox.drain(), (0, 0, 0))
+        self.make_due()
+        self.assertEqual(outbox.drain(), (0, 1, 0))
+        self.make_due()
+        self.assertEqual(outbox.drain(), (0, 0, 1))
+        queued.refresh_from_db()
+        self.assertEqual((queued.status, queued.attempts, queued.body), (outbox.FAILED, 3, 'Body'))
+        self.make_due()
+        self.assertEqual(outbox.drain(), (0, 0, 0))
+
+    def test_claimed_messages_are_not_claimed_twice(self):
+        for n in range(3):
+            outbox.enqueue(f'Hello {n}', 'Body', 'asha@example.com')
+        first = outbox.claim(2)
+        second = outbox.claim(2)
+        self.assertEqual(len(first), 2)
+        self.assertEqual(len(second), 1)
+        self.assertFalse({m.pk for m in first} & {m.pk for m in second})
+
+    def test_send_now(self):
+        with self.settings(OUTBOX_SEND_NOW=True):
+            sent = outbox.enqueue('Hello', 'Body', 'asha@example.com')
+            with self.settings(EMAIL_BACKEND='shop.tests.RefusingEmailBackend'):
+                kept = outbox.enqueue('Hello', 'Body', 'asha@example.com')
+        self.assertEqual(sent.status, outbox.SENT)
+        self.assertEqual(len(mail.outbox), 1)
+        self.assertEqual((kept.status, kept.attempts), (outbox.PENDING, 1))
+        self.make_due()
+        self.assertEqual(outbox.drain(), (1, 0, 0))
+
+
+class CustomerNotificationTests(TestCase):
+
+    def setUp(self):
+        shirt = make_product('Blue Linen Shirt')
+        self.first = place_order(items_json=cart_json(shirt), **order_fields())
+        self.second = place_order(items_json=cart_json(shirt), **order_fields(email='ravi@example.com'))
+        order_state.apply_all([self.first.pk, self.second.pk], 'confirmed')
+
+    def unnotified(self):
+        return OrderUpdate.objects.filter(is_customer_notified=False).count()
+
+    def test_batch_boundary_coalesces_per_order(self):
+        # The first update alone fills the batch; the rest of its order's updates come along
+        self.assertEqual(notifications.notify_batch(batch_size=1), (2, 1))
+        message = OutgoingEmail.objects.get()
+        self.assertEqual(message.to, ['asha@example.com'])
+        self.assertEqual(message.subject, f'Order #{self.first.pk}: 2 updates')
+        self.assertEqual(self.unnotified(), 2)
+        self.assertEqual(notifications.notify_batch(batch_size=1), (2, 1))
+        self.assertEqual(notifications.notify_batch(batch_size=1), (0, 0))
+        self.assertEqual(OutgoingEmail.objects.filter(to=['ravi@example.com']).count(), 1)
+
+    @override_settings(CUSTOMER_NOTIFY_MAX_AGE=60)
+    def test_old_updates_are_flagged_without_email(self):
+        OrderUpdate.objects.filter(order_id=self.first.pk).update(timestamp=timezone.now() - datetime.timedelta(hours=1))
+        self.assertEqual(notifications.notify_pending(), (4, 1))
+        self.assertEqual(self.unnotified(), 0)
+        self.assertEqual(list(OutgoingEmail.objects.values_list('to', flat=True)), [['ravi@example.com']])
@@ -0,0 +1,129 @@
+"""
+Order tracker lookups for shop.views.tracker.
+
+The order and its updates are fetched together (one prefetch_related round
+trip) and serialised through a fixed field schema into the JSON the tracker
+page polls for. The encoded payload is cached per order alongside a hash of
+the email it was looked up with, so repeated polls skip the database
+entirely; shop.signals drops the entry whenever the order or one of its
+updates is written. That only reaches the writing process's cache, so the
+entry lives for settings.SHOP_TRACKER_CACHE_TIMEOUT seconds (short unless the
+default cache is shared between workers).
+"""
+import hashlib
+import json
+from operator import attrgetter
+
+from django.conf import settings
+from django.core import signing
+from django.core.cache import cache
+from django.db.models import Prefetch
+
+from .models import Order, OrderUpdate
+
+CACHE_KEY = 'shop:tracker:{}'
+
+NOT_FOUND = '{"status":"noitem"}'
+
+# Signs the order id handed to the tracker page for its live event stream
+STREAM_SALT = 'shop.tracker.events'
+# A tracker page left open longer than this has to look the order up again
+STREAM_TOKEN_MAX_AGE = 12 * 60 * 60
+
+
+def _text(getter):
+    return lambda obj: str(getter(obj) or '')
+
+
+def _str_or_none(getter):
+    def value(obj):
+        raw = getter(obj)
+        return str(raw) if raw else None
+    return value
+
+
+# Response schemas: (json key, accessor) resolved once at import time
+ORDER_SCHEMA = tuple((key, attrgetter(key)) for key in (
+    'order_id', 'amount', 'name', 'address', 'city', 'zip_code', 'phone',
+    'payment_method', 'payment_status', 'order_status',
+)) + (
+    ('tracking_number', _text(attrgetter('tracking_number'))),
+    ('created_at', _str_or_none(attrgetter('created_at'))),
+)
+UPDATE_SCHEMA = (
+    ('text', attrgetter('update_desc')),
+    ('time', lambda update: str(update.timestamp)),
+    ('status_type', attrgetter('status_type')),
+    ('tracking_number', _text(attrgetter('tracking_number'))),
+    ('location', _text(attrgetter('location'))),
+)
+
+_encode = json.JSONEncoder(default=str).encode
+
+
+def email_hash(email):
+    return hashlib.sha256((email or '').encode()).hexdigest()
+
+
+def cache_key(order_id):
+    return CACHE_KEY.format(order_id)
+
+
+def invalidate(order_id):
+    if order_id is not None:
+        cache.delete(cache_key(order_id))
+
+
+def invalidate_many(order_ids):
+    cache.delete_many([cache_key(order_id) for order_id in order_ids])
+
+
+def stream_token(order_id):
+    """Opaque token authorising the live event stream of one order"""
+    return signing.dumps(order_id, salt=STREAM_SALT)
+
+
+def stream_order_id(token):
+    """Order id from a stream_token, or None if it does not verify"""
+    try:
+        return int(signing.loads(token, salt=STREAM_SALT, max_age=STREAM_TOKEN_MAX_AGE))
+    except (signing.BadSignature, TypeError, ValueError):
+        return None
+
+
+def serialize_update(update):
+    data = {key: get(update) for key, get in UPDATE_SCHEMA}
+    data['id'] = update.update_id
+    return data
+
+
+def serialize(order):
+    """Build the tracker JSON for an order with prefetched updates"""
+    return _encode({
+        'status': 'success',
+        'updates': [serialize_update(update) for update in order.orderupdate_set.all()],
+        'itemsJson': order.item_json,
+        'order': {key: get(order) for key, get in ORDER_SCHEMA},
+        # Without a live stream the page falls back to polling
+        'streamToken': stream_token(order.order_id) if settings.SHOP_TRACKER_STREAM else '',
+    })
+
+
+def tracker_payload(order_id, email):
+    """
+    Return the tracker JSON for (order_id, email), or NOT_FOUND.
+    Raises ValueError for a malformed order id.
+    """
+    order_id = int(order_id)
+    digest = email_hash(email)
+    cached = cache.get(cache_key(order_id))
+    if cached is not None and cached[0] == digest:
+        return cached[1]
+
+    updates = Prefetch('orderupdate_set', queryset=OrderUpdate.objects.order_by('timestamp', 'update_id'))
+    order = Order.objects.filter(order_id=order_id, email=email).prefetch_related(updates).first()
+    if order is None:
+        return NOT_FOUND
+    payload = serialize(order)
+    cache.set(cache_key(order_id), (digest, payload), settings.SHOP_TRACKER_CACHE_TIMEOUT)
+    return payload
@@ -7,16 +7,19 @@ from django.conf.urls.static import static
 urlpatterns=[
     path('', views.index, name='shopHome'),
     path('search/', views.search, name='Search'),
+    path('search/suggest/', views.search_suggest, name='SearchSuggest'),
     path("products/<int:myid>", views.productView, name="ProductView"),
     path('mencat/', views.mencat, name='MensCategory'),
     path('womencat/', views.womencat, name='WomensCategory'),
     path('kidscat/', views.kidscat, name='KidsCategory'),
+    path('category/<slug:slug>/more/', views.category_more, name='CategoryMore'),
     path('cart/', views.cart, name='Cart'),
     path('checkout/', views.checkout, name='Checkout'),
     path('upi-payment-success/', views.upi_payment_success, name='UPIPaymentSuccess'),
     path('card-payment-success/', views.card_payment_success, name='CardPaymentSuccess'),
     path('order-success/', views.order_success, name='OrderSuccess'),
     path('tracker/', views.tracker, name='TrackingStatus'),
+    path('tracker/events/', views.tracker_events, name='TrackerEvents'),
     path('about/', views.about, name='AboutUs'),
     path('contact/', views.contact, name='ContactUs'),
     path('login/', views.login, name='Login'),
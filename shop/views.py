@@ -1,11 +1,27 @@
 from django.shortcuts import render, get_object_or_404
-from django.http import HttpResponse
+from django.conf import settings
+from django.core.handlers.asgi import ASGIRequest
+from django.http import HttpResponse, JsonResponse, Http404, StreamingHttpResponse
+from django.core.paginator import Paginator
+from django.db import IntegrityError, transaction
+from django.urls import reverse
+from django.utils.http import urlencode
 from .models import Product,Contact,Order,OrderUpdate
+from .orders import CheckoutError, place_order
+from .state_machine import order_state
+from .tracking import stream_order_id, tracker_payload
+from .events import order_event_stream
+from . import idempotency
 from blog.models import BlogPost
-from math import ceil
 import json
 from django.contrib.auth.decorators import login_required
-from django.db.models import Q
+from .catalog import build_category_slides, get_category_slides
+from .search_index import search_index, load_ranked, tokenize
+from . import search_fts
+from .suggest import suggest_index
+from .fuzzy import trigram_index
+from .facets import RESULTS_PER_PAGE, apply_filters, facet_counts, facet_links, parse_filters
+from .listing import CATEGORY_PAGES, PAGE_SIZE, get_category_page, serialize_product
 
 # Create your views here.
 def index(request):
@@ -14,15 +30,8 @@ def index(request):
     # nSlides= n//4 + ceil((n/4)-(n/4))
     # params={'no_of_slides':nSlides, 'range':range(1,nSlides),'product':products}
     
-    allProds = []
-    catprods= Product.objects.values('category','id')
-    cats = {item ['category'] for item in catprods}
-    for cat in cats:
-        prod = Product.objects.filter(category=cat)
-        n = len(prod)
-        nSlides = n // 4 + ceil((n/4)-(n//4))
-        allProds.append([prod,range(1,nSlides) ,nSlides])
-   
+    # Grouped in one query and cached in memory (see shop.catalog)
+    allProds = get_category_slides()
     params = {'allProds': allProds}
     return render(request,'shop/index.html',params)
 
@@ -36,55 +45,61 @@ def search(request):
     query = request.GET.get('search', '').strip()
     
     # Initialize result containers
-    products = Product.objects.none()  # Empty QuerySet
-    blog_posts = BlogPost.objects.none()  # Empty QuerySet
+    products = []
+    blog_posts = []
     categories = []
     allProds = []
+    suggested_query = ''
+    filters = parse_filters(request.GET)
+    facets = {}
+    page_obj = None
+    product_count = 0
     
     # Only search if query is provided and has at least 2 characters
     if query and len(query) >= 2:
-        # Search Products using Q objects for better performance
-        product_query = Q(product_name__icontains=query) | \
-                       Q(desc__icontains=query) | \
-                       Q(category__icontains=query) | \
-                       Q(subcategory__icontains=query)
-        
-        products = Product.objects.filter(product_query).distinct()
+        if search_fts.is_enabled():
+            # SQLite FTS5 backend: bm25 ranking plus highlighted snippets
+            product_hits = search_fts.search_products(query)
+            blog_posts = load_ranked(BlogPost, search_fts.search_posts(query))
+        else:
+            # Ranked lookups against the in-memory inverted index (see shop.search_index)
+            product_hits = search_index.search_products(query)
+            blog_posts = load_ranked(BlogPost, search_index.search_posts(query))
         
-        # Search Blog Posts
-        blog_query = Q(title__icontains=query) | \
-                    Q(head0__icontains=query) | \
-                    Q(chead0__icontains=query) | \
-                    Q(head1__icontains=query) | \
-                    Q(chead1__icontains=query) | \
-                    Q(head2__icontains=query) | \
-                    Q(chead2__icontains=query) | \
-                    Q(conclusion__icontains=query)
+        # Nothing matched exactly: fall back to the nearest products by trigram similarity
+        if not product_hits and not blog_posts:
+            product_hits, suggested_query = trigram_index.search(query)
         
-        blog_posts = BlogPost.objects.filter(blog_query).distinct()
+        if product_hits:
+            # Facet counts over every match in one grouped query, then filter and
+            # paginate the ranked ids so only one page of rows is loaded
+            product_ids = [pk for pk, _ in product_hits]
+            facets = facet_counts(product_ids)
+            filtered_ids = apply_filters(product_ids, filters)
+            product_count = len(filtered_ids)
+            page_obj = Paginator(filtered_ids, RESULTS_PER_PAGE).get_page(request.GET.get('page'))
+            extras = dict(product_hits)
+            products = load_ranked(Product, [(pk, extras[pk]) for pk in page_obj.object_list])
         
-        # Get unique categories that match the query
-        matching_categories = Product.objects.filter(
-            category__icontains=query
-        ).values_list('category', flat=True).distinct()
-        categories = list(matching_categories)
+        # Matching categories whose name matches every query term
+        query_tokens = set(tokenize(query))
+        for value, _, _ in facets.get('category', []):
+            if query_tokens <= set(tokenize(value)):
+                categories.append(value)
         
-        # Organize products by category for display (similar to index page)
-        if products.exists():
-            catprods = products.values('category', 'id')
-            cats = {item['category'] for item in catprods}
-            for cat in cats:
-                prod = products.filter(category=cat)
-                n = prod.count()
-                nSlides = n // 4 + ceil((n / 4) - (n // 4))
-                if n > 0:
-                    allProds.append([prod, range(1, nSlides), nSlides])
+        # Organize products by category for display (similar to index page),
+        # categories ordered by their best ranked product
+        cat_rank = {}
+        for product in products:
+            cat_rank.setdefault(product.category, len(cat_rank))
+        allProds = build_category_slides(sorted(products, key=lambda p: cat_rank[p.category]))
     
-    # Prepare context - use count() for QuerySets to avoid unnecessary evaluation
-    product_count = products.count()
-    blog_count = blog_posts.count()
+    # Prepare context
+    blog_count = len(blog_posts)
     category_count = len(categories)
     total_results = product_count + blog_count + category_count
+    page_query = request.GET.copy()
+    page_query.pop('page', None)
     
     params = {
         'query': query,
@@ -97,6 +112,11 @@ def search(request):
         'blog_count': blog_count,
         'category_count': category_count,
         'has_results': total_results > 0,
+        'suggested_query': suggested_query if products else '',
+        'facets': facet_links(facets, filters, request.GET),
+        'active_filters': filters,
+        'page_obj': page_obj,
+        'page_query': page_query.urlencode(),
         'msg': '' if (query and len(query) >= 2) else 'Please enter at least 2 characters to search'
     }
     
@@ -107,49 +127,66 @@ def search(request):
     return render(request, 'shop/search.html', params)
 
 
+def search_suggest(request):
+    """Typeahead completions for the navbar search box (JSON)"""
+    query = request.GET.get('q', '').strip()
+    try:
+        limit = max(1, min(int(request.GET.get('limit', 8)), 20))
+    except ValueError:
+        limit = 8
+    suggestions = []
+    for kind, ref, label in suggest_index.suggest(query, limit):
+        if kind == 'product':
+            url = reverse('ProductView', args=[ref])
+        elif kind == 'post':
+            url = reverse('blogPost', args=[ref])
+        else:
+            url = reverse('Search') + '?' + urlencode({'search': label})
+        suggestions.append({'text': label, 'type': kind, 'url': url})
+    return JsonResponse({'query': query, 'suggestions': suggestions})
+
+
 def productView(request, myid):
     # Fetch the product using the id
     product = get_object_or_404(Product, id=myid)
     return render(request, 'shop/prodView.html', {'product': product})
-def mencat(request):
-    # Fetch products with the subcategory "Men's Fashion"
-    category = "Men's Fashion"
-    prods = Product.objects.filter(category=category)
-    
+def category_listing(request, slug):
+    """Shared listing for the category pages, first page rendered server side"""
+    category, template = CATEGORY_PAGES[slug]
+    prods, next_cursor = get_category_page(category)
+
     # Divide the products into rows of 4
-    n = len(prods)
-    nSlides = n // 4 + ceil((n / 4) - (n // 4))
-    allProds = [prods[i:i + 4] for i in range(0, n, 4)]  # Fix the range
+    allProds = [prods[i:i + 4] for i in range(0, len(prods), 4)]
     ran=len(allProds)
-    params = {'allProds': allProds, 'ran':ran}
-    # print(params)
-    return render(request, 'shop/men.html', params)
+    params = {
+        'allProds': allProds,
+        'ran': ran,
+        'next_cursor': next_cursor,
+        'more_url': reverse('CategoryMore', args=[slug]),
+    }
+    return render(request, template, params)
+
+def category_more(request, slug):
+    """Load-more endpoint for the category pages (keyset paginated JSON)"""
+    if slug not in CATEGORY_PAGES:
+        raise Http404("Unknown category")
+    category, _ = CATEGORY_PAGES[slug]
+    try:
+        limit = int(request.GET.get('limit', PAGE_SIZE))
+    except ValueError:
+        limit = PAGE_SIZE
+    prods, next_cursor = get_category_page(category, request.GET.get('cursor'), limit)
+    return JsonResponse({
+        'products': [serialize_product(p) for p in prods],
+        'next_cursor': next_cursor,
+    })
+
+def mencat(request):
+    return category_listing(request, 'men')
 def womencat(request):
-    # Fetch products with the subcategory "Women's Fashion"
-    category = "Women's Fashion"
-    prods = Product.objects.filter(category=category)
-    
-    # Divide the products into rows of 4
-    n = len(prods)
-    nSlides = n // 4 + ceil((n / 4) - (n // 4))
-    allProds = [prods[i:i + 4] for i in range(0, n, 4)]  # Fix the range
-    ran=len(allProds)
-    params = {'allProds': allProds, 'ran':ran}
-    # print(params)
-    return render(request, 'shop/women.html', params)
+    return category_listing(request, 'women')
 def kidscat(request):
-    # Fetch products with the subcategory "kid's Fashion"
-    category = "Kids Wear"
-    prods = Product.objects.filter(category=category)
-    
-    # Divide the products into rows of 4
-    n = len(prods)
-    nSlides = n // 4 + ceil((n / 4) - (n // 4))
-    allProds = [prods[i:i + 4] for i in range(0, n, 4)]  # Fix the range
-    ran=len(allProds)
-    params = {'allProds': allProds, 'ran':ran}
-    # print(params)
-    return render(request, 'shop/kids.html', params)
+    return category_listing(request, 'kids')
 def cart(request):
     if request.method == "POST":
         # Process order when form is submitted
@@ -161,25 +198,28 @@ def cart(request):
         city = request.POST.get('city', '')
         zip_code = request.POST.get('zip_code', '')
         
-        # Save order to database
-        order = Order(
-            item_json=items_json,
-            name=name,
-            email=email,
-            address=address,
-            phone=phone,
-            city=city,
-            zip_code=zip_code
-        )
-        order.save()
-        
-        # Create order update
-        update = OrderUpdate(
-            order=order,
-            status_type='order_placed',
-            update_desc="The order has been placed"
-        )
-        update.save()
+        # Order, items and first update are written in one transaction;
+        # a resubmitted form with the same token gets the same order back
+        token = idempotency.request_token(request)
+        try:
+            order = place_order(
+                items_json=items_json,
+                name=name,
+                email=email,
+                address=address,
+                phone=phone,
+                city=city,
+                zip_code=zip_code,
+                idempotency_key=(idempotency.make_key(email.lower(), token) if token else ''),
+                user=(request.user if request.user.is_authenticated else None)
+            )
+        except CheckoutError as e:
+            return render(request, 'shop/cart.html', {
+                'cart_exists': True,
+                'error': str(e),
+                # Nothing was written, so the corrected form may reuse its token
+                'idempotency_key': token or idempotency.new_token()
+            })
         
         # Show success message with order ID
         return render(request, 'shop/cart.html', {
@@ -194,7 +234,8 @@ def cart(request):
     
     # Return the cart page with basic context
     return render(request, 'shop/cart.html', {
-        'cart_exists': True
+        'cart_exists': True,
+        'idempotency_key': idempotency.new_token()
     })
 
 @login_required(login_url='account:login')
@@ -218,134 +259,148 @@ def checkout(request):
         zip_code = request.POST.get('zip_code','')
         payment = request.POST.get('payment','cc')
         order_total = request.POST.get('order_total', '0')
-        try:
-            amount_int = int(order_total)
-        except Exception:
-            amount_int = 0
         
-        # Create order
-        order = Order(
-            item_json=items_json,
-            name=name,
-            email=email,
-            address=address,
-            phone=phone,
-            city=city,
-            zip_code=zip_code,
-            amount=amount_int,
-            payment_method=payment,
-            payment_status=('cod_pending' if payment=='cod' else 'pending')
-        )
-        order.save()
-        
-        # Create order update
-        update_desc = "The order has been placed"
-        status_type = 'order_placed'
-        if payment == 'cod':
-            update_desc = "Order placed with Cash on Delivery"
-        update = OrderUpdate(
-            order=order,
-            status_type=status_type,
-            update_desc=update_desc
-        )
-        update.save()
+        # Create order, its items and the initial update in one transaction.
+        # A double-click or browser retry carries the same form token and
+        # gets the already placed order back instead of a second one.
+        token = idempotency.request_token(request)
+        try:
+            order = place_order(
+                items_json=items_json,
+                name=name,
+                email=email,
+                address=address,
+                phone=phone,
+                city=city,
+                zip_code=zip_code,
+                amount=order_total,
+                payment_method=payment,
+                idempotency_key=(idempotency.make_key(request.user.pk, token) if token else ''),
+                user=request.user
+            )
+        except CheckoutError as e:
+            return render(request, 'shop/modern_checkout.html', {
+                'error': str(e),
+                'idempotency_key': idempotency.new_token()
+            })
         
         # Secure: Save order ID to session to verify ownership in success page
         request.session['last_order_id'] = order.order_id
         
-        # Handle different payment methods
-        if payment == 'cod':
-            # Cash on Delivery - show confirmation page
-            return render(request, 'shop/cod_confirmation.html', {
-                'order_id': order.order_id,
-                'name': name,
-                'address': address,
-                'city': city,
-                'zip': zip_code
-            })
-        elif payment == 'upi':
-            # UPI Payment - redirect to UPI payment page
-            return render(request, 'shop/upi_payment.html', {
-                'order_id': order.order_id,
-                'amount': amount_int,
-                'name': name
-            })
-        elif payment == 'cc':
-            # Credit Card Payment - redirect to card payment processing page
-            card_number = request.POST.get('card_number', '').replace(' ', '')
-            expiry = request.POST.get('expiry', '')
-            cvv = request.POST.get('cvv', '')
-            card_name = request.POST.get('card_name', name)
-            
-            return render(request, 'shop/card_payment.html', {
-                'order_id': order.order_id,
-                'amount': amount_int,
-                'name': name,
-                'card_number': card_number,
-                'expiry': expiry,
-                'cvv': cvv,
-                'card_name': card_name
-            })
-        else:
-            # Default - return success response
-            return render(request, 'shop/modern_checkout.html', {
-                'order_id': order.order_id,
-                'success': True
-            })
+        return _render_payment_step(request, order)
+    
+    # For GET requests, render our modern checkout template with a fresh
+    # token so resubmitting this form cannot place a second order
+    return render(request, 'shop/modern_checkout.html', {
+        'idempotency_key': idempotency.new_token()
+    })
+
+def _render_payment_step(request, order):
+    """Render the page that follows checkout for the order's payment method"""
+    # Built from the stored order so a replayed submission renders the same page
+    amount_int = order.amount
+    name = order.name
+    # Token the payment page sends back with its success callback
+    payment_key = idempotency.new_token()
+    
+    # Handle different payment methods
+    if order.payment_method == 'cod':
+        # Cash on Delivery - show confirmation page
+        return render(request, 'shop/cod_confirmation.html', {
+            'order_id': order.order_id,
+            'name': name,
+            'address': order.address,
+            'city': order.city,
+            'zip': order.zip_code
+        })
+    elif order.payment_method == 'upi':
+        # UPI Payment - redirect to UPI payment page
+        return render(request, 'shop/upi_payment.html', {
+            'order_id': order.order_id,
+            'amount': amount_int,
+            'name': name,
+            'payment_key': payment_key
+        })
+    elif order.payment_method == 'cc':
+        # Credit Card Payment - redirect to card payment processing page
+        card_number = request.POST.get('card_number', '').replace(' ', '')
+        expiry = request.POST.get('expiry', '')
+        cvv = request.POST.get('cvv', '')
+        card_name = request.POST.get('card_name', name)
+        
+        return render(request, 'shop/card_payment.html', {
+            'order_id': order.order_id,
+            'amount': amount_int,
+            'name': name,
+            'card_number': card_number,
+            'expiry': expiry,
+            'cvv': cvv,
+            'card_name': card_name,
+            'payment_key': payment_key
+        })
+    else:
+        # Default - return success response
+        return render(request, 'shop/modern_checkout.html', {
+            'order_id': order.order_id,
+            'success': True
+        })
+
+def _payment_callback(request, scope, update_desc):
+    """
+    Mark an order paid and append its payment update, at most once per
+    (user, order, Idempotency-Key). A replayed callback gets the stored JSON
+    response back without touching Order or OrderUpdate. Callbacks without a
+    key are keyed on the order alone, so only the first one is applied.
+    """
+    try:
+        order_id = int(request.POST.get('order_id'))
+    except (TypeError, ValueError):
+        return HttpResponse(json.dumps({'success': False, 'error': 'Order not found'}), content_type='application/json')
+    token = idempotency.request_token(request)
+    key = idempotency.make_key(f'{request.user.pk}:{order_id}', token)
+    record = idempotency.lookup(scope, key)
+    if record is not None:
+        return HttpResponse(record.response, content_type='application/json')
     
-    # For GET requests, render our modern checkout template
-    return render(request, 'shop/modern_checkout.html')
+    try:
+        with transaction.atomic():
+            # Guarded UPDATE: only a pending payment becomes paid, and only
+            # then is the 'payment_received' update written
+            if not order_state.mark_paid(order_id, update_desc):
+                payment_status = Order.objects.filter(pk=order_id).values_list('payment_status', flat=True).first()
+                if payment_status is None:
+                    return HttpResponse(json.dumps({'success': False, 'error': 'Order not found'}), content_type='application/json')
+                # Refunded and similar orders cannot be paid; not remembered,
+                # so the outcome is re-checked on the next callback
+                if payment_status != 'paid':
+                    return HttpResponse(json.dumps({'success': False, 'error': 'Order is not awaiting payment'}), content_type='application/json')
+            # An order that was already paid still reports success
+            body = json.dumps({'success': True})
+            # A concurrent duplicate fails here and rolls back
+            idempotency.remember(scope, key, order_id=order_id, response=body)
+    except IntegrityError:
+        record = idempotency.lookup(scope, key)
+        if record is None:
+            raise
+        body = record.response
+    return HttpResponse(body, content_type='application/json')
 
 @login_required(login_url='account:login')
 def upi_payment_success(request):
     """Handle UPI payment success callback"""
     if request.method == 'POST':
-        order_id = request.POST.get('order_id')
-        try:
-            order = Order.objects.get(order_id=order_id)
-            # Update payment status to paid
-            order.payment_status = 'paid'
-            order.save()
-            
-            # Create order update
-            update = OrderUpdate(
-                order=order,
-                status_type='payment_received',
-                update_desc="Payment received via UPI. Order confirmed."
-            )
-            update.save()
-            
-            return HttpResponse(json.dumps({'success': True}), content_type='application/json')
-        except Order.DoesNotExist:
-            return HttpResponse(json.dumps({'success': False, 'error': 'Order not found'}), content_type='application/json')
+        return _payment_callback(request, idempotency.SCOPE_UPI, "Payment received via UPI. Order confirmed.")
     return HttpResponse(json.dumps({'success': False, 'error': 'Invalid request'}), content_type='application/json')
 
 @login_required(login_url='account:login')
 def card_payment_success(request):
     """Handle credit card payment success callback"""
     if request.method == 'POST':
-        order_id = request.POST.get('order_id')
         card_last4 = request.POST.get('card_last4', '')
-        try:
-            order = Order.objects.get(order_id=order_id)
-            # Update payment status to paid
-            order.payment_status = 'paid'
-            order.save()
-            
-            # Create order update
-            update_desc = "Payment received via Credit/Debit Card. Order confirmed."
-            if card_last4:
-                update_desc += f" Card ending in {card_last4}."
-            update = OrderUpdate(
-                order=order,
-                status_type='payment_received',
-                update_desc=update_desc
-            )
-            update.save()
-            
-            return HttpResponse(json.dumps({'success': True}), content_type='application/json')
-        except Order.DoesNotExist:
-            return HttpResponse(json.dumps({'success': False, 'error': 'Order not found'}), content_type='application/json')
+        update_desc = "Payment received via Credit/Debit Card. Order confirmed."
+        if card_last4:
+            update_desc += f" Card ending in {card_last4}."
+        return _payment_callback(request, idempotency.SCOPE_CARD, update_desc)
     return HttpResponse(json.dumps({'success': False, 'error': 'Invalid request'}), content_type='application/json')
 
 def order_success(request):
@@ -397,40 +452,8 @@ def tracker(request):
         orderId = request.POST.get('orderId', '')
         email = request.POST.get('email', '')
         try:
-            order = Order.objects.filter(order_id=orderId, email=email)
-            if len(order) > 0:
-                update = OrderUpdate.objects.filter(order__order_id=orderId).order_by('timestamp')
-                updates = []
-                for item in update:
-                    updates.append({
-                        'text': item.update_desc, 
-                        'time': item.timestamp,
-                        'status_type': item.status_type,
-                        'tracking_number': item.tracking_number or '',
-                        'location': item.location or ''
-                    })
-                response = json.dumps({
-                    "status": "success", 
-                    "updates": updates, 
-                    "itemsJson": order[0].item_json,
-                    "order": {
-                        "order_id": order[0].order_id,
-                        "amount": order[0].amount,
-                        "name": order[0].name,
-                        "address": order[0].address,
-                        "city": order[0].city,
-                        "zip_code": order[0].zip_code,
-                        "phone": order[0].phone,
-                        "payment_method": order[0].payment_method,
-                        "payment_status": order[0].payment_status,
-                        "order_status": order[0].order_status,
-                        "tracking_number": order[0].tracking_number or "",
-                        "created_at": str(order[0].created_at) if order[0].created_at else None
-                    }
-                }, default=str)
-                return HttpResponse(response)
-            else:
-                return HttpResponse('{"status":"noitem"}')
+            # Order and updates in one round trip, cached until the next update
+            return HttpResponse(tracker_payload(orderId, email))
         except Exception as e:
             return HttpResponse('{"status":"error"}')
     
@@ -457,6 +480,26 @@ def tracker(request):
         'order_items': order_items,
         'order_id_param': order_id
     })
+
+async def tracker_events(request):
+    """
+    Server-Sent Events stream of new updates for the order a tracker lookup
+    returned (authorised by its signed streamToken). Only served under ASGI
+    with settings.SHOP_TRACKER_STREAM on: WSGI buffers an async streaming
+    response, so there it answers 204, which tells EventSource not to
+    reconnect, and the page keeps polling.
+    """
+    if not settings.SHOP_TRACKER_STREAM or not isinstance(request, ASGIRequest):
+        return HttpResponse(status=204)
+    order_id = stream_order_id(request.GET.get('token', ''))
+    if order_id is None:
+        return HttpResponse(status=403)
+    last_event_id = request.headers.get('Last-Event-ID') or request.GET.get('last_id')
+    response = StreamingHttpResponse(order_event_stream(order_id, last_event_id), content_type='text/event-stream')
+    response['Cache-Control'] = 'no-cache'
+    response['X-Accel-Buffering'] = 'no'
+    return response
+
 def about(request):
      return render(request, 'shop/about.html')
 def contact(request):